@@ -17,12 +17,16 @@ SBOLFactory(
 from labop_submodule import *
 
 from labop.data import *
+from labop.data_export import *
 from labop.decisions import *
 from labop.execution_engine import *
 from labop.execution_engine_utils import *
 from labop.primitive_execution import *
+from labop.read_batching import *
 from labop.sample_maps import *
+from labop.transfer_merging import *
 from labop.ui import *
+from labop.units import *
 from labop.utils import *
 
 
@@ -4,23 +4,34 @@ Functions related to data i/o in connection with a protocol execution trace.
 This file monkey-patches the imported labop classes with data handling functions.
 """
 
+import base64
+import hashlib
 import json
 import logging
 import os
+import struct
+import weakref
+import zlib
 from cmath import nan
+from collections import OrderedDict, namedtuple
 from itertools import islice
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 from urllib.parse import quote, unquote
 
+import numpy as np
 import pandas as pd
 import sbol3
 import xarray as xr
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
 
 import labop
 import uml
 from labop.strings import Strings
-from labop_convert.plate_coordinates import get_sample_list
+from labop_convert.plate_coordinates import (
+    DEFAULT_PLATE_GEOMETRY,
+    PlateGeometry,
+    get_sample_list,
+)
 
 l = logging.getLogger(__file__)
 l.setLevel(logging.ERROR)
@@ -30,9 +41,9 @@ def protocol_execution_set_data(self, dataset):
     """
     Overwrite execution trace values based upon values provided in data
     """
+    sample_data = _document_objects(self.document, dataset.keys())
     for k, v in dataset.items():
-        sample_data = self.document.find(k)
-        sample_data.values = json.dumps(v.to_dict())
+        sample_data[k].values = serialize_sample_format(v)
 
 
 labop.ProtocolExecution.set_data = protocol_execution_set_data
@@ -58,7 +69,114 @@ def protocol_execution_get_data(self):
 labop.ProtocolExecution.get_data = protocol_execution_get_data
 
 
-def sample_array_empty(self, geometry=None, sample_format=Strings.XARRAY):
+# Name of the data template sheet that maps the names of the other sheets to
+# the identities of the SampleData they were written for.
+DATA_SHEET_INDEX = "index"
+
+
+def data_sheet_index(sample_data: Dict[str, str]) -> pd.DataFrame:
+    return pd.DataFrame(
+        {"sheet": list(sample_data.keys()), "data": list(sample_data.values())}
+    )
+
+
+def protocol_execution_load_data_sheets(
+    self, data_file_path, sample_format=Strings.XARRAY
+) -> List[labop.SampleData]:
+    """
+    Load the values filled into a data template workbook into the SampleData
+    of the execution.  The workbook is read in a single pass and each sheet
+    is matched to its SampleData through the index sheet.  Sheets without any
+    values are skipped.
+
+    Returns
+    -------
+    The SampleData objects that were updated
+    """
+    if sample_format != Strings.XARRAY:
+        raise Exception(
+            f"Cannot read sample_format {sample_format} from a data sheet"
+        )
+    sheets = read_data_sheets(data_file_path)
+    if DATA_SHEET_INDEX not in sheets:
+        raise ValueError(
+            f"Data template {data_file_path} has no {DATA_SHEET_INDEX} sheet"
+        )
+    index = sheets[DATA_SHEET_INDEX]
+    index = dict(zip(index["sheet"], index["data"]))
+    sample_data = _document_objects(self.document, index.values())
+    missing = [
+        sheet for sheet, data in index.items() if data not in sample_data
+    ]
+    if missing:
+        raise ValueError(f"Cannot find SampleData for data sheets {missing}")
+
+    updated = []
+    for sheet_name, data in index.items():
+        sd = sample_data[data]
+        values = _data_sheet_values(
+            sheets[sheet_name], sd.to_data_array(), sheet_name
+        )
+        if values is not None:
+            # Keep large values that are stored externally out of the
+            # document, next to the values they replace
+            if sd.values and sd.values.startswith(EXTERNAL_ENCODING_TAG):
+                header = json.loads(
+                    unquote(sd.values[len(EXTERNAL_ENCODING_TAG) :])
+                )
+                data_dir = os.path.dirname(
+                    _external_data_path(header["file"], sd.document)
+                )
+                sd.values = serialize_sample_format(
+                    values, encoding=Strings.NPY, data_dir=data_dir
+                )
+            else:
+                sd.values = serialize_sample_format(values)
+            updated.append(sd)
+    return updated
+
+
+labop.ProtocolExecution.load_data_sheets = protocol_execution_load_data_sheets
+
+
+def _data_sheet_values(
+    sheet: pd.DataFrame, template: xr.DataArray, sheet_name: str
+) -> xr.DataArray:
+    """
+    Get the values of a data sheet in the shape of the template array, or None
+    if the sheet has no values.  The sheet has a column for each dimension of
+    the template, followed by a column of values.
+    """
+    dims = list(template.dims)
+    value_columns = [c for c in sheet.columns if c not in dims]
+    if len(value_columns) != 1 or len(sheet) != template.size:
+        raise ValueError(
+            f"Data sheet {sheet_name} does not match the shape {dict(template.sizes)} of its SampleData"
+        )
+    values = sheet[value_columns[0]].to_numpy()
+    if pd.isnull(values).all():
+        return None
+
+    # Position of each row of the sheet in the template
+    positions = np.stack(
+        [template.get_index(dim).get_indexer(sheet[dim]) for dim in dims]
+    )
+    if (positions < 0).any() or len(
+        np.unique(np.ravel_multi_index(positions, template.shape))
+    ) != len(sheet):
+        raise ValueError(
+            f"Data sheet {sheet_name} does not list the samples of its SampleData"
+        )
+    data = np.empty(template.shape, dtype=values.dtype)
+    data[tuple(positions)] = values
+    return template.copy(data=data)
+
+
+def sample_array_empty(
+    self,
+    geometry: Union[str, PlateGeometry] = None,
+    sample_format=Strings.XARRAY,
+):
     samples = get_sample_list(geometry) if geometry else []
 
     if sample_format == Strings.XARRAY:
@@ -103,19 +221,16 @@ def sample_array_mask(self, mask, sample_format=Strings.XARRAY):
     elif sample_format == Strings.XARRAY:
         initial_contents_array = self.to_data_array(sample_format=sample_format)
         if isinstance(mask, labop.SampleMask):
-            masked_array = mask.to_data_array(sample_format=sample_format)
+            mask_array = mask.to_data_array(sample_format=sample_format)
         else:
-            mask_coordinates = get_sample_list(mask)
-            mask_array = xr.DataArray(
-                [
-                    m in mask_coordinates
-                    for m in initial_contents_array[Strings.SAMPLE].data
-                ],
-                name="mask",
-                dims=("sample"),
-                coords={"sample": initial_contents_array[Strings.SAMPLE].data},
-            )
-            masked_array = initial_contents_array.where(mask_array, drop=True)
+            mask_array = self.coordinate_mask(mask)
+        selected = np.isin(
+            initial_contents_array[Strings.SAMPLE].data,
+            _masked_samples(mask_array),
+        )
+        masked_array = initial_contents_array.isel(
+            {Strings.SAMPLE: np.flatnonzero(selected)}
+        )
         return masked_array
     else:
         raise Exception(
@@ -126,6 +241,52 @@ def sample_array_mask(self, mask, sample_format=Strings.XARRAY):
 labop.SampleArray.mask = sample_array_mask
 
 
+def sample_array_coordinate_mask(self, coordinates) -> xr.DataArray:
+    """
+    Create a boolean mask over the samples of the SampleArray that is True
+    for the samples in coordinates, e.g., "A1:B6,C3".
+    """
+    samples = self.to_data_array()[Strings.SAMPLE].data
+    return xr.DataArray(
+        np.isin(samples, get_sample_list(coordinates)),
+        name="mask",
+        dims=(Strings.SAMPLE),
+        coords={Strings.SAMPLE: samples},
+    )
+
+
+labop.SampleArray.coordinate_mask = sample_array_coordinate_mask
+
+
+def _masked_samples(mask_array: xr.DataArray) -> np.ndarray:
+    """
+    Get the samples selected by a boolean mask array.
+    """
+    return mask_array[Strings.SAMPLE].data[mask_array.data]
+
+
+def _is_boolean_mask(mask_array: xr.DataArray) -> bool:
+    return mask_array.dtype == bool and mask_array.dims == (Strings.SAMPLE,)
+
+
+def _from_legacy_mask(
+    source: labop.SampleCollection, mask_array: xr.DataArray
+) -> xr.DataArray:
+    """
+    Convert a mask written before masks were stored as booleans.  Such a mask
+    holds the contents of the selected samples, whatever their type and
+    dimensions, and no other samples, so the samples are selected by their
+    coordinates.
+    """
+    samples = source.to_data_array()[Strings.SAMPLE].data
+    return xr.DataArray(
+        np.isin(samples, mask_array[Strings.SAMPLE].data),
+        name=mask_array.name,
+        dims=(Strings.SAMPLE),
+        coords={Strings.SAMPLE: samples},
+    )
+
+
 def sample_array_from_dict(self, initial_contents: dict):
     if self.sample_format == "json":
         self.initial_contents = serialize_sample_format(initial_contents)
@@ -164,7 +325,7 @@ def sample_mask_empty(self, sample_format=Strings.XARRAY):
         source_samples = self.source.lookup()
         sample_array = source_samples.to_data_array(sample_format=sample_format)
         mask_array = xr.DataArray(
-            [True] * len(sample_array[Strings.SAMPLE]),
+            np.ones(len(sample_array[Strings.SAMPLE]), dtype=bool),
             name=self.identity,
             dims=(Strings.SAMPLE),
             coords={Strings.SAMPLE: sample_array.coords[Strings.SAMPLE].data},
@@ -183,6 +344,8 @@ def sample_mask_to_data_array(self, sample_format=Strings.XARRAY):
         sample_mask = self.empty(sample_format=sample_format)
     else:
         sample_mask = deserialize_sample_format(self.mask, parent=self)
+        if not _is_boolean_mask(sample_mask):
+            sample_mask = _from_legacy_mask(self.source.lookup(), sample_mask)
     return sample_mask
 
 
@@ -204,19 +367,32 @@ def sample_mask_from_coordinates(
     sample_format=Strings.XARRAY,
 ):
     mask = labop.SampleMask(source=source)
-    mask_array = source.mask(coordinates, sample_format=sample_format)
-    mask_array.name = mask.identity
-    mask.mask = serialize_sample_format(mask_array)
+    if sample_format == Strings.XARRAY:
+        mask_array = source.coordinate_mask(coordinates)
+    else:
+        mask_array = source.mask(coordinates, sample_format=sample_format)
+    mask.set_mask(mask_array)
     return mask
 
 
 labop.SampleMask.from_coordinates = sample_mask_from_coordinates
 
 
+def sample_mask_set_mask(self, mask_array: xr.DataArray):
+    """
+    Store a boolean mask array over the samples of the mask source.
+    """
+    mask_array = mask_array.copy(deep=False)
+    mask_array.name = self.identity
+    self.mask = serialize_sample_format(mask_array)
+
+
+labop.SampleMask.set_mask = sample_mask_set_mask
+
+
 def sample_mask_get_coordinates(self, sample_format=Strings.XARRAY):
     if sample_format == "xarray":
-        mask = self.to_data_array()
-        return [c for c in mask[Strings.SAMPLE].data if mask.loc[c]]
+        return _masked_samples(self.to_data_array()).tolist()
     elif sample_format == "json":
         return json.loads(deserialize_sample_format(self.mask)).keys()
 
@@ -224,6 +400,55 @@ def sample_mask_get_coordinates(self, sample_format=Strings.XARRAY):
 labop.SampleMask.get_coordinates = sample_mask_get_coordinates
 
 
+def _combine_masks(self, other, operation) -> labop.SampleMask:
+    if self.source != other.source:
+        raise ValueError(
+            f"Cannot combine SampleMasks with different sources: {self.source} and {other.source}"
+        )
+    self_array, other_array = xr.align(
+        self.to_data_array(),
+        other.to_data_array(),
+        join="outer",
+        fill_value=False,
+    )
+    combined = labop.SampleMask(source=self.source)
+    combined.set_mask(operation(self_array, other_array))
+    return combined
+
+
+def sample_mask_union(self, other: labop.SampleMask) -> labop.SampleMask:
+    """
+    Create a SampleMask that selects the samples selected by either mask.
+    """
+    return _combine_masks(self, other, np.logical_or)
+
+
+labop.SampleMask.union = sample_mask_union
+
+
+def sample_mask_intersection(self, other: labop.SampleMask) -> labop.SampleMask:
+    """
+    Create a SampleMask that selects the samples selected by both masks.
+    """
+    return _combine_masks(self, other, np.logical_and)
+
+
+labop.SampleMask.intersection = sample_mask_intersection
+
+
+def sample_mask_complement(self) -> labop.SampleMask:
+    """
+    Create a SampleMask that selects the samples of the source that are not
+    selected by this mask.
+    """
+    complement = labop.SampleMask(source=self.source)
+    complement.set_mask(~self.to_data_array())
+    return complement
+
+
+labop.SampleMask.complement = sample_mask_complement
+
+
 def sample_array_get_coordinates(self, sample_format=Strings.XARRAY):
     if sample_format == Strings.JSON:
         return self.to_dict(Strings.JSON).values()
@@ -240,11 +465,7 @@ labop.SampleArray.get_coordinates = sample_array_get_coordinates
 def sample_array_from_coordinates(
     source: labop.SampleCollection, coordinates: str, sample_type=Strings.XARRAY
 ):
-    mask = labop.SampleMask(source=source)
-    mask_array = source.mask(coordinates)
-    mask_array.name = mask.identity
-    mask.mask = serialize_sample_format(mask_array)
-    return mask
+    return labop.SampleMask.from_coordinates(source, coordinates)
 
 
 labop.SampleArray.from_coordinates = sample_array_from_coordinates
@@ -254,15 +475,7 @@ def sample_array_from_container_spec(
     container_type: labop.ContainerSpec, sample_format=Strings.XARRAY
 ):
     sample_array = labop.SampleArray(container_type=container_type)
-
-    if (
-        container_type.queryString
-        == "cont:Opentrons24TubeRackwithEppendorf1.5mLSafe-LockSnapcap"
-    ):
-        geometry = "A1:C8"
-    else:
-        geometry = "A1:H12"
-
+    geometry = PlateGeometry.from_container_spec(container_type)
     initial_contents = sample_array.empty(
         geometry=geometry, sample_format=sample_format
     )
@@ -273,6 +486,19 @@ def sample_array_from_container_spec(
 labop.SampleArray.from_container_spec = sample_array_from_container_spec
 
 
+def sample_array_geometry(self) -> PlateGeometry:
+    """
+    Get the PlateGeometry of the container holding the SampleArray.
+    """
+    container_type = (
+        self.container_type.lookup() if self.container_type else None
+    )
+    return PlateGeometry.from_container_spec(container_type)
+
+
+labop.SampleArray.geometry = sample_array_geometry
+
+
 def sample_data_empty(self: labop.SampleData, sample_format=Strings.XARRAY):
     if sample_format == "xarray":
         from_samples = self.from_samples.lookup()
@@ -303,6 +529,75 @@ def sample_data_to_data_array(self, sample_format=Strings.XARRAY):
 labop.SampleData.to_data_array = sample_data_to_data_array
 
 
+def sample_data_append(
+    self: labop.SampleData,
+    measurements: Union[xr.DataArray, List[xr.DataArray]],
+    time=None,
+):
+    """
+    Append the reads of one or more timepoints to a kinetic SampleData, whose
+    values have dimensions (time, sample).  The reads are encoded as new
+    chunks of the values, which are only joined to the chunks already stored
+    when the values are next used, so each call takes time proportional to
+    the reads appended.
+
+    Parameters
+    ----------
+    measurements : xr.DataArray or list of xr.DataArray
+        Reads with a time dimension, or reads of a single timepoint.
+    time : optional
+        Timepoint of the reads, if measurements is a single DataArray with no
+        time dimension.
+    """
+    if isinstance(measurements, xr.DataArray):
+        if time is not None:
+            measurements = measurements.expand_dims(
+                {Strings.TIME: np.atleast_1d(time)}
+            )
+        measurements = [measurements]
+    if any(Strings.TIME not in m.dims for m in measurements):
+        raise ValueError(
+            f"Cannot append measurements without a {Strings.TIME} dimension to SampleData"
+        )
+    pending = self.__dict__.get("_pending_chunks")
+    if pending is None:
+        values = _stored_literal(self, "values")
+        if values and not values.startswith(BINARY_ENCODING_TAG):
+            # Legacy encodings cannot be chunked, so encode all of the reads
+            # again
+            self.values = serialize_sample_format(
+                xr.concat(
+                    [deserialize_sample_format(values)] + measurements,
+                    dim=Strings.TIME,
+                )
+            )
+            return
+        pending = [values] if values else []
+    pending += [serialize_sample_format(m) for m in measurements]
+    self.__dict__["_pending_chunks"] = pending
+
+
+labop.SampleData.append = sample_data_append
+
+_sbol_getattribute = labop.SampleData.__getattribute__
+
+
+def sample_data_getattribute(self: labop.SampleData, name: str):
+    # Join the chunks appended since the values were last used, including by
+    # serialization, which reads the properties directly
+    if name in ("values", "_properties"):
+        pending = _sbol_getattribute(self, "__dict__").pop(
+            "_pending_chunks", None
+        )
+        if pending:
+            self.values = CHUNK_SEPARATOR.join(pending)
+    return _sbol_getattribute(self, name)
+
+
+labop.SampleData.__getattribute__ = sample_data_getattribute
+labop.SampleData.append = sample_data_append
+
+
 def sample_data_from_table(self, table: List[List[Dict[str, str]]]):
     """Convert from LabOPED table to SampleData
 
@@ -389,12 +684,12 @@ labop.SampleArray.plot = sample_array_plot
 def sample_array_sample_coordinates(self, sample_format=Strings.XARRAY):
     sample_array = deserialize_sample_format(self.initial_contents, parent=self)
     if sample_format == Strings.XARRAY:
-        coords = sample_array.coords[Strings.SAMPLE].data.tolist()
-        plate_coords = get_sample_list("A1:H12")
-        if all([c in coords for c in plate_coords]):
-            return "A1:H12"
+        coords = sample_array.coords[Strings.SAMPLE].data
+        geometry = self.geometry()
+        if np.isin(geometry.wells, coords).all():
+            return geometry.rectangle
         else:
-            return coords
+            return coords.tolist()
     else:
         return sample_array
 
@@ -433,7 +728,7 @@ labop.SampleArray.to_dot = sample_array_to_dot
 
 
 def sample_metadata_to_dataarray(self: labop.SampleMetadata):
-    return xr.DataArray.from_dict(json.loads(self.descriptions))
+    return deserialize_sample_format(self.descriptions, parent=self)
 
 
 labop.SampleMetadata.to_dataarray = sample_metadata_to_dataarray
@@ -531,7 +826,16 @@ def sample_metadata_for_primitive(
     if sample_format == Strings.XARRAY:
         sample_array = for_samples.to_data_array()
 
-        # Create new metadata for each input to primitive, aside from for_samples
+        # Create new metadata for each input to primitive, aside from
+        # for_samples and multi-valued inputs (e.g., the timepoints of a
+        # kinetic measurement, which are coordinates of its data).  An input
+        # map holds a single value of a multi-valued input as a scalar, so
+        # they are found from the parameters of the primitive.
+        multi_valued = {
+            p.property_value.name
+            for p in primitive.parameters
+            if p.property_value.upper_value is None
+        }
         inputs_meta = {
             k: xr.DataArray(
                 [v.identity] * len(sample_array.coords[Strings.SAMPLE]),
@@ -540,6 +844,8 @@ def sample_metadata_for_primitive(
             )
             for k, v in inputs.items()
             if v != for_samples
+            and k not in multi_valued
+            and not isinstance(v, list)
         }
 
         metadata_dataset = xr.Dataset(inputs_meta, coords=sample_array.coords)
@@ -563,8 +869,42 @@ def sample_metadata_for_primitive(
 labop.SampleMetadata.for_primitive = sample_metadata_for_primitive
 
 
+# Bounded LRU cache of merged datasets, keyed by a fingerprint of the Dataset
+# and the serialized data and metadata it was merged from, so that editing any
+# part of a Dataset, or of its nested datasets, invalidates the merge.  Cached
+# datasets are read-only, and callers receive shallow copies.
+dataset_cache_size = 64
+_dataset_cache = OrderedDict()
+_dataset_cache_stats = {"hits": 0, "misses": 0}
+
+DatasetCacheInfo = namedtuple(
+    "DatasetCacheInfo", ["hits", "misses", "maxsize", "currsize"]
+)
+
+
+def clear_dataset_cache():
+    _dataset_cache.clear()
+    _dataset_cache_stats.update(hits=0, misses=0)
+
+
+def dataset_cache_info() -> DatasetCacheInfo:
+    """
+    Get the hits and misses of the cache of merged datasets since it was
+    last cleared, and its size.
+    """
+    return DatasetCacheInfo(
+        _dataset_cache_stats["hits"],
+        _dataset_cache_stats["misses"],
+        dataset_cache_size,
+        len(_dataset_cache),
+    )
+
+
 def dataset_to_dataset(
-    self: labop.Dataset, sample_format=Strings.XARRAY, humanize=False
+    self: labop.Dataset,
+    sample_format=Strings.XARRAY,
+    humanize=False,
+    chunks=None,
 ):
     """
     Join the self.data and self.metadata into a single xarray dataset.
@@ -573,47 +913,208 @@ def dataset_to_dataset(
     ----------
     self : labop.Dataset
         Dataset comprising data and metadata.
+    chunks : dict, optional
+        Chunk sizes (e.g., {"sample": 384}) for a lazy, dask-backed merge of
+        large multi-plate datasets.  Requires dask.
+    """
+    ds = _merge_dataset(self, sample_format, chunks, {})
+    if humanize:
+        ds = self.humanize(dataset=ds, sample_format=sample_format)
+    return ds
+
+
+def _merge_dataset(
+    dataset: labop.Dataset, sample_format, chunks, fingerprints: Dict
+) -> xr.Dataset:
+    """
+    Merge a Dataset, reusing the cached merge of each nested Dataset.
+    Datasets shared by several parents are fingerprinted once per call.
     """
+    key = _dataset_fingerprint(dataset, sample_format, chunks, fingerprints)
+    cached = _dataset_cache.get(key) if key is not None else None
+    if cached is not None:
+        _dataset_cache_stats["hits"] += 1
+        _dataset_cache.move_to_end(key)
+        return cached.copy(deep=False)
+    _dataset_cache_stats["misses"] += 1
+
     data = (
-        [self.data.to_data_array(sample_format=sample_format)]
-        if self.data
+        [dataset.data.to_data_array(sample_format=sample_format)]
+        if dataset.data
         else []
     )
     datasets = (
         [
-            d.lookup().to_dataset(sample_format=sample_format)
-            for d in self.dataset
+            _merge_dataset(d.lookup(), sample_format, chunks, fingerprints)
+            for d in dataset.dataset
         ]
-        if self.dataset
+        if dataset.dataset
         else []
     )
     metadata = (
-        [m.to_data_array(sample_format=sample_format) for m in self.metadata]
-        if self.metadata
+        [m.to_data_array(sample_format=sample_format) for m in dataset.metadata]
+        if dataset.metadata
         else []
     )
     linked_metadata = (
         [
             m.lookup().to_data_array(sample_format=sample_format)
-            for m in self.linked_metadata
+            for m in dataset.linked_metadata
         ]
-        if self.linked_metadata
+        if dataset.linked_metadata
         else []
     )
+    if chunks is not None:
+        data, metadata, linked_metadata = (
+            [x.chunk(_dim_chunks(x, chunks)) for x in arrays]
+            for arrays in (data, metadata, linked_metadata)
+        )
     to_merge = data + metadata + datasets + linked_metadata
     ds = xr.merge(to_merge)
-    if humanize:
-        ds = self.humanize(dataset=ds, sample_format=sample_format)
+
+    if key is not None and dataset_cache_size > 0:
+        _set_read_only(ds)
+        _dataset_cache[key] = ds
+        while len(_dataset_cache) > dataset_cache_size:
+            _dataset_cache.popitem(last=False)
+        return ds.copy(deep=False)
     return ds
 
 
+def _dataset_fingerprint(
+    dataset: labop.Dataset, sample_format, chunks, fingerprints: Dict
+):
+    """
+    Get a hashable fingerprint of the serialized contents of a Dataset, or
+    None if some part of it is not serialized yet and cannot be cached.
+    """
+    if dataset.identity in fingerprints:
+        return fingerprints[dataset.identity]
+
+    def payload(obj, attribute):
+        digest = _payload_digest(obj, attribute)
+        return (obj.identity, digest) if digest is not None else None
+
+    parts = ([payload(dataset.data, "values")] if dataset.data else []) + [
+        payload(m, "descriptions") for m in dataset.metadata
+    ]
+    parts += [
+        payload(m.lookup(), "descriptions") for m in dataset.linked_metadata
+    ]
+    parts += [
+        _dataset_fingerprint(d.lookup(), sample_format, chunks, fingerprints)
+        for d in dataset.dataset
+    ]
+    if any(part is None for part in parts):
+        fingerprint = None
+    else:
+        chunk_key = tuple(sorted(chunks.items())) if chunks else chunks
+        fingerprint = (dataset.identity, sample_format, chunk_key, tuple(parts))
+    fingerprints[dataset.identity] = fingerprint
+    return fingerprint
+
+
+def _stored_literal(obj, attribute) -> Optional[str]:
+    """
+    Get the stored value of a text property of obj, without the copy that
+    getting the property makes, or None if it is not set.
+    """
+    prop = object.__getattribute__(obj, attribute)
+    literals = prop._storage().get(prop.property_uri)
+    return literals[0] if literals else None
+
+
+def _payload_digest(obj, attribute) -> Optional[str]:
+    """
+    Get a digest of the serialized value of a text property of obj, so that
+    fingerprints do not keep the value alive, or None if it is not set.  The
+    digest is memoized on obj with the stored literal that it was taken
+    from, and only computed again once the property is set to a new value.
+    """
+    literal = _stored_literal(obj, attribute)
+    if not literal:
+        return None
+    digests = obj.__dict__.setdefault("_payload_digests", {})
+    if attribute not in digests or digests[attribute][0] is not literal:
+        digests[attribute] = (
+            literal,
+            hashlib.sha1(literal.encode()).hexdigest(),
+        )
+    return digests[attribute][1]
+
+
+def _dim_chunks(data: Union[xr.DataArray, xr.Dataset], chunks: Dict) -> Dict:
+    # Only chunk the dimensions present, as DataArray.chunk() rejects others
+    return {dim: size for dim, size in chunks.items() if dim in data.dims}
+
+
 labop.Dataset.to_dataset = dataset_to_dataset
 
 
-def serialize_sample_format(data):
-    data_str = None
+# Serialized xarray payloads starting with this tag use the compact binary
+# encoding: base64 of a zlib-compressed blob holding a 4 byte header length, a
+# JSON header describing each variable, and the raw variable buffers.  Bump the
+# version in the tag whenever the layout of the blob changes.
+BINARY_ENCODING_TAG = "labop-xarray-v1:"
+
+# Kinetic SampleData values are a sequence of binary payloads separated by
+# CHUNK_SEPARATOR (which base64 never produces), each holding the reads of one
+# or more timepoints.  The payloads are decoded and concatenated along time.
+CHUNK_SEPARATOR = " "
+
+# Serialized payloads starting with this tag keep the values of an
+# xr.DataArray in an .npy file, which is memory-mapped when deserialized so
+# that slicing (e.g., a wavelength range of a spectrum) reads only the slice.
+# The payload holds the file name and the binary encoding of the coordinates.
+# Files are named by the hash of their contents and are never modified, and
+# are looked up in the external data directories of the document holding the
+# payload (see add_external_data_dir()).
+EXTERNAL_ENCODING_TAG = "labop-npy-v1:"
+
+
+def add_external_data_dir(document: sbol3.Document, data_dir: str):
+    """
+    Look up the files of the external sample data of document in data_dir,
+    e.g., after reading a document whose data were stored in data_dir.
+    """
+    data_dirs = getattr(document, "external_data_dirs", [])
+    if data_dir not in data_dirs:
+        document.external_data_dirs = data_dirs + [data_dir]
+
+
+# numpy dtype kinds that can be stored as raw buffers.  Everything else (e.g.,
+# object arrays read from Excel) is stored as a JSON list in the header.
+_BUFFER_DTYPE_KINDS = "biufcmMSU"
+
+
+def serialize_sample_format(data, encoding=Strings.BINARY, data_dir=None):
+    """
+    Serialize sample data so that it can be stored in a string property, such
+    as SampleArray.initial_contents or SampleData.values.
+
+    Parameters
+    ----------
+    data : Union[xr.DataArray, xr.Dataset, Dict]
+        Data to serialize.  Dicts are always serialized as JSON.
+    encoding : str, optional
+        Strings.BINARY (default) for the compact binary encoding of xarray
+        objects, Strings.NPY to store the values of a large xr.DataArray in an
+        .npy file under data_dir, or Strings.JSON for the legacy JSON
+        encoding.
+    data_dir : str, optional
+        Directory of the .npy files, required by Strings.NPY.
+    """
     if isinstance(data, xr.DataArray) or isinstance(data, xr.Dataset):
-        data_dict = data.to_dict()
+        if encoding == Strings.BINARY:
+            return _encode_binary(data)
+        elif encoding == Strings.NPY:
+            return _encode_external(data, data_dir)
+        elif encoding == Strings.JSON:
+            data_dict = data.to_dict()
+        else:
+            raise Exception(
+                f"Cannot serialize sample_format with encoding: {encoding}"
+            )
     elif isinstance(data, Dict):
         data_dict = data
     else:
@@ -622,7 +1123,64 @@ def serialize_sample_format(data):
     return quote(json.dumps(data_dict))
 
 
+# Bounded LRU cache of deserialized xarray payloads, keyed by the identity of
+# the object holding the payload and the payload itself.  Cached objects are
+# read-only; callers receive shallow copies, so they may rename or reassign
+# coordinates freely, but must copy() before modifying values in place.
+sample_format_cache_size = 256
+_sample_format_cache = OrderedDict()
+
+
+def clear_sample_format_cache():
+    _sample_format_cache.clear()
+
+
 def deserialize_sample_format(data: str, parent: sbol3.Identified = None):
+    key = (parent.identity if parent else None, data)
+    cached = _sample_format_cache.get(key)
+    if cached is not None:
+        _sample_format_cache.move_to_end(key)
+        return cached.copy(deep=False)
+
+    deserialized = _deserialize_sample_format(data, parent=parent)
+    # External payloads are memory-mapped, and name files that are looked up
+    # by the document, so they are not cached
+    if (
+        sample_format_cache_size > 0
+        and not data.startswith(EXTERNAL_ENCODING_TAG)
+        and (
+            isinstance(deserialized, xr.DataArray)
+            or isinstance(deserialized, xr.Dataset)
+        )
+    ):
+        _set_read_only(deserialized)
+        _sample_format_cache[key] = deserialized
+        while len(_sample_format_cache) > sample_format_cache_size:
+            _sample_format_cache.popitem(last=False)
+        return deserialized.copy(deep=False)
+    return deserialized
+
+
+def _deserialize_sample_format(data: str, parent: sbol3.Identified = None):
+    if data.startswith(EXTERNAL_ENCODING_TAG):
+        try:
+            xarray_data = _decode_external(
+                data, parent.document if parent else None
+            )
+        except Exception as e:
+            raise Exception(f"Could not load external sample format: {e}")
+        return _set_parent_identity(xarray_data, parent)
+
+    if data.startswith(BINARY_ENCODING_TAG):
+        try:
+            xarray_data = _decode_chunks(data)
+        except Exception as e:
+            raise Exception(f"Could not decode binary sample format: {e}")
+        return sort_samples(
+            _set_parent_identity(xarray_data, parent),
+            sample_format=Strings.XARRAY,
+        )
+
     try:
         json_data = json.loads(unquote(data))
         try:
@@ -642,78 +1200,285 @@ def deserialize_sample_format(data: str, parent: sbol3.Identified = None):
         raise Exception(f"Could not determine format of data: {e}")
 
 
-def sort_samples(data, sample_format=Strings.XARRAY):
+def _set_read_only(data: Union[xr.DataArray, xr.Dataset]):
+    variables = list(data.coords.variables.values())
+    if isinstance(data, xr.DataArray):
+        variables.append(data.variable)
+    else:
+        variables += list(data.data_vars.variables.values())
+    for variable in variables:
+        if isinstance(variable.data, np.ndarray):
+            variable.data.flags.writeable = False
+
+
+def _set_parent_identity(data, parent: sbol3.Identified = None):
+    if parent:
+        if isinstance(data, xr.DataArray):
+            data.name = parent.identity
+        elif Strings.SOURCE in data.coords:
+            data.coords[Strings.SOURCE] = [parent.identity]
+    return data
+
 
+def _encode_variable(variable: xr.Variable, buffers: List[bytes], offset: int):
+    values = variable.values
+    header = {
+        "dims": list(variable.dims),
+        "attrs": variable.attrs,
+        "dtype": values.dtype.str,
+        "shape": list(values.shape),
+    }
+    if values.dtype.kind in _BUFFER_DTYPE_KINDS:
+        buffer = np.ascontiguousarray(values).tobytes()
+        header["offset"] = offset
+        buffers.append(buffer)
+        offset += len(buffer)
+    else:
+        header["data"] = values.tolist()
+    return header, offset
+
+
+def _decode_variable(header: dict, body: memoryview) -> xr.Variable:
+    shape = tuple(header["shape"])
+    if "data" in header:
+        values = np.empty(shape, dtype=object)
+        values[...] = header["data"]
+    else:
+        dtype = np.dtype(header["dtype"])
+        count = int(np.prod(shape))
+        values = (
+            np.frombuffer(
+                body, dtype=dtype, count=count, offset=header["offset"]
+            )
+            if count > 0
+            else np.empty(0, dtype=dtype)
+        ).reshape(shape)
+    return xr.Variable(header["dims"], values, attrs=header["attrs"])
+
+
+def _encode_binary(data: Union[xr.DataArray, xr.Dataset]) -> str:
+    buffers = []
+    offset = 0
+    header = {"type": type(data).__name__, "attrs": data.attrs, "coords": {}}
+    for name, coord in data.coords.items():
+        header["coords"][name], offset = _encode_variable(
+            coord.variable, buffers, offset
+        )
+    if isinstance(data, xr.DataArray):
+        header["name"] = data.name
+        header["data"], offset = _encode_variable(
+            data.variable, buffers, offset
+        )
+    else:
+        header["data_vars"] = {}
+        for name, var in data.data_vars.items():
+            header["data_vars"][name], offset = _encode_variable(
+                var.variable, buffers, offset
+            )
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    blob = (
+        struct.pack("<I", len(header_bytes)) + header_bytes + b"".join(buffers)
+    )
+    return BINARY_ENCODING_TAG + base64.b64encode(zlib.compress(blob)).decode(
+        "ascii"
+    )
+
+
+def _encode_external(data: xr.DataArray, data_dir: str) -> str:
+    if not isinstance(data, xr.DataArray):
+        raise Exception(
+            f"Cannot serialize {type(data)} with encoding: {Strings.NPY}"
+        )
+    if data_dir is None:
+        raise Exception(f"Encoding {Strings.NPY} needs a data_dir")
+    # Store samples in sorted order, so that deserializing does not reorder
+    # (and read) the whole file
+    data = sort_samples(data, sample_format=Strings.XARRAY)
+    values = np.ascontiguousarray(data.values)
+    if values.dtype.kind not in _BUFFER_DTYPE_KINDS:
+        raise Exception(
+            f"Cannot serialize dtype {values.dtype} with encoding: {Strings.NPY}"
+        )
+    digest = hashlib.sha1(values.tobytes())
+    digest.update(f"{values.dtype.str}{values.shape}".encode("utf-8"))
+    filename = f"{digest.hexdigest()}.npy"
+    path = os.path.join(data_dir, filename)
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        np.save(path, values)
+
+    header = {
+        "name": data.name,
+        "attrs": data.attrs,
+        "dims": list(data.dims),
+        "file": filename,
+        "coords": _encode_binary(xr.Dataset(coords=data.coords)),
+    }
+    return EXTERNAL_ENCODING_TAG + quote(json.dumps(header))
+
+
+def _decode_external(
+    data: str, document: sbol3.Document = None
+) -> xr.DataArray:
+    header = json.loads(unquote(data[len(EXTERNAL_ENCODING_TAG) :]))
+    coords = _decode_binary(header["coords"]).coords
+    return xr.DataArray(
+        np.load(_external_data_path(header["file"], document), mmap_mode="r"),
+        dims=header["dims"],
+        coords=coords,
+        name=header["name"],
+        attrs=header["attrs"],
+    )
+
+
+def _external_data_path(filename: str, document: sbol3.Document = None) -> str:
+    data_dirs = getattr(document, "external_data_dirs", []) if document else []
+    for data_dir in data_dirs:
+        path = os.path.join(data_dir, filename)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(
+        f"Cannot find {filename} in the external data directories {data_dirs}, see add_external_data_dir()"
+    )
+
+
+def _decode_chunks(data: str) -> Union[xr.DataArray, xr.Dataset]:
+    chunks = data.split(CHUNK_SEPARATOR)
+    if len(chunks) == 1:
+        return _decode_binary(data)
+    return xr.concat(
+        [_decode_binary(chunk) for chunk in chunks],
+        dim=Strings.TIME,
+        coords="minimal",
+        compat="override",
+    )
+
+
+def _decode_binary(data: str) -> Union[xr.DataArray, xr.Dataset]:
+    blob = bytearray(
+        zlib.decompress(base64.b64decode(data[len(BINARY_ENCODING_TAG) :]))
+    )
+    (header_length,) = struct.unpack_from("<I", blob)
+    header = json.loads(blob[4 : 4 + header_length].decode("utf-8"))
+    body = memoryview(blob)[4 + header_length :]
+
+    coords = {
+        name: _decode_variable(coord, body)
+        for name, coord in header["coords"].items()
+    }
+    if header["type"] == "DataArray":
+        return xr.DataArray(
+            _decode_variable(header["data"], body),
+            coords=coords,
+            name=header["name"],
+            attrs=header["attrs"],
+        )
+    elif header["type"] == "Dataset":
+        data_vars = {
+            name: _decode_variable(var, body)
+            for name, var in header["data_vars"].items()
+        }
+        return xr.Dataset(data_vars, coords=coords, attrs=header["attrs"])
+    else:
+        raise ValueError(f"Unknown xarray type: {header['type']}")
+
+
+def sort_samples(
+    data, sample_format=Strings.XARRAY, geometry: PlateGeometry = None
+):
     if sample_format == Strings.XARRAY:
         if Strings.SAMPLE in data.coords:
-            data = (
-                data.assign_coords(
-                    samplez=(
-                        "sample",
-                        [
-                            (f"{s[:1]}0{s[1:]}" if len(s) == 2 else s)
-                            for s in data.coords["sample"].data
-                        ],
-                    )
-                )
-                .sortby("samplez")
-                .reset_coords("samplez", drop=True)
-            )
+            geometry = geometry if geometry else DEFAULT_PLATE_GEOMETRY
+            data = geometry.sort(data, dim=Strings.SAMPLE)
     return data
 
 
 def sample_data_update_data_sheet(
     self, data_file_path, sheet_name, sample_format=Strings.XARRAY
 ):
+    sheets = read_data_sheets(data_file_path)
+    data_sheet = self.to_data_sheet(
+        existing_sheet=sheets.get(sheet_name), sample_format=sample_format
+    )
+    if data_sheet is not None:
+        sheets[sheet_name] = data_sheet
+        write_data_sheets(data_file_path, sheets)
+
+
+labop.SampleData.update_data_sheet = sample_data_update_data_sheet
+
+
+def read_data_sheets(data_file_path) -> Dict[str, pd.DataFrame]:
+    """
+    Read every sheet of a data template workbook with a single load, or
+    return an empty dict if the workbook does not exist.
+    """
+    if not os.path.exists(data_file_path):
+        return {}
+    return pd.read_excel(data_file_path, sheet_name=None)
+
+
+def write_data_sheets(data_file_path, sheets: Dict[str, pd.DataFrame]):
+    """
+    Write all sheets of a data template workbook at once, streaming the rows
+    of each sheet through a write-only workbook.  The first row of each sheet
+    holds the column names.
+    """
+    wb = Workbook(write_only=True)
+    for sheet_name, sheet in sheets.items():
+        ws = wb.create_sheet(title=sheet_name)
+        ws.append([str(c) for c in sheet.columns])
+        values = sheet.astype(object).where(sheet.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            ws.append(row)
+    wb.save(data_file_path)
+
+
+def sample_data_to_data_sheet(
+    self, existing_sheet: pd.DataFrame = None, sample_format=Strings.XARRAY
+):
+    """
+    Get the data template sheet for the SampleData.  If existing_sheet holds
+    data filled in for the samples, then load the data into self.values and
+    return None, so that the existing sheet is kept.
+    """
     sample_array = self.humanize(sample_format=sample_format)
 
     if sample_format == Strings.XARRAY:
         # Check whether data exists in the data template, and load it
-        changed = False
-        if os.path.exists(data_file_path):
+        if existing_sheet is not None:
             try:
-                data_df = pd.read_excel(data_file_path, sheet_name=sheet_name)
                 # Assume that first column is the sample index
-                data_df = data_df.set_index(data_df.columns[0])
-                if sample_format == Strings.XARRAY:
-                    # Convert pd.DataFrame into xr.DataArray
-                    sample_data_array = xr.Dataset.from_dataframe(data_df)[
-                        sample_array.name
-                    ]
-
-                    changed = not (
-                        (
-                            sample_array.isnull().all()
-                            and sample_data_array.isnull().all()
-                        )
-                        or (sample_data_array == sample_array).all()
+                data_df = existing_sheet.set_index(existing_sheet.columns[0])
+                # Convert pd.DataFrame into xr.DataArray
+                sample_data_array = xr.Dataset.from_dataframe(data_df)[
+                    sample_array.name
+                ]
+
+                changed = not (
+                    (
+                        sample_array.isnull().all()
+                        and sample_data_array.isnull().all()
                     )
-                    if changed:
-                        sample_array = sample_data_array
-                        self.values = labop.serialize_sample_format(
-                            sample_array
-                        )
-
-                else:
-                    raise Exception(
-                        f"Cannot read sample_format {sample_format} from Excel"
+                    or (sample_data_array == sample_array).all()
+                )
+                if changed:
+                    self.values = labop.serialize_sample_format(
+                        sample_data_array
                     )
+                    return None
             except Exception as e:
                 # Sheet could not be loaded, so it did not change
                 pass
-
-        if not changed:
-            mode = "a" if os.path.exists(data_file_path) else "w"
-            kwargs = {"if_sheet_exists": "replace"} if mode == "a" else {}
-            with pd.ExcelWriter(
-                data_file_path, mode=mode, engine="openpyxl", **kwargs
-            ) as writer:
-                sample_array.to_dataframe().to_excel(
-                    writer, sheet_name=sheet_name
-                )
+        return sample_array.to_dataframe().reset_index()
+    else:
+        raise Exception(
+            f"Cannot write sample_format {sample_format} to a data sheet"
+        )
 
 
-labop.SampleData.update_data_sheet = sample_data_update_data_sheet
+labop.SampleData.to_data_sheet = sample_data_to_data_sheet
 
 
 def dataset_humanize(self, dataset=None, sample_format=Strings.XARRAY):
@@ -729,22 +1494,18 @@ def dataset_humanize(self, dataset=None, sample_format=Strings.XARRAY):
         )  # to_dataset will call this function again with an xaray.Dataset for dataset
 
     if sample_format == Strings.XARRAY:
-        vars = list(dataset.data_vars.keys())
-        var_map = {}
-        for var in vars:
-            var_obj = self.document.find(var)
-            if var_obj is not None:
-                var_map[var] = str(var_obj.name)
-            values = dataset[var]
-            if values.dtype.str == "<U102" or values.dtype.str == "|O":
-                unique_values = set(values.data.tolist())
-                for old in unique_values:
-                    val_obj = self.document.find(old)
-                    if val_obj is not None:
-                        new = str(val_obj)
-                        values = values.astype("str").str.replace(old, str(new))
-                dataset = dataset.assign({var: values})
-
+        objects = _document_objects(self.document, list(dataset.data_vars))
+        var_map = {
+            var: str(objects[var].name)
+            for var in dataset.data_vars
+            if var in objects
+        }
+        dataset = dataset.assign(
+            {
+                var: _humanize_values(dataset[var], self.document)
+                for var in dataset.data_vars
+            }
+        )
         dataset = dataset.rename(var_map)
         return dataset
     else:
@@ -763,18 +1524,10 @@ def sample_data_humanize(self, sample_format=Strings.XARRAY):
     sample_array = self.to_data_array(sample_format=sample_format)
     if sample_format == Strings.XARRAY:
         var = sample_array.name
-        var_obj = self.document.find(var)
+        var_obj = _document_objects(self.document, [var]).get(var)
         if var_obj is not None:
             sample_array.name = str(var_obj.name)
-
-        if sample_array.dtype.str == "<U102" or sample_array.dtype.str == "|O":
-            unique_values = set(sample_array.data.tolist())
-            for old in unique_values:
-                val_obj = self.document.find(old)
-                if val_obj is not None:
-                    new = str(val_obj)
-                    sample_array = sample_array.str.replace(old, str(new))
-        return sample_array
+        return _humanize_values(sample_array, self.document)
     else:
         return sample_array
 
@@ -782,20 +1535,99 @@ def sample_data_humanize(self, sample_format=Strings.XARRAY):
 labop.SampleData.humanize = sample_data_humanize
 
 
+# Index of the objects in each document by identity and display_id, built by a
+# single traversal and reused across humanize calls, along with the values
+# known not to name any object.  A document is indexed again when TopLevels are
+# added, or when asked about a value that is in neither.  The index holds weak
+# references so that it does not keep the document alive.
+_document_indexes = weakref.WeakKeyDictionary()
+
+
+def clear_humanize_cache():
+    _document_indexes.clear()
+
+
+def _document_objects(document: sbol3.Document, values) -> Dict:
+    """
+    Get the objects of document named by values, as document.find() would.
+    """
+    values = [v for v in values if isinstance(v, str)]
+    n_objects, index, missing = _document_indexes.get(
+        document, (None, {}, set())
+    )
+    if n_objects != len(document.objects):
+        missing = set()
+    objects = {v: index[v]() for v in values if v in index}
+    if any(
+        (v not in index and v not in missing) or objects.get(v, v) is None
+        for v in values
+    ):
+        index = _index_document(document)
+        missing = {v for v in missing.union(values) if v not in index}
+        _document_indexes[document] = (len(document.objects), index, missing)
+        objects = {v: index[v]() for v in values if v in index}
+    return objects
+
+
+def _index_document(document: sbol3.Document) -> Dict[str, weakref.ref]:
+    index = {}
+
+    def add(obj):
+        if obj.identity not in index:
+            index[obj.identity] = weakref.ref(obj)
+        display_id = getattr(obj, "display_id", None)
+        if display_id and display_id not in index:
+            index[display_id] = weakref.ref(obj)
+
+    # find() checks the TopLevels before descending into their children
+    for obj in document.objects:
+        add(obj)
+    document.traverse(add)
+    return index
+
+
+def _humanize_values(values: xr.DataArray, document: sbol3.Document):
+    """
+    Replace the values that name objects in document by their labels, with a
+    single lookup of the unique values and one vectorized mapping.
+    """
+    if values.dtype.kind not in "OU":
+        return values
+    unique_values, inverse = np.unique(
+        values.data.astype(str), return_inverse=True
+    )
+    objects = _document_objects(document, unique_values.tolist())
+    if not objects:
+        return values
+    labels = np.array(
+        [str(objects[v]) if v in objects else v for v in unique_values.tolist()]
+    )
+    return values.copy(data=labels[inverse].reshape(values.shape))
+
+
 def dataset_update_data_sheet(
     self, data_file_path, sheet_name, sample_format=Strings.XARRAY
 ):
+    data_sheet = self.to_data_sheet(sample_format=sample_format)
+    if data_sheet is not None:
+        sheets = read_data_sheets(data_file_path)
+        sheets[sheet_name] = data_sheet
+        write_data_sheets(data_file_path, sheets)
+
+
+labop.Dataset.update_data_sheet = dataset_update_data_sheet
+
+
+def dataset_to_data_sheet(self, sample_format=Strings.XARRAY):
+    """
+    Get the data template sheet for the Dataset, or None if it is empty.
+    """
     dataset = sort_samples(
         self.to_dataset(humanize=True), sample_format=sample_format
     )
-
     if len(dataset) > 0:
-        mode = "a" if os.path.exists(data_file_path) else "w"
-        kwargs = {"if_sheet_exists": "replace"} if mode == "a" else {}
-        with pd.ExcelWriter(
-            data_file_path, mode=mode, engine="openpyxl", **kwargs
-        ) as writer:
-            dataset.to_dataframe().to_excel(writer, sheet_name=sheet_name)
+        return dataset.to_dataframe().reset_index()
+    return None
 
 
-labop.Dataset.update_data_sheet = dataset_update_data_sheet
+labop.Dataset.to_data_sheet = dataset_to_data_sheet
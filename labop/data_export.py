@@ -0,0 +1,174 @@
+"""
+Functions that export the data of protocol executions to columnar stores.
+
+This file monkey-patches the imported labop classes with data export functions.
+"""
+
+import logging
+from typing import Dict, Iterable, Iterator, Tuple
+
+import xarray as xr
+
+import labop
+from labop.strings import Strings
+
+l = logging.getLogger(__file__)
+l.setLevel(logging.ERROR)
+
+# Provenance used to partition the exported datasets
+PARTITIONS = ["execution", "primitive", "plate"]
+
+
+def protocol_execution_iter_data(
+    self, sample_format=Strings.XARRAY
+) -> Iterator[Tuple[Dict[str, str], xr.Dataset]]:
+    """
+    Iterate over the Datasets and SampleData produced by the
+    CallBehaviorExecutions of the execution, one at a time.  The provenance
+    names the execution, primitive, plate, node, output parameter, data
+    object, and start and end times of each.
+
+    Returns
+    -------
+    Iterator of (provenance, dataset) pairs
+    """
+    for record in self.executions:
+        if not isinstance(record, labop.CallBehaviorExecution):
+            continue
+        call = record.call.lookup()
+        for output in record.get_outputs():
+            value = output.value.get_value()
+            if isinstance(value, labop.Dataset):
+                dataset = value.to_dataset(sample_format=sample_format)
+            elif isinstance(value, labop.SampleData):
+                dataset = value.to_data_array(sample_format=sample_format).to_dataset()
+            else:
+                continue
+            dataset = _rename_measurements(dataset)
+            provenance = {
+                "execution": self.display_id,
+                "primitive": record.node.lookup().behavior.lookup().display_id,
+                "plate": _plate(value, self),
+                "node": str(record.node),
+                "data": value.identity,
+                "output": output.parameter.lookup().property_value.name,
+                "start_time": str(call.start_time),
+                "end_time": str(call.end_time),
+            }
+            yield provenance, dataset
+
+
+labop.ProtocolExecution.iter_data = protocol_execution_iter_data
+
+
+def protocol_execution_export_data(
+    self, path, store_format=Strings.PARQUET, sample_format=Strings.XARRAY
+):
+    """
+    Export the data of the execution to a store partitioned by execution,
+    primitive, and plate.  See export_data().
+    """
+    export_data([self], path, store_format=store_format, sample_format=sample_format)
+
+
+labop.ProtocolExecution.export_data = protocol_execution_export_data
+
+
+def export_data(
+    executions: Iterable[labop.ProtocolExecution],
+    path,
+    store_format=Strings.PARQUET,
+    sample_format=Strings.XARRAY,
+):
+    """
+    Export the data of many executions to a Parquet dataset or a Zarr store at
+    path.  Datasets are written one at a time, so that the data of all
+    executions need not fit in memory.
+
+    Parquet files are written to hive partitions (e.g.,
+    execution=.../primitive=.../plate=...) with a column for each variable and
+    provenance column.  Zarr groups follow the same layout and carry the
+    provenance as attributes.  Requires pyarrow or zarr, respectively.
+    """
+    if store_format == Strings.PARQUET:
+        write = _write_parquet
+    elif store_format == Strings.ZARR:
+        write = _write_zarr
+    else:
+        raise ValueError(f"Cannot export data to store_format {store_format}")
+
+    for execution in executions:
+        for provenance, dataset in execution.iter_data(sample_format=sample_format):
+            write(path, provenance, dataset)
+
+
+def _write_parquet(path, provenance: Dict[str, str], dataset: xr.Dataset):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = dataset.to_dataframe().reset_index()
+    df = df.assign(**provenance)
+    pq.write_to_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        path,
+        partition_cols=PARTITIONS,
+        basename_template=_basename(provenance) + "-{i}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def _write_zarr(path, provenance: Dict[str, str], dataset: xr.Dataset):
+    group = "/".join(
+        [f"{p}={provenance[p]}" for p in PARTITIONS] + [_basename(provenance)]
+    )
+    dataset = dataset.assign_attrs(provenance)
+    dataset.to_zarr(path, group=group, mode="w")
+
+
+def _rename_measurements(dataset: xr.Dataset) -> xr.Dataset:
+    """
+    SampleData variables are named by the identity of their SampleData, which
+    differs across executions and is not a valid column or array name.  Name
+    them "measurement" (or "measurement_<i>" if there are several) instead, and
+    keep the identity as an attribute.
+    """
+    measurements = [v for v in dataset.data_vars if "://" in str(v)]
+    names = (
+        [Strings.MEASUREMENT]
+        if len(measurements) == 1
+        else [f"{Strings.MEASUREMENT}_{i}" for i in range(len(measurements))]
+    )
+    dataset = dataset.rename(dict(zip(measurements, names)))
+    for name, identity in zip(names, measurements):
+        dataset[name].attrs["identity"] = identity
+    return dataset
+
+
+def _basename(provenance: Dict[str, str]) -> str:
+    node = provenance["node"].rsplit("/", 1)[-1]
+    return f"{node}-{provenance['output']}"
+
+
+def _plate(value, execution: labop.ProtocolExecution) -> str:
+    """
+    Name the SampleArray that the data in value describes, relative to the
+    execution, or "none" if the data is not about a SampleArray.
+    """
+    if isinstance(value, labop.Dataset):
+        data = [value.data] if value.data else []
+        data += [d.lookup() for d in value.dataset]
+        for d in data:
+            plate = _plate(d, execution)
+            if plate != "none":
+                return plate
+        return "none"
+
+    samples = value.from_samples.lookup() if value.from_samples else None
+    while isinstance(samples, labop.SampleMask):
+        samples = samples.source.lookup()
+    if samples is None:
+        return "none"
+    identity = samples.identity
+    if identity.startswith(execution.identity + "/"):
+        identity = identity[len(execution.identity) + 1 :]
+    return identity.replace("/", ".")
@@ -14,6 +14,7 @@ import xarray as xr
 import labop
 import uml
 from labop.primitive_execution import initialize_primitive_compute_output
+from labop.read_batching import PlateReads
 from labop_convert.behavior_specialization import (
     BehaviorSpecialization,
     DefaultBehaviorSpecialization,
@@ -52,6 +53,7 @@ class ExecutionEngine(ABC):
         sample_format="xarray",
         out_dir="out",
         dataset_file=None,
+        data_dir=None,
     ):
         self.exec_counter = 0
         self.variable_counter = 0
@@ -80,8 +82,10 @@ class ExecutionEngine(ABC):
         ] = {}  # List of Warnings and Errors
         self.out_dir = out_dir
         self.dataset_file = dataset_file  # Write dataset specifications as template files used to fill in data
+        self.data_dir = data_dir  # Store large sample data (e.g., spectra) as .npy files here, rather than in the document
         self.data_id = 0
         self.data_id_map = {}
+        self.data_sheets = None  # Data template sheets pending a write
         self.candidate_clusters = {}
 
     def next_id(self):
@@ -132,6 +136,15 @@ class ExecutionEngine(ABC):
         # setup possible issues
         self.issues[id] = []
 
+        # Read the data template workbook again, as it may have been filled
+        # in since an earlier execution
+        self.data_sheets = None
+        self.data_id_map = {}
+        # Tokens left over from an earlier execution do not flow into this one
+        self.tokens = []
+        self.candidate_clusters = {}
+        self.blocked_nodes = set({})
+
         if self.use_defined_primitives:
             # Define the compute_output function for known primitives
             initialize_primitive_compute_output(doc)
@@ -139,6 +152,11 @@ class ExecutionEngine(ABC):
         # First, set up the record for the protocol and parameter values
         self.ex = labop.ProtocolExecution(id, protocol=protocol)
         doc.add(self.ex)
+        # Plate reads batched for this execution only, with large sample data
+        # (e.g., spectra) stored in files under data_dir, if it is given
+        self.ex.plate_reads = PlateReads(data_dir=self.data_dir)
+        if self.data_dir is not None:
+            labop.add_external_data_dir(doc, self.data_dir)
 
         self.ex.association.append(sbol3.Association(agent=agent, plan=protocol))
         self.ex.parameter_values = parameter_values
@@ -162,6 +180,9 @@ class ExecutionEngine(ABC):
         # aggregate consumed material records from all behaviors executed within, mark end time, and return
         self.ex.aggregate_child_materials()
 
+        # Write the data templates collected during execution
+        self.write_data_sheets()
+
         # End specializations
         for specialization in self.specializations:
             specialization.on_end(self.ex)
@@ -190,8 +211,13 @@ class ExecutionEngine(ABC):
         """
 
         self.initialize(protocol, agent, id, parameter_values)
-        self.run(protocol, start_time=start_time)
-        self.finalize(protocol)
+        try:
+            self.run(protocol, start_time=start_time)
+            self.finalize(protocol)
+        except Exception:
+            for specialization in self.specializations:
+                specialization.on_failure(self.ex)
+            raise
 
         return self.ex
 
@@ -343,22 +369,51 @@ class ExecutionEngine(ABC):
             if isinstance(dataset.data, labop.SampleData)
         ]
 
-        path = os.path.join(self.out_dir, f"{self.dataset_file}.xlsx")
+        data_sheets = self.get_data_sheets()
 
         for dataset in datasets:
             sheet_name = f"{record.node.lookup().behavior.lookup().display_id}_dataset_{self.data_id}"
-            dataset.update_data_sheet(
-                path, sheet_name, sample_format=self.sample_format
-            )
+            data_sheet = dataset.to_data_sheet(sample_format=self.sample_format)
+            if data_sheet is not None:
+                data_sheets[sheet_name] = data_sheet
             self.data_id += 1
 
         for sd in sample_data:
             sheet_name = f"{record.node.lookup().behavior.lookup().display_id}_data_{self.data_id}"
-            sd.update_data_sheet(
-                path, sheet_name, sample_format=self.sample_format
+            data_sheet = sd.to_data_sheet(
+                existing_sheet=data_sheets.get(sheet_name),
+                sample_format=self.sample_format,
             )
+            if data_sheet is not None:
+                data_sheets[sheet_name] = data_sheet
+            self.data_id_map[sheet_name] = sd.identity
             self.data_id += 1
 
+    def data_template_path(self):
+        return os.path.join(self.out_dir, f"{self.dataset_file}.xlsx")
+
+    def get_data_sheets(self) -> Dict[str, pd.DataFrame]:
+        """
+        Get the data template sheets, reading any existing data template
+        workbook (e.g., one filled in by the user) the first time they are needed.
+        """
+        if self.data_sheets is None:
+            self.data_sheets = labop.data.read_data_sheets(self.data_template_path())
+        return self.data_sheets
+
+    def write_data_sheets(self):
+        """
+        Write the data template sheets collected by write_data_templates()
+        to the data template workbook in a single pass.  The index sheet
+        records the SampleData written to each sheet, so that the filled in
+        workbook can be loaded with ProtocolExecution.load_data_sheets().
+        """
+        if self.dataset_file is not None and self.data_sheets:
+            self.data_sheets[labop.data.DATA_SHEET_INDEX] = labop.data.data_sheet_index(
+                self.data_id_map
+            )
+            labop.data.write_data_sheets(self.data_template_path(), self.data_sheets)
+
 
 class ManualExecutionEngine(ExecutionEngine):
     def run(self, protocol: labop.Protocol, start_time: datetime.datetime = None):
@@ -368,6 +423,7 @@ class ManualExecutionEngine(ExecutionEngine):
         )  # TODO: remove str wrapper after sbol_factory #22 fixed
         ready = protocol.initiating_nodes()
         ready = self.advance(ready)
+        self.write_data_sheets()
         choices = self.ready_message(ready)
         graph = self.ex.to_dot(
             ready=ready, done=self.ex.backtrace()[0], out_dir=self.out_dir
@@ -448,6 +504,7 @@ class ManualExecutionEngine(ExecutionEngine):
             [activity_node], node_outputs={activity_node: node_output}
         )
         ready = self.advance(successors)
+        self.write_data_sheets()
         choices = self.ready_message(ready)
         graph = self.ex.to_dot(ready=ready, done=self.ex.backtrace()[0])
         return ready, choices, graph
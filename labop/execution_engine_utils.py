@@ -1232,7 +1232,7 @@ def activity_parameter_node_next_tokens_callback(
                     token_source=source,
                     value=source.get_value(
                         return_edge, node_outputs, engine.sample_format
-                    )
+                    ),
                     # uml.literal(source.incoming_flows[0].lookup().value)
                 )
             ]
@@ -1477,7 +1477,7 @@ def activity_node_execution_get_token_source(
     # The immediate predecessor will be the token_source
 
     node = self.node.lookup()
-    print(self.identity + " " + node.identity + " param = " + str(parameter))
+    l.debug(self.identity + " " + node.identity + " param = " + str(parameter))
     if (
         isinstance(node, uml.InputPin)
         or isinstance(node, uml.ForkNode)
@@ -1493,7 +1493,7 @@ def activity_node_execution_get_token_source(
         return self
 
     node = self.node.lookup()
-    print(self.identity + " " + node.identity + " param = " + str(parameter))
+    l.debug(self.identity + " " + node.identity + " param = " + str(parameter))
     if (
         isinstance(node, uml.InputPin)
         or isinstance(node, uml.ForkNode)
@@ -1518,7 +1518,7 @@ def call_behavior_execution_get_token_source(
     target: labop.ActivityNodeExecution = None,
 ) -> labop.CallBehaviorExecution:
     node = self.node.lookup()
-    print(self.identity + " " + node.identity + " param = " + str(parameter))
+    l.debug(self.identity + " " + node.identity + " param = " + str(parameter))
     if parameter:
         return labop.ActivityNodeExecution.get_token_source(
             self, parameter, target=target
@@ -1536,7 +1536,7 @@ def activity_edge_flow_get_token_source(
     target: labop.ActivityNodeExecution = None,
 ) -> labop.CallBehaviorExecution:
     node = self.token_source.lookup().node.lookup()
-    print(self.identity + " src = " + node.identity + " param = " + str(parameter))
+    l.debug(self.identity + " src = " + node.identity + " param = " + str(parameter))
     if parameter and isinstance(node, uml.InputPin):
         if node == target.node.lookup().input_pin(parameter.name):
             return self.token_source.lookup().get_token_source(None, target=target)
@@ -1549,3 +1549,25 @@ def activity_edge_flow_get_token_source(
 
 
 labop.ActivityEdgeFlow.get_token_source = activity_edge_flow_get_token_source
+
+
+def protocol_execution_get_markdown(self) -> str:
+    """
+    Get the markdown of the execution, e.g., from a MarkdownSpecialization.
+    Markdown written to a file (markdown_file) is only read when it is used.
+    """
+    markdown_file = self.__dict__.get("markdown_file")
+    if markdown_file:
+        with open(markdown_file) as f:
+            return f.read()
+    return self.__dict__.get("_markdown", "")
+
+
+def protocol_execution_set_markdown(self, markdown: str):
+    self.__dict__["_markdown"] = markdown
+    self.__dict__["markdown_file"] = None
+
+
+labop.ProtocolExecution.markdown = property(
+    protocol_execution_get_markdown, protocol_execution_set_markdown
+)
@@ -1,17 +1,67 @@
 import json
-from typing import List
+from dataclasses import dataclass
+from typing import Any, Dict, List
 from urllib.parse import quote, unquote
 
+import numpy as np
+import sbol3
 import xarray as xr
 from numpy import nan
 
+import labop
 from labop.strings import Strings
 
 
+@dataclass
+class PlateRead:
+    """
+    A read of the wells at coordinates, taken by calling the LabInterface
+    method named method with arguments.
+    """
+
+    method: str
+    coordinates: List[str]
+    arguments: Dict[str, Any]
+
+    def take(self, lab_interface=None) -> str:
+        lab_interface = lab_interface if lab_interface is not None else _lab_interface
+        return getattr(lab_interface, self.method)(self.coordinates, **self.arguments)
+
+    def key(self):
+        """Hashable description of the read"""
+
+        def hashable(value):
+            if isinstance(value, sbol3.Measure):
+                return (value.value, value.unit)
+            if isinstance(value, (list, tuple, np.ndarray)):
+                return tuple(value)
+            return value
+
+        return (
+            self.method,
+            tuple(self.coordinates),
+            tuple((k, hashable(v)) for k, v in sorted(self.arguments.items())),
+        )
+
+
 class LabInterface:
+    """
+    Interface to the instruments that take measurements.  The measure_*
+    methods return serialized reads of the wells at coordinates (NaN by
+    default), taken at time (an elapsed time) for kinetic measurements.
+    Subclass it and install an instance of the subclass with
+    set_lab_interface() to connect primitives to instruments.
+    """
+
+    # Emission wavelengths (nm) read by default for a fluorescence spectrum
+    SPECTRUM_WAVELENGTHS = np.arange(300.0, 851.0)
+
     @staticmethod
     def measure_absorbance(
-        coordinates: List[str], wavelength: float, sample_format: str
+        coordinates: List[str],
+        wavelength: float,
+        sample_format: str,
+        time: sbol3.Measure = None,
     ) -> xr.DataArray:
         # Override this method to interface with laboratory plate reader API
         if sample_format == Strings.XARRAY:
@@ -21,7 +71,7 @@ class LabInterface:
                 dims=(Strings.SAMPLE),
                 coords={Strings.SAMPLE: coordinates},
             )
-            measurements = quote(json.dumps(measurements.to_dict()))
+            measurements = labop.serialize_sample_format(measurements)
         elif sample_format == Strings.JSON:
             measurements = quote(json.dumps({}))
         else:
@@ -37,6 +87,7 @@ class LabInterface:
         emission: float,
         bandpass: float,
         sample_format: str,
+        time: sbol3.Measure = None,
     ) -> xr.DataArray:
         # Override this method to interface with laboratory plate reader API
         if sample_format == Strings.XARRAY:
@@ -46,7 +97,7 @@ class LabInterface:
                 dims=(Strings.SAMPLE),
                 coords={Strings.SAMPLE: coordinates},
             )
-            measurements = quote(json.dumps(measurements.to_dict()))
+            measurements = labop.serialize_sample_format(measurements)
         elif sample_format == Strings.JSON:
             measurements = quote(json.dumps({}))
         else:
@@ -55,7 +106,82 @@ class LabInterface:
             )
         return measurements
 
+    @staticmethod
+    def measure_fluorescence_spectrum(
+        coordinates: List[str],
+        excitation: float,
+        sample_format: str,
+        wavelengths: List[float] = None,
+        data_dir: str = None,
+    ) -> xr.DataArray:
+        # Override this method to interface with laboratory plate reader API
+        if sample_format == Strings.XARRAY:
+            wavelengths = (
+                wavelengths
+                if wavelengths is not None
+                else LabInterface.SPECTRUM_WAVELENGTHS
+            )
+            measurements = xr.DataArray(
+                np.full((len(coordinates), len(wavelengths)), nan),
+                name=Strings.DATA,
+                dims=(Strings.SAMPLE, Strings.EMISSION_WAVELENGTH),
+                coords={
+                    Strings.SAMPLE: coordinates,
+                    Strings.EMISSION_WAVELENGTH: wavelengths,
+                },
+            )
+            # Spectra are large, so keep their values out of the document
+            # when there is a directory for them
+            measurements = labop.serialize_sample_format(
+                measurements,
+                encoding=Strings.NPY if data_dir is not None else Strings.BINARY,
+                data_dir=data_dir,
+            )
+        elif sample_format == Strings.JSON:
+            measurements = quote(json.dumps({}))
+        else:
+            raise Exception(
+                f"Cannot initialize contents of sample_format: {sample_format}"
+            )
+        return measurements
+
+    def measure_many(self, reads: List[PlateRead]) -> List[str]:
+        """
+        Take several reads of the same samples, e.g., in one pass of the plate
+        reader, and return their values in the order of reads.
+        """
+        # Override this method to read a plate once for several measurements
+        return [read.take(self) for read in reads]
+
     @staticmethod
     def check_lims_inventory(self, matching_containers: list) -> str:
         # Override this method to interface with laboratory lims system
         return matching_containers[0]
+
+
+# The LabInterface that primitives use to take measurements
+_lab_interface = LabInterface()
+
+
+def get_lab_interface() -> LabInterface:
+    return _lab_interface
+
+
+def set_lab_interface(lab_interface=None):
+    """
+    Set the LabInterface that primitives use to take measurements, or restore
+    the default LabInterface if lab_interface is None.  A LabInterface class
+    is instantiated.
+
+    Returns
+    -------
+    The LabInterface that was replaced
+    """
+    global _lab_interface
+    previous = _lab_interface
+    if lab_interface is None:
+        lab_interface = LabInterface
+    _lab_interface = (
+        lab_interface() if isinstance(lab_interface, type) else lab_interface
+    )
+    return previous
@@ -5,13 +5,15 @@ import json
 import logging
 import types
 from typing import Dict, List
+from urllib.parse import quote
 
 import sbol3
 
 import labop
 import labop.data
 import uml
-from labop.lab_interface import LabInterface
+from labop.lab_interface import PlateRead
+from labop.read_batching import READ_METHODS, PlateReads, plate_reads
 
 l = logging.getLogger(__file__)
 l.setLevel(logging.ERROR)
@@ -33,6 +35,26 @@ def call_behavior_execution_compute_output(self, parameter, sample_format):
         for x in call.parameter_values
         if x.parameter.lookup().property_value.direction == uml.PARAMETER_IN
     ]
+    if (
+        primitive.display_id in READ_METHODS
+        and getattr(primitive.compute_output, "__func__", None)
+        is measure_compute_output
+    ):
+        # Reads are batched within the execution that the record belongs to,
+        # which gets its PlateReads here if it was not made by ExecutionEngine
+        execution = self.get_parent()
+        execution_reads = getattr(execution, "plate_reads", None)
+        if execution_reads is None:
+            execution_reads = PlateReads()
+            if execution is not None:
+                execution.plate_reads = execution_reads
+        if execution is not None:
+            execution_reads.prefetch(
+                self.node.lookup(), input_parameter_map(inputs), sample_format
+            )
+        return primitive.compute_output(
+            inputs, parameter, sample_format, execution_reads=execution_reads
+        )
     value = primitive.compute_output(inputs, parameter, sample_format)
     return value
 
@@ -239,51 +261,60 @@ def get_short_uuid(obj):
     return j
 
 
-def measure_absorbance_compute_output(self, inputs, parameter, sample_format):
-    if (
-        parameter.name == "measurements"
-        and parameter.type == "http://bioprotocols.org/labop#Dataset"
-    ):
-        input_map = input_parameter_map(inputs)
-        samples = input_map["samples"]
-        wl = input_map["wavelength"]
-
-        measurements = LabInterface.measure_absorbance(
-            samples.get_coordinates(sample_format), wl.value, sample_format
-        )
-        name = f"{self.display_id}.{parameter.name}.{get_short_uuid([self.identity, parameter.identity, [i.value.identity for i in inputs]])}"
-        sample_data = labop.SampleData(
-            name=name, from_samples=samples, values=measurements
-        )
-        sample_metadata = labop.SampleMetadata.for_primitive(
-            self, input_map, samples, sample_format=sample_format
+def record_reads(
+    sample_data: labop.SampleData, reads: List[PlateRead], values: List[str]
+):
+    """
+    Set the values of sample_data to the values of reads.  If the reads have
+    a time, then the measurement is kinetic: each read is appended to
+    sample_data along its time dimension, whose coordinates are the timepoint
+    values.
+    """
+    if len(reads) == 1 and reads[0].arguments.get("time") is None:
+        sample_data.values = values[0]
+        return
+
+    for read, value in zip(reads, values):
+        timepoint = read.arguments["time"]
+        sample_data.append(
+            labop.deserialize_sample_format(value)
+            .expand_dims({labop.Strings.TIME: [timepoint.value]})
+            .assign_coords(
+                {
+                    labop.Strings.TIME: (
+                        labop.Strings.TIME,
+                        [timepoint.value],
+                        {"unit": timepoint.unit},
+                    )
+                }
+            )
         )
-        sample_dataset = labop.Dataset(data=sample_data, metadata=[sample_metadata])
-        return sample_dataset
 
 
-def measure_fluorescence_compute_output(self, inputs, parameter, sample_format):
+def measure_compute_output(
+    self, inputs, parameter, sample_format, execution_reads: PlateReads = None
+):
+    """
+    Compute the measurements of a measurement primitive (see
+    labop.read_batching.READ_METHODS) from the reads of its samples, taking
+    the reads prefetched in execution_reads if they were.
+    """
     if (
         parameter.name == "measurements"
         and parameter.type == "http://bioprotocols.org/labop#Dataset"
     ):
         input_map = input_parameter_map(inputs)
         samples = input_map["samples"]
-        exwl = input_map["excitationWavelength"]
-        emwl = input_map["emissionWavelength"]
-        bandpass = input_map["emissionBandpassWidth"]
-
-        measurements = LabInterface.measure_fluorescence(
-            samples.get_coordinates(sample_format),
-            exwl.value,
-            emwl.value,
-            bandpass.value,
-            sample_format,
+
+        execution_reads = (
+            execution_reads if execution_reads is not None else PlateReads()
         )
-        name = f"{self.display_id}.{parameter.name}.{get_short_uuid([self.identity, parameter.identity, [i.value.identity for i in inputs]])}"
-        sample_data = labop.SampleData(
-            name=name, from_samples=samples, values=measurements
+        reads = plate_reads(
+            self.display_id, input_map, sample_format, execution_reads.data_dir
         )
+        name = f"{self.display_id}.{parameter.name}.{get_short_uuid([self.identity, parameter.identity, [i.value.identity for i in inputs]])}"
+        sample_data = labop.SampleData(name=name, from_samples=samples)
+        record_reads(sample_data, reads, execution_reads.take(reads))
         sample_metadata = labop.SampleMetadata.for_primitive(
             self, input_map, samples, sample_format=sample_format
         )
@@ -351,8 +382,9 @@ def compute_metadata_compute_output(self, inputs, parameter, sample_format):
 primitive_to_output_function = {
     "EmptyContainer": empty_container_compute_output,
     "PlateCoordinates": plate_coordinates_compute_output,
-    "MeasureAbsorbance": measure_absorbance_compute_output,
-    "MeasureFluorescence": measure_fluorescence_compute_output,
+    "MeasureAbsorbance": measure_compute_output,
+    "MeasureFluorescence": measure_compute_output,
+    "MeasureFluorescenceSpectrum": measure_compute_output,
     "EmptyInstrument": empty_rack_compute_output,
     "EmptyRack": empty_rack_compute_output,
     "LoadContainerOnInstrument": load_container_on_instrument_compute_output,
@@ -431,9 +463,9 @@ labop.Primitive.compute_output = primitive_compute_output
 def transfer_out(self, source, target, plan, sample_format):
     if sample_format == "xarray":
         sourceResult, targetResult = self.transfer(source, target, plan, sample_format)
-        return json.dumps(sourceResult.to_dict())
+        return labop.serialize_sample_format(sourceResult)
     elif sample_format == "json":
-        contents = quote(json.dumps({c: None for c in aliquots}))
+        contents = quote(json.dumps({c: None for c in source.to_dict(sample_format)}))
     else:
         raise Exception(f"Cannot initialize contents of: {self.identity}")
     return contents
@@ -445,9 +477,9 @@ labop.Primitive.transfer_out = transfer_out
 def transfer_in(self, source, target, plan, sample_format):
     if sample_format == "xarray":
         sourceResult, targetResult = self.transfer(source, target, plan, sample_format)
-        return json.dumps(targetResult.to_dict())
+        return labop.serialize_sample_format(targetResult)
     elif sample_format == "json":
-        contents = quote(json.dumps({c: None for c in aliquots}))
+        contents = quote(json.dumps({c: None for c in target.to_dict(sample_format)}))
     else:
         raise Exception(f"Cannot initialize contents of: {self.identity}")
     return contents
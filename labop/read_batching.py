@@ -0,0 +1,247 @@
+"""
+Batching of plate reads.
+
+Protocols often measure the same samples several times in a row (e.g.,
+MeasureAbsorbance followed by a few MeasureFluorescence).  A batch is a chain
+of measurement actions that each directly follow the previous one, read the
+same samples, and have no other action (e.g., liquid handling) in between.
+When the first action of a batch executes, the reads of the whole batch are
+taken with one LabInterface.measure_many() call, and each action then takes
+its own reads from the results.  The reads taken for a batch are kept by the
+PlateReads of the execution, so they are never served to another execution.
+
+This file monkey-patches the imported labop classes with batching functions.
+"""
+
+import logging
+from typing import Dict, List, Tuple
+
+import labop
+import uml
+from labop.lab_interface import PlateRead, get_lab_interface
+from labop.strings import Strings
+
+l = logging.getLogger(__file__)
+l.setLevel(logging.ERROR)
+
+# Take the reads of a batch in one instrument pass
+batch_plate_reads = True
+
+# The LabInterface method that takes the reads of each measurement primitive,
+# and the primitive inputs passed to it as arguments
+READ_METHODS = {
+    "MeasureAbsorbance": ("measure_absorbance", {"wavelength": "wavelength"}),
+    "MeasureFluorescence": (
+        "measure_fluorescence",
+        {
+            "excitation": "excitationWavelength",
+            "emission": "emissionWavelength",
+            "bandpass": "emissionBandpassWidth",
+        },
+    ),
+    "MeasureFluorescenceSpectrum": (
+        "measure_fluorescence_spectrum",
+        {"excitation": "excitationWavelength"},
+    ),
+}
+
+# Primitives whose reads can be kinetic, i.e., taken at timepoints
+KINETIC_READS = {"MeasureAbsorbance", "MeasureFluorescence"}
+
+# Primitives whose reads are large enough to be stored in files, outside of
+# the document, when there is a directory for them
+EXTERNAL_READS = {"MeasureFluorescenceSpectrum"}
+
+
+def plate_reads(
+    primitive: str, input_map: Dict, sample_format: str, data_dir: str = None
+) -> List[PlateRead]:
+    """
+    Make the reads that a measurement primitive takes given its inputs, one
+    per timepoint if the measurement is kinetic.
+    """
+    method, arguments = READ_METHODS[primitive]
+    arguments = {a: input_map[i].value for a, i in arguments.items()}
+    arguments["sample_format"] = sample_format
+    if primitive in EXTERNAL_READS and data_dir is not None:
+        arguments["data_dir"] = data_dir
+    coordinates = input_map["samples"].get_coordinates(sample_format)
+    timepoints = input_map.get("timepoints")
+    if (
+        primitive not in KINETIC_READS
+        or timepoints is None
+        or sample_format != Strings.XARRAY
+    ):
+        # Only kinetic reads pass a time, so that LabInterface methods
+        # without a time argument keep working
+        return [PlateRead(method, coordinates, arguments)]
+    timepoints = timepoints if isinstance(timepoints, list) else [timepoints]
+    units = {t.unit for t in timepoints}
+    if len(units) > 1:
+        raise ValueError(f"Timepoints must be in the same unit, found: {units}")
+    return [
+        PlateRead(method, coordinates, {**arguments, "time": t}) for t in timepoints
+    ]
+
+
+class PlateReads:
+    """
+    Plate reads of one execution: the batches of the protocols it executes,
+    and the reads taken for the batch being executed.  The ExecutionEngine
+    makes one for each ProtocolExecution, so that the reads left over by an
+    execution that was interrupted are not served to another one.  Large
+    reads are stored in files under data_dir, if it is given.
+    """
+
+    def __init__(self, data_dir: str = None):
+        self.data_dir = data_dir
+        # Batches of each protocol by its identity, along with the size of
+        # the protocol when they were found
+        self.batches: Dict[str, Tuple[Tuple[int, int], Dict]] = {}
+        # Reads taken for the batch being executed, by PlateRead.key()
+        self.prefetched: Dict[Tuple, List[str]] = {}
+
+    def protocol_batches(
+        self, protocol: labop.Protocol
+    ) -> Dict[str, List[uml.CallBehaviorAction]]:
+        size = (len(protocol.nodes), len(protocol.edges))
+        if (
+            protocol.identity not in self.batches
+            or self.batches[protocol.identity][0] != size
+        ):
+            self.batches[protocol.identity] = (size, protocol.plate_read_batches())
+        return self.batches[protocol.identity][1]
+
+    def prefetch(self, node: uml.CallBehaviorAction, input_map: Dict, sample_format):
+        """
+        Called before a measurement node executes with the values of its
+        inputs.  If node is the first node of a batch, then take the reads of
+        the whole batch with LabInterface.measure_many().  Reads left over
+        from an earlier batch are discarded once a measurement outside of
+        that batch executes.
+        """
+        protocol = node.get_parent()
+        if not batch_plate_reads or not isinstance(protocol, labop.Protocol):
+            return
+        batches = self.protocol_batches(protocol)
+        if node.identity in batches:
+            self.prefetched.clear()
+            reads = []
+            for member in batches[node.identity]:
+                member_inputs = _value_pin_map(member)
+                member_inputs["samples"] = input_map["samples"]
+                reads += plate_reads(
+                    member.behavior.lookup().display_id,
+                    member_inputs,
+                    sample_format,
+                    self.data_dir,
+                )
+            values = get_lab_interface().measure_many(reads)
+            if len(values) != len(reads):
+                raise ValueError(
+                    f"LabInterface.measure_many() returned {len(values)} values for {len(reads)} reads"
+                )
+            for read, value in zip(reads, values):
+                self.prefetched.setdefault(read.key(), []).append(value)
+        elif not any(
+            node.identity in [m.identity for m in members]
+            for members in batches.values()
+        ):
+            self.prefetched.clear()
+
+    def take(self, reads: List[PlateRead]) -> List[str]:
+        """
+        Take reads from the LabInterface, unless they were already taken for
+        a batch.
+        """
+        values = []
+        for read in reads:
+            prefetched = self.prefetched.get(read.key())
+            values.append(prefetched.pop(0) if prefetched else read.take())
+        return values
+
+
+def protocol_plate_read_batches(self) -> Dict[str, List[uml.CallBehaviorAction]]:
+    """
+    Find the batches of reads of the protocol: chains of two or more
+    measurement actions that read the same samples, where each action is the
+    only control successor of the previous one and has no other control
+    predecessor.  All inputs other than samples must be ValuePins (or unset),
+    so that the reads of the batch are known when its first action executes.
+
+    Returns
+    -------
+    Dict of the actions in each batch, keyed by the identity of its first one
+    """
+
+    def readable(node):
+        return (
+            isinstance(node, uml.CallBehaviorAction)
+            and node.behavior.lookup() is not None
+            and node.behavior.lookup().display_id in READ_METHODS
+            and all(
+                isinstance(pin, uml.ValuePin) or not self.incoming_edges(pin)
+                for pin in node.inputs
+                if pin.name != "samples"
+            )
+            and _samples_source(self, node) is not None
+        )
+
+    def control_edges(edges, end):
+        return [
+            getattr(e, end).lookup() for e in edges if isinstance(e, uml.ControlFlow)
+        ]
+
+    def successor(node):
+        successors = control_edges(self.outgoing_edges(node), "target")
+        if len(successors) != 1 or not readable(successors[0]):
+            return None
+        if control_edges(self.incoming_edges(successors[0]), "source") != [node]:
+            return None
+        if _samples_source(self, successors[0]) is not _samples_source(self, node):
+            return None
+        return successors[0]
+
+    batches = {}
+    batched = set()
+    for node in self.nodes:
+        if node.identity in batched or not readable(node):
+            continue
+        predecessors = control_edges(self.incoming_edges(node), "source")
+        if (
+            len(predecessors) == 1
+            and readable(predecessors[0])
+            and successor(predecessors[0]) is node
+        ):
+            continue  # Not the first node of its batch
+        members = [node]
+        while successor(members[-1]) is not None:
+            members.append(successor(members[-1]))
+        if len(members) > 1:
+            batches[node.identity] = members
+            batched.update(m.identity for m in members)
+
+    return batches
+
+
+labop.Protocol.plate_read_batches = protocol_plate_read_batches
+
+
+def _samples_source(protocol: labop.Protocol, node: uml.CallBehaviorAction):
+    """
+    Find the node that the samples pin of node takes its value from, looking
+    past any ForkNodes, or None if it has no single source.
+    """
+    pins = node.input_pins("samples")
+    if len(pins) != 1:
+        return None
+    [pin] = pins
+    return protocol.flow_source(pin)
+
+
+def _value_pin_map(node: uml.CallBehaviorAction) -> Dict:
+    values = {}
+    for pin in node.inputs:
+        if isinstance(pin, uml.ValuePin):
+            values.setdefault(pin.name, []).append(pin.value.get_value())
+    return {k: (v[0] if len(v) == 1 else v) for k, v in values.items()}
@@ -4,20 +4,19 @@ Functions related to sample map get and set.
 This file monkey-patches the imported labop classes with data handling functions.
 """
 
-import json
 import logging
 from cmath import nan
+from typing import Tuple
 
+import numpy as np
+import pandas as pd
 import xarray as xr
 
 import labop
 import uml
 from labop import SampleArray, SampleData, SampleMask
-from labop_convert.plate_coordinates import (
-    coordinate_rect_to_row_col_pairs,
-    coordinate_to_row_col,
-    get_sample_list,
-)
+from labop.strings import Strings
+from labop_convert.plate_coordinates import get_sample_list
 
 l = logging.getLogger(__file__)
 l.setLevel(logging.ERROR)
@@ -32,7 +31,7 @@ def sample_map_get_map(self):
             "Don't know how to initialize a generic SampleMap.  Try a subclass."
         )
     else:
-        sample_map = xr.DataArray.from_dict(json.loads(self.values))
+        sample_map = labop.deserialize_sample_format(self.values)
     return sample_map
 
 
@@ -48,9 +47,7 @@ def many_to_one_sample_map_get_map(self):
         sources = [source.lookup() for source in self.sources]
         target = self.targets.lookup()
 
-        aliquots = get_sample_list(
-            geometry="A1:H12"
-        )  # FIXME need to use the spec for each source and target
+        aliquots = get_sample_list(geometry=target.geometry())
         source_to_target_arrays = {
             source.identity: xr.DataArray(
                 [""] * len(aliquots),
@@ -75,12 +72,10 @@ def one_to_many_sample_map_get_map(self):
     """
     if not hasattr(self, "values") or not self.values:
 
-        source = self.sources
-        targets = self.targets
+        source = self.sources.lookup()
+        targets = [target.lookup() for target in self.targets]
 
-        aliquots = get_sample_list(
-            geometry="A1:H12"
-        )  # FIXME need to use the spec for each source and target
+        aliquots = get_sample_list(geometry=source.geometry())
         source_to_target_arrays = {
             target.identity: xr.DataArray(
                 [""] * len(aliquots),
@@ -103,7 +98,193 @@ def sample_map_set_map(self, sample_map):
     """
     Set the XArray Dataset to the values field.
     """
-    self.values = json.dumps(sample_map.to_dict())
+    self.values = labop.serialize_sample_format(sample_map)
 
 
 labop.SampleMap.set_map = sample_map_set_map
+
+
+class TransferMatrix:
+    """
+    Sparse (coordinate format) matrix of the volumes transferred from the
+    samples of a source array to the samples of a target array.  Only the
+    nonzero transfers are stored, so plate to plate maps stay linear in the
+    number of transfers rather than quadratic in the number of wells.
+    """
+
+    def __init__(
+        self,
+        source_samples,
+        target_samples,
+        rows: np.ndarray,
+        columns: np.ndarray,
+        volumes: np.ndarray,
+    ):
+        self.source_samples = np.asarray(source_samples)
+        self.target_samples = np.asarray(target_samples)
+        self.rows = np.asarray(rows, dtype=np.intp)
+        self.columns = np.asarray(columns, dtype=np.intp)
+        self.volumes = np.asarray(volumes, dtype=float)
+
+    def __repr__(self):
+        return f"TransferMatrix({len(self.source_samples)}x{len(self.target_samples)}, nnz={self.nnz})"
+
+    @property
+    def nnz(self) -> int:
+        return len(self.volumes)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (len(self.source_samples), len(self.target_samples))
+
+    @classmethod
+    def from_data_array(
+        cls,
+        transfer: xr.DataArray,
+        source_dim: str = "source_aliquot",
+        target_dim: str = "target_aliquot",
+    ) -> "TransferMatrix":
+        """
+        Create a TransferMatrix from a two dimensional DataArray of volumes
+        indexed by source_dim and target_dim.
+        """
+        transfer = transfer.transpose(source_dim, target_dim)
+        volumes = np.nan_to_num(np.asarray(transfer.data, dtype=float))
+        rows, columns = np.nonzero(volumes)
+        return cls(
+            transfer[source_dim].data,
+            transfer[target_dim].data,
+            rows,
+            columns,
+            volumes[rows, columns],
+        )
+
+    def limit(self, totals: np.ndarray) -> np.ndarray:
+        """
+        Get the volumes of the transfers when each source sample holds the
+        volume in totals (one entry per source sample).  The transfers from
+        a source sample are taken in order, so once it is empty the
+        remaining transfers from it move nothing.
+        """
+        if not self.nnz:
+            return self.volumes.copy()
+        order = np.argsort(self.rows, kind="stable")
+        rows = self.rows[order]
+        volumes = self.volumes[order]
+        # Volume taken from the same source sample by the earlier transfers
+        taken = np.cumsum(volumes) - volumes
+        first = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        taken -= np.repeat(taken[first], np.diff(np.r_[first, len(rows)]))
+        limited = np.empty_like(volumes)
+        limited[order] = np.clip(
+            np.asarray(totals, dtype=float)[rows] - taken, 0.0, volumes
+        )
+        return limited
+
+    def to_data_array(
+        self, source_dim: str = "source_aliquot", target_dim: str = "target_aliquot"
+    ) -> xr.DataArray:
+        """
+        Create the dense DataArray of volumes for the TransferMatrix.
+        """
+        volumes = np.zeros(self.shape)
+        np.add.at(volumes, (self.rows, self.columns), self.volumes)
+        return xr.DataArray(
+            volumes,
+            dims=(source_dim, target_dim),
+            coords={source_dim: self.source_samples, target_dim: self.target_samples},
+        )
+
+    def apply(
+        self,
+        source_contents: xr.DataArray,
+        target_contents: xr.DataArray,
+        sample_dim: str = Strings.SAMPLE,
+    ) -> Tuple[xr.DataArray, xr.DataArray]:
+        """
+        Move volume from the source to the target contents.  Each transfer
+        takes the mixture in its source sample, in proportion to the
+        concentration of each of the contents, so that the contents are
+        propagated by a sparse matrix product.  Empty source samples transfer
+        nothing, and a source sample cannot give more than it holds (see
+        limit()).
+        """
+        source_rows = _sample_positions(
+            source_contents, sample_dim, self.source_samples
+        )
+        target_rows = _sample_positions(
+            target_contents, sample_dim, self.target_samples
+        )
+
+        source = source_contents.transpose(sample_dim, ...)
+        target = target_contents.transpose(sample_dim, ...)
+        source_values = np.asarray(source.data, dtype=float)
+        totals = source_values.reshape(len(source_values), -1).sum(axis=1)
+        totals = totals.reshape((-1,) + (1,) * (source_values.ndim - 1))
+        concentration = np.divide(
+            source_values,
+            totals,
+            out=np.zeros_like(source_values),
+            where=totals != 0,
+        )
+
+        volumes = self.limit(totals.reshape(-1)[source_rows]).reshape(
+            (-1,) + (1,) * (source_values.ndim - 1)
+        )
+        moved = concentration[source_rows[self.rows]] * volumes
+        removed = np.zeros_like(source_values)
+        np.add.at(removed, source_rows[self.rows], moved)
+        added = np.zeros(target.shape, dtype=float)
+        np.add.at(added, target_rows[self.columns], moved)
+
+        source_result = source.copy(data=source_values - removed)
+        target_result = target.copy(data=np.asarray(target.data, dtype=float) + added)
+        return (
+            source_result.transpose(*source_contents.dims),
+            target_result.transpose(*target_contents.dims),
+        )
+
+
+def dense_transfer(
+    source_contents: xr.DataArray,
+    target_contents: xr.DataArray,
+    transfer: xr.DataArray,
+    sample_dim: str = Strings.SAMPLE,
+) -> Tuple[xr.DataArray, xr.DataArray]:
+    """
+    Move volume from the source to the target contents by broadcasting over
+    the dense DataArray of volumes transfer (see TransferMatrix.to_data_array),
+    as TransferMatrix.apply() does with a sparse product.  This is the
+    reference for apply() when no source sample is empty or gives more than
+    it holds, and takes time quadratic in the number of samples.
+    """
+    source = source_contents.rename({sample_dim: "source_aliquot"})
+    amount_transferred = source / source.sum(dim="contents") * transfer
+    source_result = source - amount_transferred.sum(dim="target_aliquot")
+    target_result = target_contents + amount_transferred.sum(
+        dim="source_aliquot"
+    ).rename({"target_aliquot": sample_dim})
+    return source_result.rename({"source_aliquot": sample_dim}), target_result
+
+
+def _sample_positions(contents: xr.DataArray, sample_dim: str, samples) -> np.ndarray:
+    positions = pd.Index(contents[sample_dim].data).get_indexer(samples)
+    if (positions < 0).any():
+        missing = np.asarray(samples)[positions < 0].tolist()
+        raise ValueError(f"Samples {missing} are not in {contents.name}")
+    return positions
+
+
+def sample_map_transfer_matrix(
+    self, source: SampleArray, target: SampleArray
+) -> TransferMatrix:
+    """
+    Get the sparse TransferMatrix from source to target in the values field.
+    """
+    sample_map = self.get_map()
+    return TransferMatrix.from_data_array(
+        sample_map.sel(source_array=source.name, target_array=target.name)
+    )
+
+
+labop.SampleMap.transfer_matrix = sample_map_transfer_matrix
@@ -5,7 +5,13 @@ class Strings:
     DATA = "data"
     XARRAY = "xarray"
     JSON = "json"
+    BINARY = "binary"
+    NPY = "npy"
+    PARQUET = "parquet"
+    ZARR = "zarr"
     MASK = "mask"
     MEASUREMENT = "measurement"
     CONTENTS = "contents"
     SOURCE = "source"
+    TIME = "time"
+    EMISSION_WAVELENGTH = "emission_wavelength"
@@ -0,0 +1,232 @@
+"""
+A LabInterface that generates synthetic instrument reads, e.g., to exercise
+data handling with realistic values and volumes.
+
+Reads are computed for all requested wells at once from a signal model and a
+noise model.  They depend only on the seed, the wells, the time, and the
+number of reads taken before, so a protocol executed with the same seed
+always gets the same data.
+"""
+
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+import sbol3
+import tyto
+import xarray as xr
+
+import labop
+from labop.lab_interface import LabInterface
+from labop.strings import Strings
+from labop_convert.plate_coordinates import DEFAULT_PLATE_GEOMETRY
+
+# Factors to convert elapsed times to hours
+HOUR_FACTORS = {
+    tyto.OM.second: 1.0 / 3600.0,
+    tyto.OM.minute: 1.0 / 60.0,
+    tyto.OM.hour: 1.0,
+}
+
+
+@dataclass
+class GrowthCurve:
+    """
+    Logistic growth of optical density from initial_od to capacity, at rate
+    (per hour) after a lag (in hours).  The rate and capacity of each well vary
+    by a relative standard deviation of variation.
+    """
+
+    initial_od: float = 0.01
+    capacity: float = 1.0
+    rate: float = 0.8
+    lag: float = 1.0
+    blank: float = 0.04
+    variation: float = 0.1
+
+    def __call__(self, rows, columns, hours, effects):
+        rate = self.rate * (1.0 + self.variation * effects[0])
+        capacity = self.capacity * (1.0 + self.variation * effects[1])
+        elapsed = np.maximum(hours - self.lag, 0.0)
+        growth = (capacity - self.initial_od) / self.initial_od
+        return self.blank + capacity / (1.0 + growth * np.exp(-rate * elapsed))
+
+
+@dataclass
+class DilutionSeries:
+    """
+    Calibrant diluted by dilution_factor from one column (or row) to the
+    next, starting at top in the first one.  Wells beyond the first steps
+    columns (or rows) hold only the blank, as in the iGEM calibration plates.
+    """
+
+    top: float = 1.0
+    dilution_factor: float = 2.0
+    steps: int = 11
+    along: str = "column"
+    blank: float = 0.0
+
+    def __call__(self, rows, columns, hours, effects):
+        step = columns if self.along == "column" else rows
+        signal = self.top / self.dilution_factor ** step.astype(float)
+        return self.blank + np.where(step < self.steps, signal, 0.0)
+
+
+@dataclass
+class NoiseModel:
+    """
+    Instrument noise with a standard deviation of additive plus
+    proportional times the signal.
+    """
+
+    additive: float = 0.001
+    proportional: float = 0.02
+
+    def __call__(self, signal, rng: np.random.Generator):
+        noise = rng.standard_normal((2,) + signal.shape)
+        return signal * (1.0 + self.proportional * noise[0]) + (
+            self.additive * noise[1]
+        )
+
+
+class SyntheticLabInterface(LabInterface):
+    """
+    Generate seeded synthetic reads.  Absorbance follows a GrowthCurve and
+    fluorescence a DilutionSeries by default.  Reads taken without a time
+    (i.e., not as part of a kinetic measurement) are taken at a clock that
+    starts at 0 and advances by read_interval hours with every read.
+
+    Install an instance with labop.lab_interface.set_lab_interface().
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        absorbance=None,
+        fluorescence=None,
+        noise=None,
+        read_interval: float = 1.0,
+        stokes_shift: float = 30.0,
+        peak_width: float = 20.0,
+    ):
+        self.seed = seed
+        self.absorbance = absorbance if absorbance is not None else GrowthCurve()
+        self.fluorescence = (
+            fluorescence
+            if fluorescence is not None
+            else DilutionSeries(top=50000.0, blank=100.0)
+        )
+        self.noise = noise if noise is not None else NoiseModel()
+        self.read_interval = read_interval
+        self.stokes_shift = stokes_shift
+        self.peak_width = peak_width
+        self.reset()
+
+    def reset(self):
+        """Restart the clock and the sequence of reads"""
+        self.clock = 0.0
+        self.reads = 0
+        # Per-well effects, indexed by the canonical index of the well
+        self.effects = np.random.default_rng(self.seed).standard_normal(
+            (2, DEFAULT_PLATE_GEOMETRY.size)
+        )
+
+    def measure_absorbance(
+        self,
+        coordinates: List[str],
+        wavelength: float,
+        sample_format: str,
+        time: sbol3.Measure = None,
+    ) -> xr.DataArray:
+        if sample_format != Strings.XARRAY:
+            return LabInterface.measure_absorbance(
+                coordinates, wavelength, sample_format
+            )
+        return self._serialize(
+            coordinates, self._read(self.absorbance, coordinates, time)
+        )
+
+    def measure_fluorescence(
+        self,
+        coordinates: List[str],
+        excitation: float,
+        emission: float,
+        bandpass: float,
+        sample_format: str,
+        time: sbol3.Measure = None,
+    ) -> xr.DataArray:
+        if sample_format != Strings.XARRAY:
+            return LabInterface.measure_fluorescence(
+                coordinates, excitation, emission, bandpass, sample_format
+            )
+        return self._serialize(
+            coordinates, self._read(self.fluorescence, coordinates, time)
+        )
+
+    def measure_fluorescence_spectrum(
+        self,
+        coordinates: List[str],
+        excitation: float,
+        sample_format: str,
+        wavelengths: List[float] = None,
+        data_dir: str = None,
+    ) -> xr.DataArray:
+        if sample_format != Strings.XARRAY:
+            return LabInterface.measure_fluorescence_spectrum(
+                coordinates, excitation, sample_format, wavelengths
+            )
+        wavelengths = np.asarray(
+            wavelengths if wavelengths is not None else self.SPECTRUM_WAVELENGTHS
+        )
+        rows, columns = DEFAULT_PLATE_GEOMETRY.row_columns(coordinates)
+        peak = self.fluorescence(
+            rows, columns, self._hours(None), self._effects(rows, columns)
+        )
+        shape = np.exp(
+            -0.5
+            * ((wavelengths - excitation - self.stokes_shift) / self.peak_width) ** 2
+        )
+        spectra = self.noise(peak[:, None] * shape[None, :], self._rng())
+        measurements = xr.DataArray(
+            spectra,
+            name=Strings.DATA,
+            dims=(Strings.SAMPLE, Strings.EMISSION_WAVELENGTH),
+            coords={
+                Strings.SAMPLE: coordinates,
+                Strings.EMISSION_WAVELENGTH: wavelengths,
+            },
+        )
+        return labop.serialize_sample_format(
+            measurements,
+            encoding=Strings.NPY if data_dir is not None else Strings.BINARY,
+            data_dir=data_dir,
+        )
+
+    def _read(self, model, coordinates: List[str], time: sbol3.Measure):
+        rows, columns = DEFAULT_PLATE_GEOMETRY.row_columns(coordinates)
+        signal = model(rows, columns, self._hours(time), self._effects(rows, columns))
+        return self.noise(signal, self._rng())
+
+    def _effects(self, rows, columns):
+        return self.effects[:, rows * DEFAULT_PLATE_GEOMETRY.columns + columns]
+
+    def _hours(self, time: sbol3.Measure) -> float:
+        if time is not None:
+            return time.value * HOUR_FACTORS[time.unit]
+        hours = self.clock
+        self.clock += self.read_interval
+        return hours
+
+    def _rng(self) -> np.random.Generator:
+        rng = np.random.default_rng([self.seed, self.reads])
+        self.reads += 1
+        return rng
+
+    def _serialize(self, coordinates: List[str], values: np.ndarray) -> str:
+        measurements = xr.DataArray(
+            values,
+            name=Strings.DATA,
+            dims=(Strings.SAMPLE),
+            coords={Strings.SAMPLE: coordinates},
+        )
+        return labop.serialize_sample_format(measurements)
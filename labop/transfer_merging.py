@@ -0,0 +1,456 @@
+"""
+Merging of liquid transfers into multi-dispense operations.
+
+Protocols written with one Transfer per pair of wells aspirate, dispense, and
+change tips once per pair.  Protocol.merge_transfers() finds runs of
+consecutive Transfer and TransferInto actions, moves independent transfers so
+that transfers of the same amount from the same well follow one another, and
+replaces each group of them with a single Dispense from that well into the
+union of their destination wells.
+
+This file monkey-patches the imported labop classes with merging functions.
+"""
+
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import sbol3
+
+import labop
+import uml
+from labop.units import MICROLITER_FACTORS
+from labop_convert.plate_coordinates import get_sample_list
+
+l = logging.getLogger(__file__)
+l.setLevel(logging.ERROR)
+
+# Predicted seconds that an OT2 takes for each pipetting motion
+TIP_CHANGE_SECONDS = 15.0
+ASPIRATE_SECONDS = 4.0
+DISPENSE_SECONDS = 3.0
+
+# Largest volume (microliters) aspirated at once for a multi-dispense
+MAX_DISPENSE_VOLUME = 300.0
+
+TRANSFERS = {"Transfer", "TransferInto"}
+
+# Inputs that a transfer may set and still be merged
+MERGEABLE_INPUTS = {"source", "destination", "amount", "dispenseVelocity"}
+
+
+@dataclass
+class TransferMergeReport:
+    """
+    The Dispense actions made by Protocol.merge_transfers(), each with the
+    identities of the transfers that it replaced, and the predicted robot
+    time of those transfers before and after merging.
+    """
+
+    dispenses: Dict[str, List[str]] = field(default_factory=dict)
+    seconds_before: float = 0.0
+    seconds_after: float = 0.0
+
+    @property
+    def seconds_saved(self) -> float:
+        return self.seconds_before - self.seconds_after
+
+
+@dataclass
+class _TransferStep:
+    node: uml.CallBehaviorAction
+    # Nodes that provide the source and destination samples, and the plates
+    # that they are on (None if unknown)
+    source: Optional[uml.ActivityNode]
+    destination: Optional[uml.ActivityNode]
+    source_plate: Optional[uml.ActivityNode]
+    destination_plate: Optional[uml.ActivityNode]
+    # Transfers with the same key can be merged (None if this one cannot)
+    key: Optional[Tuple] = None
+    wells: List[str] = field(default_factory=list)
+    amount: Optional[sbol3.Measure] = None
+    velocity: Optional[sbol3.Measure] = None
+
+    def independent(self, other: "_TransferStep") -> bool:
+        """
+        Transfers can be swapped if neither one takes samples from a plate
+        that the other one adds to.
+        """
+        plates = [
+            self.source_plate,
+            self.destination_plate,
+            other.source_plate,
+            other.destination_plate,
+        ]
+        return (
+            all(p is not None for p in plates)
+            and self.source_plate is not other.destination_plate
+            and other.source_plate is not self.destination_plate
+        )
+
+
+def protocol_merge_transfers(self) -> TransferMergeReport:
+    """
+    Merge runs of transfers into Dispense actions.  Transfers are merged if
+    they follow one another in the control flow, take the same amount from
+    the same single well (selected with PlateCoordinates), and add it to
+    disjoint wells (also selected with PlateCoordinates) of another plate.
+    PlateCoordinates actions between the transfers of a run, such as those
+    made with primitive_step() just before each transfer, are moved ahead of
+    the run if they are only used by its transfers.
+    A transfer is moved past the transfers between it and the others of its
+    group only if it is independent of them, i.e., neither one takes samples
+    from a plate that the other adds to.  Transfers that set other inputs,
+    such as the pipette or the mixing cycles, are left as they are.
+
+    Returns
+    -------
+    TransferMergeReport describing the Dispense actions that were made
+    """
+    report = TransferMergeReport()
+    for run in _transfer_runs(self):
+        transfers = [node for node in run if _is_transfer(node)]
+        steps = [_transfer_step(self, node) for node in transfers]
+        groups = _group(steps)
+        if all(len(group) == 1 for group in groups):
+            continue
+
+        predecessor = _control_neighbor(self, run[0], "incoming")
+        successor = _control_neighbor(self, run[-1], "outgoing")
+        run_nodes = {node.identity for node in run}
+        _remove_edges(
+            self,
+            lambda e: isinstance(e, uml.ControlFlow)
+            and (str(e.source) in run_nodes or str(e.target) in run_nodes),
+        )
+
+        # The PlateCoordinates between the transfers go first, in order
+        sequence = [node for node in run if not _is_transfer(node)]
+        replaced = {}
+        for group in groups:
+            if len(group) == 1:
+                sequence.append(group[0].node)
+                continue
+            # The Dispense takes samples from the source of the first transfer
+            source = _plate_coordinates_action(group[0].source)
+            for step in group:
+                for node in [step.source, step.destination]:
+                    action = _plate_coordinates_action(node)
+                    if action is not source:
+                        replaced[action.identity] = action
+            coordinates, dispense = _dispense(self, group)
+            sequence += [coordinates, dispense]
+            report.dispenses[dispense.identity] = [s.node.identity for s in group]
+            report.seconds_before += sum(_transfer_seconds(s) for s in group)
+            report.seconds_after += _dispense_seconds(group)
+
+        for source, target in zip([predecessor] + sequence, sequence + [successor]):
+            if source is not None and target is not None:
+                self.order(source, target)
+        if getattr(self, "last_step", None) is not None and (
+            self.last_step.identity in run_nodes
+        ):
+            self.last_step = sequence[-1]
+        for action in replaced.values():
+            _remove_unused(self, action)
+
+    return report
+
+
+labop.Protocol.merge_transfers = protocol_merge_transfers
+
+
+def _is_transfer(node) -> bool:
+    return (
+        isinstance(node, uml.CallBehaviorAction)
+        and node.behavior.lookup() is not None
+        and node.behavior.lookup().display_id in TRANSFERS
+    )
+
+
+def _is_plate_coordinates(node) -> bool:
+    return (
+        isinstance(node, uml.CallBehaviorAction)
+        and node.behavior.lookup() is not None
+        and node.behavior.lookup().display_id == "PlateCoordinates"
+    )
+
+
+def _transfer_runs(protocol: labop.Protocol) -> List[List[uml.ActivityNode]]:
+    """
+    Find the chains of two or more transfers in which each transfer is the
+    only control successor of the previous one, and has no other control
+    predecessor.  Transfers may also be chained through PlateCoordinates
+    actions whose outputs are only used by transfers of the chain, which are
+    included in it.
+    """
+
+    def linked(node, direction):
+        # The node that is the only control neighbor of node in direction,
+        # if node is its only control neighbor the other way
+        other = "incoming" if direction == "outgoing" else "outgoing"
+        neighbor = _control_neighbor(protocol, node, direction)
+        if (
+            neighbor is not None
+            and _control_neighbor(protocol, neighbor, other) is node
+        ):
+            return neighbor
+        return None
+
+    def chained(node, direction):
+        # The first transfer linked to node in direction, and the
+        # PlateCoordinates in between
+        between = []
+        node = linked(node, direction)
+        while _is_plate_coordinates(node):
+            between.append(node)
+            node = linked(node, direction)
+        return (node, between) if _is_transfer(node) else (None, [])
+
+    def used_outside(action, run):
+        transfers = {node.identity for node in run if _is_transfer(node)}
+        outputs = {p.identity for p in action.outputs}
+        return any(
+            e.target.lookup().get_parent().identity not in transfers
+            for e in protocol.edges
+            if str(e.source) in outputs
+        )
+
+    def split(run):
+        # Split a chain at the PlateCoordinates that are used outside of it,
+        # which are left where they are
+        for i, node in enumerate(run):
+            if not _is_transfer(node) and used_outside(node, run):
+                head = run[:i]
+                while head and not _is_transfer(head[-1]):
+                    head.pop()
+                tail = run[i + 1 :]
+                while tail and not _is_transfer(tail[0]):
+                    tail.pop(0)
+                return split(head) + split(tail)
+        return [run]
+
+    runs = []
+    for node in list(protocol.nodes):
+        if not _is_transfer(node) or chained(node, "incoming")[0] is not None:
+            continue  # Not the first transfer of its chain
+        run = [node]
+        transfer, between = chained(node, "outgoing")
+        while transfer is not None:
+            run += between + [transfer]
+            transfer, between = chained(transfer, "outgoing")
+        runs += [r for r in split(run) if len([n for n in r if _is_transfer(n)]) > 1]
+    return runs
+
+
+def _control_neighbor(
+    protocol: labop.Protocol, node: uml.ActivityNode, direction: str
+) -> Optional[uml.ActivityNode]:
+    """
+    Get the only node connected to node by an incoming or outgoing
+    ControlFlow, or None if there is not exactly one.
+    """
+    if direction == "incoming":
+        neighbors = [
+            e.source.lookup()
+            for e in protocol.incoming_edges(node)
+            if isinstance(e, uml.ControlFlow)
+        ]
+    else:
+        neighbors = [
+            e.target.lookup()
+            for e in protocol.outgoing_edges(node)
+            if isinstance(e, uml.ControlFlow)
+        ]
+    return neighbors[0] if len(neighbors) == 1 else None
+
+
+def _transfer_step(
+    protocol: labop.Protocol, node: uml.CallBehaviorAction
+) -> _TransferStep:
+    source = protocol.flow_source(next(iter(node.input_pins("source"))))
+    destination = protocol.flow_source(next(iter(node.input_pins("destination"))))
+    step = _TransferStep(
+        node=node,
+        source=source,
+        destination=destination,
+        source_plate=_plate(protocol, source),
+        destination_plate=_plate(protocol, destination),
+    )
+
+    values = {}
+    for pin in node.inputs:
+        if isinstance(pin, uml.ValuePin):
+            values.setdefault(pin.name, []).append(pin.value.get_value())
+        elif protocol.incoming_edges(pin):
+            values.setdefault(pin.name, []).append(None)
+    if (
+        not set(values).issubset(MERGEABLE_INPUTS)
+        or any(len(v) != 1 for v in values.values())
+        or not isinstance(values.get("amount", [None])[0], sbol3.Measure)
+        or step.source_plate is None
+        or step.source_plate is step.destination_plate
+    ):
+        return step
+
+    source_coordinates = _coordinates(source)
+    coordinates = _coordinates(destination)
+    if source_coordinates is None or coordinates is None:
+        return step
+    if len(get_sample_list(source_coordinates)) != 1:
+        return step
+    velocity = values.get("dispenseVelocity", [None])[0]
+    step.wells = get_sample_list(coordinates)
+    step.amount = values["amount"][0]
+    step.velocity = velocity
+    # The source well may be selected by a different PlateCoordinates action
+    # for each transfer
+    step.key = (
+        step.source_plate.identity,
+        get_sample_list(source_coordinates)[0],
+        step.destination_plate.identity,
+        (step.amount.value, step.amount.unit),
+        (velocity.value, velocity.unit) if velocity is not None else None,
+    )
+    return step
+
+
+def _plate_coordinates_action(node) -> Optional[uml.CallBehaviorAction]:
+    """Get the PlateCoordinates action that node is the output of, if any"""
+    action = node.get_parent() if isinstance(node, uml.OutputPin) else None
+    return action if _is_plate_coordinates(action) else None
+
+
+def _coordinates(node) -> Optional[str]:
+    """Get the coordinates selected by PlateCoordinates, if known statically"""
+    action = _plate_coordinates_action(node)
+    if action is None:
+        return None
+    [pin] = action.input_pins("coordinates")
+    return pin.value.get_value() if isinstance(pin, uml.ValuePin) else None
+
+
+def _plate(protocol: labop.Protocol, node) -> Optional[uml.ActivityNode]:
+    """Get the node providing the plate that node selects samples from"""
+    action = _plate_coordinates_action(node)
+    while node is not None and action is not None:
+        node = protocol.flow_source(next(iter(action.input_pins("source"))))
+        action = _plate_coordinates_action(node)
+    return node
+
+
+def _group(steps: List[_TransferStep]) -> List[List[_TransferStep]]:
+    """
+    Group the transfers that can be merged, keeping them in order except
+    for moving each transfer that joins a group ahead of the transfers that
+    it is independent of.
+    """
+    groups = []
+    remaining = list(steps)
+    while remaining:
+        group = [remaining.pop(0)]
+        skipped = []
+        for step in list(remaining):
+            wells = {w for s in group for w in s.wells}
+            if (
+                group[0].key is not None
+                and step.key == group[0].key
+                and wells.isdisjoint(step.wells)
+                and all(step.independent(s) for s in skipped)
+            ):
+                group.append(step)
+                remaining.remove(step)
+            else:
+                skipped.append(step)
+        groups.append(group)
+    return groups
+
+
+def _dispense(
+    protocol: labop.Protocol, group: List[_TransferStep]
+) -> Tuple[uml.CallBehaviorAction, uml.CallBehaviorAction]:
+    """
+    Replace a group of transfers with a PlateCoordinates action selecting
+    all of their destination wells and a Dispense into them.
+    """
+    first = group[0]
+    for step in group:
+        pins = {step.node.identity} | {p.identity for p in step.node.inputs}
+        _remove_edges(
+            protocol, lambda e: str(e.source) in pins or str(e.target) in pins
+        )
+        protocol.nodes.remove(step.node)
+
+    destination_action = _plate_coordinates_action(first.destination)
+    plate = protocol.flow_source(next(iter(destination_action.input_pins("source"))))
+    coordinates = protocol.execute_primitive(
+        "PlateCoordinates",
+        source=plate,
+        coordinates=",".join(_coordinates(s.destination) for s in group),
+    )
+    inputs = {
+        "source": first.source,
+        "destination": coordinates.output_pin("samples"),
+        "amount": sbol3.Measure(first.amount.value, first.amount.unit),
+    }
+    if first.velocity is not None:
+        inputs["dispenseVelocity"] = sbol3.Measure(
+            first.velocity.value, first.velocity.unit
+        )
+    dispense = protocol.execute_primitive("Dispense", **inputs)
+    return coordinates, dispense
+
+
+def _remove_edges(protocol: labop.Protocol, condition):
+    for edge in [e for e in protocol.edges if condition(e)]:
+        protocol.edges.remove(edge)
+
+
+def _remove_unused(protocol: labop.Protocol, action: uml.CallBehaviorAction):
+    """
+    Remove an action whose outputs are no longer used, e.g., the
+    PlateCoordinates selecting the destination of a merged transfer, and
+    connect its control predecessors to its successors.
+    """
+    outputs = {p.identity for p in action.outputs}
+    if any(str(e.source) in outputs for e in protocol.edges):
+        return
+    predecessors = [
+        e.source.lookup()
+        for e in protocol.incoming_edges(action)
+        if isinstance(e, uml.ControlFlow)
+    ]
+    successors = [
+        e.target.lookup()
+        for e in protocol.outgoing_edges(action)
+        if isinstance(e, uml.ControlFlow)
+    ]
+    nodes = {action.identity} | outputs | {p.identity for p in action.inputs}
+    _remove_edges(protocol, lambda e: str(e.source) in nodes or str(e.target) in nodes)
+    protocol.nodes.remove(action)
+    for predecessor in predecessors:
+        for successor in successors:
+            protocol.order(predecessor, successor)
+    if getattr(protocol, "last_step", None) is action:
+        protocol.last_step = (
+            predecessors[0] if len(predecessors) == 1 else protocol.initial()
+        )
+
+
+def _microliters(measure: sbol3.Measure) -> float:
+    return float(measure.value) * MICROLITER_FACTORS.get(measure.unit, 1.0)
+
+
+def _transfer_seconds(step: _TransferStep) -> float:
+    # Each destination well gets its own tip, aspiration, and dispense
+    return len(step.wells) * (TIP_CHANGE_SECONDS + ASPIRATE_SECONDS + DISPENSE_SECONDS)
+
+
+def _dispense_seconds(group: List[_TransferStep]) -> float:
+    # One tip, with as many aspirations as needed to hold the total volume
+    wells = sum(len(s.wells) for s in group)
+    aspirations = math.ceil(wells * _microliters(group[0].amount) / MAX_DISPENSE_VOLUME)
+    return (
+        TIP_CHANGE_SECONDS + aspirations * ASPIRATE_SECONDS + wells * DISPENSE_SECONDS
+    )
@@ -0,0 +1,13 @@
+"""
+Conversion factors between units of measure.
+"""
+
+import tyto
+
+# Factors to convert volumes to microliters
+MICROLITER_FACTORS = {
+    tyto.OM.nanoliter: 1e-3,
+    tyto.OM.microliter: 1.0,
+    tyto.OM.milliliter: 1e3,
+    tyto.OM.liter: 1e6,
+}
@@ -0,0 +1,139 @@
+"""
+Simulation of many generated OT2 scripts at once.
+
+simulate_ot2_scripts() runs the Opentrons simulator on the scripts in a pool
+of worker processes, so that they are simulated in parallel and apart from the
+calling process, and collects the run logs, errors, and durations into a
+SimulationReport.  When the report is written to a file, a later call skips
+the scripts whose content has not changed since, by comparing content hashes,
+unless their simulation failed (e.g., because the simulator was missing).
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+from typing import Iterable, List, Optional
+
+from labop_convert.opentrons.run_time import estimate_run_time
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.INFO)
+
+
+@dataclass
+class SimulationResult:
+    """
+    Outcome of simulating one script: the run log, or the error that stopped
+    the simulation, the seconds that the simulation took, and the predicted
+    seconds that an OT2 takes to run the script.
+    """
+
+    filename: str
+    digest: str
+    runlog: str = ""
+    error: Optional[str] = None
+    seconds: float = 0.0
+    run_time: float = 0.0
+    # Whether the result was taken from an earlier report
+    skipped: bool = False
+
+
+@dataclass
+class SimulationReport:
+    results: List[SimulationResult] = field(default_factory=list)
+
+    @property
+    def failed(self) -> List[SimulationResult]:
+        return [r for r in self.results if r.error is not None]
+
+    def write(self, filename: str):
+        with open(filename, "w") as f:
+            json.dump([asdict(r) for r in self.results], f, indent=2)
+
+    @classmethod
+    def read(cls, filename: str) -> "SimulationReport":
+        with open(filename) as f:
+            return cls([SimulationResult(**r) for r in json.load(f)])
+
+
+def script_digest(filename: str) -> str:
+    """Hash of the content of a script"""
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def simulate_ot2_scripts(
+    filenames: Iterable[str],
+    report_file: str = None,
+    max_workers: int = None,
+    force: bool = False,
+) -> SimulationReport:
+    """
+    Simulate OT2 scripts concurrently, each in a worker process.
+
+    Parameters
+    ----------
+    filenames: the scripts to simulate
+    report_file: JSON file to write the report to.  Scripts that are
+        unchanged since the report in this file was written, and were
+        simulated without error, are not simulated again, unless force is
+        set.
+    max_workers: number of worker processes (default: number of CPUs)
+
+    Returns
+    -------
+    SimulationReport with a result for each script, in order
+    """
+    filenames = list(filenames)
+    previous = {}
+    if report_file is not None and os.path.exists(report_file) and not force:
+        previous = {r.filename: r for r in SimulationReport.read(report_file).results}
+
+    results = {}
+    pending = []
+    for filename in filenames:
+        digest = script_digest(filename)
+        if (
+            filename in previous
+            and previous[filename].digest == digest
+            and previous[filename].error is None
+        ):
+            results[filename] = replace(previous[filename], skipped=True)
+        else:
+            pending.append((filename, digest))
+    logger.info(
+        f"Simulating {len(pending)} OT2 scripts, skipping {len(results)} unchanged"
+    )
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            for result in pool.map(_simulate, *zip(*pending)):
+                results[result.filename] = result
+
+    report = SimulationReport([results[filename] for filename in filenames])
+    if report_file is not None:
+        report.write(report_file)
+    return report
+
+
+def _simulate(filename: str, digest: str) -> SimulationResult:
+    result = SimulationResult(filename, digest)
+    start = time.perf_counter()
+    try:
+        with open(filename) as f:
+            script = f.read()
+        result.run_time = estimate_run_time(script.splitlines()).total
+
+        import opentrons.simulate as simulate
+
+        runlog, _ = simulate.simulate(io.StringIO(script), os.path.basename(filename))
+        result.runlog = simulate.format_runlog(runlog)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.seconds = time.perf_counter() - start
+    return result
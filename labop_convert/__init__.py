@@ -6,3 +6,6 @@ from labop_convert.behavior_specialization import (
 # from labop_convert.autoprotocol.autoprotocol_specialization import AutoprotocolSpecialization
 from labop_convert.markdown.markdown_specialization import MarkdownSpecialization
 from labop_convert.opentrons.opentrons_specialization import OT2Specialization
+from labop_convert.plate_state.plate_state_specialization import (
+    PlateStateSpecialization,
+)
@@ -73,6 +73,13 @@ class BehaviorSpecialization(ABC):
             ) as f:
                 f.write(self.data)
 
+    def on_failure(self, execution: labop.ProtocolExecution):
+        """
+        Called instead of finishing with on_end() when the execution stops
+        with an exception, e.g., to close the output of the specialization.
+        """
+        pass
+
     def process(self, record, execution: labop.ProtocolExecution):
         try:
             node = record.node.lookup()
@@ -1,3 +1,4 @@
+import io
 import json
 import logging
 import os
@@ -16,6 +17,7 @@ import labop
 import uml
 from labop.strings import Strings
 from labop_convert.behavior_specialization import BehaviorSpecialization
+from labop_convert.section_writer import SectionWriter
 
 from .protocol_to_markdown import MarkdownConverter
 
@@ -49,6 +51,22 @@ class MarkdownSpecialization(BehaviorSpecialization):
         self.doc = None
         self.propagate_objects = False
         self.sample_format = sample_format
+        # The markdown is streamed to this writer as the steps are processed
+        self.writer: SectionWriter = None
+        self._steps_written = 0
+        self._markdown_execution = None
+
+    @property
+    def data(self):
+        """The markdown of the last execution, or the results set otherwise"""
+        if self._markdown_execution is not None:
+            return self._markdown_execution.markdown
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._markdown_execution = None
+        self._data = value
 
     def initialize_protocol(self, execution: labop.ProtocolExecution, out_dir=None):
         super().initialize_protocol(execution, out_dir=out_dir)
@@ -75,6 +93,7 @@ class MarkdownSpecialization(BehaviorSpecialization):
             "https://bioprotocols.org/labop/primitives/liquid_handling/Discard": self.discard,
             "https://bioprotocols.org/labop/primitives/liquid_handling/Transfer": self.transfer,
             "https://bioprotocols.org/labop/primitives/liquid_handling/TransferByMap": self.transfer_by_map,
+            "https://bioprotocols.org/labop/primitives/liquid_handling/Dispense": self.dispense,
             "https://bioprotocols.org/labop/primitives/culturing/Transform": self.transform,
             "https://bioprotocols.org/labop/primitives/culturing/Culture": self.culture,
             "https://bioprotocols.org/labop/primitives/plate_handling/Incubate": self.incubate,
@@ -101,6 +120,30 @@ class MarkdownSpecialization(BehaviorSpecialization):
             protocol = execution.protocol.lookup()
             self.markdown_converter = MarkdownConverter(protocol.document)
 
+            if self.out_file:
+                if not os.path.exists(self.out_dir):
+                    os.mkdir(self.out_dir)
+                self.writer = SectionWriter(os.path.join(self.out_dir, self.out_file))
+            else:
+                self.writer = SectionWriter(io.StringIO())
+            self._steps_written = 0
+            self.writer.write(self._header_markdown(protocol))
+            # The inputs, outputs, materials, and subprotocols precede the
+            # steps, but are only known at the end
+            self.writer.placeholder("sections")
+
+    def process(self, record, execution: labop.ProtocolExecution):
+        super().process(record, execution)
+        if self.writer:
+            # The last step may still be extended, e.g., by an EmbeddedImage
+            self._write_steps(execution, len(execution.markdown_steps) - 1)
+
+    def _write_steps(self, execution: labop.ProtocolExecution, end: int):
+        for i in range(self._steps_written, end):
+            self.writer.write(str(i + 1) + ". " + execution.markdown_steps[i] + "\n")
+        self._steps_written = max(end, self._steps_written)
+        self.writer.flush()
+
     def _header_markdown(self, protocol):
         header = (
             "# "
@@ -253,49 +296,61 @@ class MarkdownSpecialization(BehaviorSpecialization):
         )
         execution.body = self._steps_markdown(execution, subprotocol_executions)
         execution.markdown_steps += [self.reporting_step(execution)]
-        execution.markdown += execution.header
 
+        sections = ""
         if execution.inputs:
-            execution.markdown += "\n\n## Protocol Inputs:\n"
-            execution.markdown += execution.inputs
+            sections += "\n\n## Protocol Inputs:\n"
+            sections += execution.inputs
 
         if execution.outputs:
-            execution.markdown += "\n\n## Protocol Outputs:\n"
-            execution.markdown += execution.outputs
+            sections += "\n\n## Protocol Outputs:\n"
+            sections += execution.outputs
 
-        execution.markdown += "\n\n## Protocol Materials:\n"
-        execution.markdown += self._materials_markdown(protocol, subprotocol_executions)
-        execution.markdown += "\n\n## Protocol Steps:\n"
-        execution.markdown += self._steps_markdown(execution, subprotocol_executions)
+        sections += "\n\n## Protocol Materials:\n"
+        sections += self._materials_markdown(protocol, subprotocol_executions)
+        sections += "\n\n## Protocol Steps:\n"
+        for x in subprotocol_executions:
+            sections += "\n\n##" + x.header
+            sections += x.body
+        self.writer.fill("sections", sections)
+        self._write_steps(execution, len(execution.markdown_steps))
 
         # Timestamp the protocol version
         dt = datetime.now()
         ts = datetime.timestamp(dt)
-        execution.markdown += f"---\nTimestamp: {datetime.fromtimestamp(ts)}"
+        self.writer.write(f"---\nTimestamp: {datetime.fromtimestamp(ts)}")
 
         # Print document version
         # This is a little bit kludgey, because version is not an official LabOP property
         # of Protocol
         protocol = execution.protocol.lookup()
         if hasattr(protocol, "version"):
-            execution.markdown += f"\nProtocol version: {protocol.version}"
+            self.writer.write(f"\nProtocol version: {protocol.version}")
         else:
             try:
                 tag = subprocess.check_output(["git", "describe", "--tags"]).decode(
                     "utf-8"
                 )
-                execution.markdown += f"\nProtocol version: {tag}"
+                self.writer.write(f"\nProtocol version: {tag}")
             except:
                 pass
-        execution.markdown += "\n"
+        self.writer.write("\n")
+        self.writer.close()
 
         if self.out_file:
-            if not os.path.exists(self.out_dir):
-                os.mkdir(self.out_dir)
-            with open(os.path.join(self.out_dir, self.out_file), "w") as f:
-                f.write(execution.markdown)
+            # Only read back from the file when it is used
+            execution.markdown_file = os.path.join(self.out_dir, self.out_file)
+        else:
+            execution.markdown = self.writer.sink.getvalue()
+        self.writer = None
+
+        self._markdown_execution = execution
 
-        self.data = execution.markdown
+    def on_failure(self, execution: labop.ProtocolExecution):
+        # Do not leave a truncated markdown file behind
+        if self.writer:
+            self.writer.discard()
+            self.writer = None
 
     def reporting_step(self, execution: labop.ProtocolExecution):
         output_parameters = []
@@ -718,6 +773,41 @@ class MarkdownSpecialization(BehaviorSpecialization):
         text = add_description(record, text)
         execution.markdown_steps += [text]
 
+    def dispense(
+        self, record: labop.ActivityNodeExecution, execution: labop.ProtocolExecution
+    ):
+        call = record.call.lookup()
+        parameter_value_map = call.parameter_value_map()
+
+        source = parameter_value_map["source"]["value"]
+        destination = parameter_value_map["destination"]["value"]
+        amount = parameter_value_map["amount"]["value"]
+
+        # Get coordinates if these are plates
+        source_coordinates = ""
+        if isinstance(source, labop.SampleMask):
+            source_coordinates = f"well {source.get_coordinates()[0]} of "
+            source = source.source.lookup()
+        destination_coordinates = ""
+        if isinstance(destination, labop.SampleMask):
+            destination_coordinates = (
+                f"wells {', '.join(destination.get_coordinates())} of "
+            )
+            destination = destination.source.lookup()
+
+        # Get the container specs
+        source_spec = record.document.find(source.container_type)
+        container_spec = record.document.find(destination.container_type)
+        container_class = (
+            ContainerOntology.uri + "#" + container_spec.queryString.split(":")[-1]
+        )
+        container_str = ContainerOntology.get_term_by_uri(container_class)
+
+        # Add to markdown
+        text = f"Dispense {measurement_to_text(amount)} from {source_coordinates}`{source_spec.name}` into each of {destination_coordinates}{container_str} `{container_spec.name}`."
+        text = add_description(record, text)
+        execution.markdown_steps += [text]
+
     def transfer_by_map(
         self, record: labop.ActivityNodeExecution, execution: labop.ProtocolExecution
     ):
@@ -1059,7 +1149,7 @@ class MarkdownSpecialization(BehaviorSpecialization):
 
         destination_coordinates = ""
         if isinstance(destination, labop.SampleMask):
-            destination_coordinates = f" wells {labop.deserialize_sample_format(destination.mask, destination)[Strings.SAMPLE].data.tolist()} of"
+            destination_coordinates = f" wells {destination.get_coordinates()} of"
             destination = destination.source.lookup()
         source_coordinates = source.sample_coordinates(sample_format=self.sample_format)
         if isinstance(source, labop.SampleMask):
@@ -1248,7 +1338,7 @@ class MarkdownSpecialization(BehaviorSpecialization):
         metadata = parameter_value_map["metadata"]["value"]
         df = pd.read_excel(filename, index_col=0, header=0)
         x = xr.Dataset.from_dataframe(df)
-        metadata.descriptions = json.dumps(x.to_dict())
+        metadata.descriptions = labop.serialize_sample_format(x)
         metadata.for_samples = for_samples
 
     def join_metadata(
@@ -1344,7 +1434,7 @@ def write_sample_contents(
 
 
 def read_sample_contents(
-    sample_array: Union[sbol3.Component, labop.SampleArray]
+    sample_array: Union[sbol3.Component, labop.SampleArray],
 ) -> dict:
     if not isinstance(sample_array, labop.SampleArray):
         return {"1": sample_array.identity}
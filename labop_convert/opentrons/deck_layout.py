@@ -0,0 +1,167 @@
+"""
+Optimization of the OT2 deck layout.
+
+The OT2 script addresses labware as labware<slot>, where <slot> is the deck
+slot that the protocol loaded it into.  The functions here trace the slots
+that the pipettes visit in a script, e.g., taking tips from a tip rack,
+aspirating from one plate, dispensing into another, and dropping tips in the
+trash, and search for an assignment of the labware to deck slots that
+shortens the total travel of the gantry.
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List
+
+from labop_convert.opentrons.tip_planning import TIPS_PER_RACK
+
+# Centers of the OT2 deck slots (mm), with slot 1 at the front left
+SLOT_PITCH = (132.5, 90.5)
+SLOT_POSITIONS = {
+    str(slot): (((slot - 1) % 3) * SLOT_PITCH[0], ((slot - 1) // 3) * SLOT_PITCH[1])
+    for slot in range(1, 13)
+}
+TRASH_SLOT = "12"
+
+# Slots that the thermocycler covers, besides the one it is loaded in
+THERMOCYCLER_SLOTS = ["7", "8", "10", "11"]
+
+_LABWARE_PATTERN = re.compile(r"\blabware(\d+)\b")
+_LOAD_PATTERN = re.compile(r"(load_labware\('[^']*', )'(\d+)'\)")
+_DECK_PATTERN = re.compile(r"\bDeck (\d+)\b")
+_PIPETTE_PATTERN = re.compile(r"^(\w+)\.(\w+)\(")
+
+
+def slot_distance(first: str, second: str) -> float:
+    """Distance (mm) between the centers of two deck slots"""
+    (x1, y1), (x2, y2) = SLOT_POSITIONS[first], SLOT_POSITIONS[second]
+    return math.hypot(x2 - x1, y2 - y1)
+
+
+class DeckMoves:
+    """
+    Count the moves of the pipettes between deck slots in the lines of an OT2
+    script, given one at a time with add(), e.g., as the script is written.
+    """
+
+    def __init__(self):
+        self.moves = Counter()
+        self._position = {}
+        self._pick_ups = Counter()
+
+    def add(
+        self,
+        step: str,
+        tip_racks: Dict[str, List[str]],
+        pick_ups_per_rack: Dict[str, int],
+    ):
+        """
+        Count the moves of a line of the script.  Tips are taken from the tip
+        racks of each pipette in turn, with pick_ups_per_rack pick-ups per
+        rack, and dropped into the trash.
+        """
+        match = _PIPETTE_PATTERN.match(step.strip())
+        if match is None:
+            return
+        pipette, command = match.groups()
+        if command == "pick_up_tip" and tip_racks.get(pipette):
+            racks = tip_racks[pipette]
+            rack = self._pick_ups[pipette] // pick_ups_per_rack.get(
+                pipette, TIPS_PER_RACK
+            )
+            slots = [racks[min(rack, len(racks) - 1)]]
+            self._pick_ups[pipette] += 1
+        elif command == "drop_tip":
+            slots = [TRASH_SLOT]
+        else:
+            slots = _LABWARE_PATTERN.findall(step)
+        for slot in slots:
+            if slot not in SLOT_POSITIONS:
+                continue
+            if pipette in self._position and self._position[pipette] != slot:
+                self.moves[(self._position[pipette], slot)] += 1
+            self._position[pipette] = slot
+
+
+def deck_moves(
+    script_steps: Iterable[str],
+    tip_racks: Dict[str, List[str]],
+    pick_ups_per_rack: Dict[str, int],
+) -> Counter:
+    """
+    Count the moves of the pipettes between deck slots in the lines of an OT2
+    script.  Tips are taken from the tip racks of each pipette in turn, with
+    pick_ups_per_rack pick-ups per rack, and dropped into the trash.
+
+    Returns
+    -------
+    Counter of the (from slot, to slot) moves
+    """
+    moves = DeckMoves()
+    for step in script_steps:
+        moves.add(step, tip_racks, pick_ups_per_rack)
+    return moves.moves
+
+
+def travel(moves: Counter, layout: Dict[str, str] = None) -> float:
+    """
+    Total distance (mm) of the moves after moving the labware in each slot
+    of layout to the slot that it maps to.
+    """
+    layout = layout if layout is not None else {}
+    return sum(
+        n * slot_distance(layout.get(a, a), layout.get(b, b))
+        for (a, b), n in moves.items()
+    )
+
+
+def optimize_layout(
+    moves: Counter, movable: List[str], slots: List[str]
+) -> Dict[str, str]:
+    """
+    Search for the assignment of the labware in the movable slots to the
+    given slots (which include the movable ones) that minimizes the travel of
+    the moves.  Starting from the current layout, labware is moved to a free
+    slot or swapped with other labware as long as that shortens the travel,
+    so the result is never worse than the current layout.
+
+    Returns
+    -------
+    Map from the current slot of each movable labware to its new slot
+    """
+    layout = {slot: slot for slot in movable}
+    best = travel(moves, layout)
+    improved = True
+    while improved:
+        improved = False
+        for labware in movable:
+            for slot in slots:
+                if slot == layout[labware]:
+                    continue
+                trial = dict(layout)
+                trial[labware] = slot
+                for other in movable:
+                    if other != labware and layout[other] == slot:
+                        trial[other] = layout[labware]
+                cost = travel(moves, trial)
+                if cost < best - 1e-6:
+                    layout, best, improved = trial, cost, True
+    return {old: new for old, new in layout.items() if old != new}
+
+
+def relabel_script(step: str, layout: Dict[str, str]) -> str:
+    """Rewrite a line of an OT2 script for labware moved to new slots"""
+    step = _LABWARE_PATTERN.sub(
+        lambda m: f"labware{layout.get(m.group(1), m.group(1))}", step
+    )
+    return _LOAD_PATTERN.sub(
+        lambda m: f"{m.group(1)}'{layout.get(m.group(2), m.group(2))}')", step
+    )
+
+
+def relabel_markdown(step: str, layout: Dict[str, str]) -> str:
+    """Rewrite an operator instruction for labware moved to new slots"""
+    return _DECK_PATTERN.sub(
+        lambda m: f"Deck {layout.get(m.group(1), m.group(1))}", step
+    )
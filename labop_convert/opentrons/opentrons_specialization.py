@@ -1,3 +1,4 @@
+import io
 import json
 import logging
 import os
@@ -9,8 +10,27 @@ import xarray as xr
 
 import labop
 import uml
+from labop.units import MICROLITER_FACTORS
 from labop_convert.behavior_specialization import BehaviorSpecialization
-from labop_convert.plate_coordinates import get_sample_list
+from labop_convert.opentrons.deck_layout import (
+    SLOT_POSITIONS,
+    THERMOCYCLER_SLOTS,
+    TRASH_SLOT,
+    deck_moves,
+    optimize_layout,
+    relabel_markdown,
+    relabel_script,
+)
+from labop_convert.opentrons.run_time import RunTimeEstimate, RunTimeEstimator
+from labop_convert.opentrons.tip_planning import TIPS_PER_RACK, TipPlanner
+from labop_convert.plate_coordinates import (
+    PlateGeometry,
+    full_columns,
+    get_sample_list,
+    num2row,
+)
+from labop_convert.sample_lineage import LineageIndex, SampleLineage
+from labop_convert.section_writer import SectionWriter
 
 l = logging.getLogger(__file__)
 l.setLevel(logging.ERROR)
@@ -32,8 +52,8 @@ COMPATIBLE_TIPS = {
         "opentrons_96_tiprack_1000ul",
         "opentrons_96_filtertiprack_1000ul",
     ],
-    "p300_multi_gen2": [],
-    "p20_multi_gen2": [],
+    "p300_multi_gen2": ["opentrons_96_tiprack_300ul"],
+    "p20_multi_gen2": ["opentrons_96_tiprack_10ul", "opentrons_96_filtertiprack_10ul"],
     "p10_single": ["opentrons_96_tiprack_10ul", "opentrons_96_filtertiprack_10ul"],
     "p10_multi": ["opentrons_96_tiprack_10ul", "opentrons_96_filtertiprack_10ul"],
     "p50_single": [],
@@ -46,6 +66,36 @@ COMPATIBLE_TIPS = {
     ],
 }
 
+# Pipettes with one channel per row of a 96 well plate
+MULTICHANNEL_PIPETTES = {
+    "p300_multi_gen2",
+    "p20_multi_gen2",
+    "p10_multi",
+    "p50_multi",
+    "p300_multi",
+}
+CHANNELS = 8
+
+# Range of volumes (microliters) that each multichannel pipette transfers
+MULTICHANNEL_VOLUMES = {
+    "p300_multi_gen2": (20.0, 300.0),
+    "p20_multi_gen2": (1.0, 20.0),
+    "p10_multi": (1.0, 10.0),
+    "p50_multi": (5.0, 50.0),
+    "p300_multi": (30.0, 300.0),
+}
+
+# Range of volumes (microliters) that each single channel pipette transfers
+SINGLE_CHANNEL_VOLUMES = {
+    "p20_single_gen2": (1.0, 20.0),
+    "p300_single_gen2": (20.0, 300.0),
+    "p1000_single_gen2": (100.0, 1000.0),
+    "p10_single": (1.0, 10.0),
+    "p50_single": (5.0, 50.0),
+    "p300_single": (30.0, 300.0),
+    "p1000_single": (100.0, 1000.0),
+}
+
 
 # Map terms in the Container ontology to OT2 API names
 LABWARE_MAP = {
@@ -101,18 +151,39 @@ class OT2Specialization(BehaviorSpecialization):
     }
 
     def __init__(
-        self, filename, resolutions: Dict[sbol3.Identified, str] = None
+        self,
+        filename,
+        resolutions: Dict[sbol3.Identified, str] = None,
+        optimize_layout: bool = False,
     ) -> None:
         super().__init__()
         self.resolutions = resolutions
+        # Move labware between deck slots to shorten pipette travel.  The
+        # steps are then only written at the end of the execution, once the
+        # layout is known, rather than streamed as they are processed.
+        self.optimize_layout = optimize_layout
         self.var_to_entity = {}
-        self.script = ""
+        # Steps processed since the last ones were written
         self.script_steps = []
-        self.markdown = ""
         self.markdown_steps = []
+        # The script and markdown are streamed to these writers as the steps
+        # are processed, see _write_steps()
+        self.script_writer: SectionWriter = None
+        self.markdown_writer: SectionWriter = None
+        self._markdown_written = 0
+        # Whether the script and markdown were completed by on_end()
+        self._finished = False
         self.apilevel = "2.11"
         self.configuration = {}
         self.filename = filename
+        self.tip_planner = TipPlanner()
+        # Origin of the samples on the pins of each step, built on_begin
+        self.lineage: LineageIndex = None
+        # Decks of the tip racks assigned to each pipette
+        self.tip_racks = {}
+        # Predicted run time of the script, estimated as its steps are written
+        self.run_time: RunTimeEstimate = None
+        self._run_time_estimator: RunTimeEstimator = None
 
         # Needed for using container ontology
         self.container_api_addl_conditions = "(cont:availableAt value <https://sift.net/container-ontology/strateos-catalog#Strateos>)"
@@ -127,6 +198,7 @@ class OT2Specialization(BehaviorSpecialization):
             "https://bioprotocols.org/labop/primitives/liquid_handling/Provision": self.provision,
             "https://bioprotocols.org/labop/primitives/liquid_handling/Transfer": self.transfer_to,
             "https://bioprotocols.org/labop/primitives/liquid_handling/TransferByMap": self.transfer_by_map,
+            "https://bioprotocols.org/labop/primitives/liquid_handling/Dispense": self.dispense,
             "https://bioprotocols.org/labop/primitives/sample_arrays/PlateCoordinates": self.plate_coordinates,
             "https://bioprotocols.org/labop/primitives/spectrophotometry/MeasureAbsorbance": self.measure_absorbance,
             "https://bioprotocols.org/labop/primitives/sample_arrays/EmptyRack": self.define_rack,
@@ -148,24 +220,46 @@ class OT2Specialization(BehaviorSpecialization):
 
         protocol = self.execution.protocol.lookup()
         apilevel = self.apilevel
-        self.markdown += f"# {protocol.name}\n"
-        self.script += (
+        if self.filename:
+            self.script_writer = SectionWriter(self.filename + ".py")
+            self.markdown_writer = SectionWriter(self.filename + ".md")
+        else:
+            self.script_writer = SectionWriter(io.StringIO())
+            self.markdown_writer = SectionWriter(io.StringIO())
+        self.script_steps = []
+        self.markdown_steps = []
+        self._markdown_written = 0
+        self._finished = False
+        self._run_time_estimator = RunTimeEstimator()
+
+        self.markdown_writer.write(f"# {protocol.name}\n")
+        # The materials and run time are only known at the end
+        self.markdown_writer.placeholder("materials")
+        self.markdown_writer.write("\n## Steps\n")
+        self.script_writer.write(
             "from opentrons import protocol_api\n\n"
             f"metadata = {{'apiLevel': '{apilevel}',\n"
             f"            'description': '{protocol.description}',\n"
             f"            'protocolName': '{protocol.name}'}} \n\n"
             "def run(protocol: protocol_api.ProtocolContext):\n"
         )
+        self.lineage = LineageIndex(ex)
         self.data = []
 
     def on_end(self, ex):
-        self.script += self._compile_script()
-        self.markdown += self._compile_markdown()
+        self.script_steps += self.tip_planner.drop_tips()
+        if self.optimize_layout:
+            self._optimize_layout()
+        self._write_steps(final=True)
+        self.run_time = self._run_time_estimator.estimate()
+        materials = self._materials()
+        if self.run_time is not None:
+            materials += f"\nEstimated run time: {self.run_time}\n"
+        self.markdown_writer.fill("materials", materials)
+        self.script_writer.close()
+        self.markdown_writer.close()
+        self._finished = True
         if self.filename:
-            with open(self.filename + ".py", "w") as f:
-                f.write(self.script)
-            with open(self.filename + ".md", "w") as f:
-                f.write(self.markdown)
             print(f"Successful execution. Script dumped to {self.filename}.")
         else:
             l.warn(
@@ -173,42 +267,122 @@ class OT2Specialization(BehaviorSpecialization):
             )
             self.data = f"# OT2 Script\n ```python\n{self.script}```\n # Operator Script\n {self.markdown}"
 
-    def _compile_script(self):
-        script = ""
+    def on_failure(self, ex):
+        # Do not leave a truncated script or markdown behind
+        for writer in [self.script_writer, self.markdown_writer]:
+            if writer is not None:
+                writer.discard()
+
+    @property
+    def script(self) -> str:
+        """The OT2 script of the last completed execution, or "" if none"""
+        return self._output(self.script_writer, ".py")
+
+    @property
+    def markdown(self) -> str:
+        """The operator instructions of the last completed execution"""
+        return self._output(self.markdown_writer, ".md")
+
+    def _output(self, writer: SectionWriter, extension: str) -> str:
+        # The output is only read back from its file when it is used
+        if not self._finished:
+            return ""
+        if self.filename:
+            with open(self.filename + extension) as f:
+                return f.read()
+        return writer.sink.getvalue()
+
+    def _optimize_layout(self):
+        """
+        Move the labware loaded on the deck to the slots that minimize the
+        travel of the pipettes, and rewrite the configuration and the steps
+        for the new slots.  Modules, and the labware on them, stay in place.
+        """
+        movable = [
+            deck
+            for deck, labware in self.configuration.items()
+            if deck in SLOT_POSITIONS
+            and deck != TRASH_SLOT
+            and type(labware) is labop.ContainerSpec
+        ]
+        blocked = {TRASH_SLOT}
+        for deck, labware in self.configuration.items():
+            if deck in SLOT_POSITIONS and deck not in movable:
+                blocked.add(deck)
+                if "thermocycler" in labware.display_id:
+                    blocked.update(THERMOCYCLER_SLOTS)
+        slots = [deck for deck in SLOT_POSITIONS if deck not in blocked]
+
+        moves = deck_moves(
+            self.script_steps, self.tip_racks, self._pick_ups_per_rack()
+        )
+        layout = optimize_layout(moves, movable, slots)
+        if not layout:
+            return
+        l.info(f"Moving labware between deck slots: {layout}")
+
+        self.script_steps = [relabel_script(s, layout) for s in self.script_steps]
+        self.markdown_steps = [
+            relabel_markdown(s, layout) for s in self.markdown_steps
+        ]
+        self.configuration = {
+            layout.get(deck, deck): labware
+            for deck, labware in self.configuration.items()
+        }
+        self.tip_racks = {
+            pipette: [layout.get(deck, deck) for deck in decks]
+            for pipette, decks in self.tip_racks.items()
+        }
+
+    def _pick_ups_per_rack(self) -> Dict[str, int]:
+        """Number of times that each pipette can pick up tips from a rack"""
+        return {
+            pipette: TIPS_PER_RACK // CHANNELS
+            if pipette in MULTICHANNEL_PIPETTES
+            else TIPS_PER_RACK
+            for pipette in self.tip_racks
+        }
+
+    def process(self, record, execution: labop.ProtocolExecution):
+        super().process(record, execution)
+        self._write_steps()
+
+    def _write_steps(self, final=False):
+        """
+        Write the steps added since the last call to the script and markdown,
+        and add them to the estimate of the run time.  When the layout is
+        optimized, the steps are only final at the end, so they are kept
+        until then rather than streamed.
+        """
+        if self.optimize_layout and not final:
+            return
+        pick_ups_per_rack = self._pick_ups_per_rack()
         for step in self.script_steps:
-            script += f"    {step}\n"
-        return script
-
-    def _compile_markdown(self):
-        markdown = self._materials()
-        markdown += "\n## Steps\n"
-        for i, step in enumerate(self.markdown_steps):
-            markdown += str(i + 1) + ". " + step + "\n"
-        return markdown
+            self.script_writer.write(f"    {step}\n")
+            self._run_time_estimator.add(step, self.tip_racks, pick_ups_per_rack)
+        for i, step in enumerate(self.markdown_steps, self._markdown_written + 1):
+            self.markdown_writer.write(f"{i}. {step}\n")
+        self._markdown_written += len(self.markdown_steps)
+        self.script_steps = []
+        self.markdown_steps = []
+        self.script_writer.flush()
+        self.markdown_writer.flush()
 
-    def _tipracks(self, left, right):
-        leftTipID = left["pipette"]
-        rightTipID = right["pipette"]
-        tipCount = 0
-        tipList = ""
+    def _tipracks(self):
+        """
+        List the tips that each pipette picks up, and the minimum number of
+        tip racks that hold them.
+        """
         markdown = ""
-        for tiprack in left["tipracks"]:
-            tiprackID = tiprack["id"]
-            tiprackDeck = tiprack["deck"]
-            tipList += f"leftTiprack{tipCount},"
-            markdown += f"leftTiprack{tipCount} = protocol.load_labware('{tiprackID}', {tiprackDeck})\n"
-            tipCount += 1
-        markdown += f"left = protocol.load_instrument('{leftTipID}', 'left', tip_rack={tipList[:-1]})\n"
-        tipCount = 0
-        tipList = ""
-        for tiprack in right["tipracks"]:
-            tiprackID = tiprack["id"]
-            tiprackDeck = tiprack["deck"]
-            tipList += f"rightTiprack{tipCount},"
-            markdown += f"rightTiprack{tipCount} = protocol.load_labware('{tiprackID}', {tiprackDeck})\n"
-            tipCount += 1
-        markdown += f"right = protocol.load_instrument('{rightTipID}', 'right', tip_rack={tipList[:-1]})\n"
-        # return markdown
+        for pipette, tips in self.tip_planner.tips.items():
+            racks = self.tip_planner.racks(pipette)
+            loaded = len(self.tip_racks.get(pipette, []))
+            markdown += f"* {racks} tip rack{'s' if racks > 1 else ''} for `{pipette}` ({tips} tip{'s' if tips > 1 else ''})\n"
+            if loaded < racks:
+                l.warning(
+                    f"{pipette} uses {tips} tips, but only {loaded} of the {racks} tip racks they need are loaded"
+                )
+        return markdown
 
     def _materials(self):
         protocol = self.execution.protocol.lookup()
@@ -264,6 +438,7 @@ class OT2Specialization(BehaviorSpecialization):
                 text += "\n"
                 markdown += text
 
+        markdown += self._tipracks()
         return markdown
 
     def _parameter_value_markdown(self, pv: labop.ParameterValue, is_output=False):
@@ -317,33 +492,20 @@ class OT2Specialization(BehaviorSpecialization):
         resource = parameter_value_map["resource"]["value"]
         amount = parameter_value_map["amount"]["value"]
         amount = measurement_to_text(amount)
-        coords = ""
-        coords = (
-            destination.get_parent()
-            .get_parent()
-            .token_source.lookup()
-            .node.lookup()
-            .input_pin("coordinates")
-            .value.value
-        )
-        upstream_execution = get_token_source("destination", record)
-        container = upstream_execution.call.lookup().parameter_value_map()["container"][
-            "value"
-        ]
-
-        behavior_type = get_behavior_type(upstream_execution)
-        if behavior_type == "LoadContainerInRack":
-            coords = upstream_execution.call.lookup().parameter_value_map()[
-                "coordinates"
-            ]["value"]
-            upstream_execution = get_token_source("slots", upstream_execution)
-            rack = upstream_execution.call.lookup().parameter_value_map()[
-                "specification"
-            ]["value"]
-        else:
+        lineage = self._lineage(record, "destination")
+        if lineage.behavior_type != "LoadContainerInRack":
             raise NotImplementedError(
-                f'A "Provision" call cannot follow a "{behavior_type}" call'
+                f'A "Provision" call cannot follow a "{lineage.behavior_type}" call'
             )
+        container = lineage.container
+        rack = lineage.rack
+        coords = lineage.coordinates
+
+        # Tips may be reused for the wells that hold the same resource
+        for deck, labware in self.configuration.items():
+            if labware == rack:
+                for c in get_sample_list(coords):
+                    self.tip_planner.fill(f"labware{deck}['{c}']", resource.identity)
 
         container_str = (
             f"`{container.name}`" if container.name else container.queryString
@@ -367,87 +529,14 @@ class OT2Specialization(BehaviorSpecialization):
         mount = parameter_value_map["pipette"]["value"] # newly defined parameter
         # OT2Pipette = "left"
 
-        # Trace the "source" pin back to the EmptyContainer to retrieve the
-        # ContainerSpec for the destination container
-        upstream_execution = record.get_token_source(
-            parameter_value_map["source"]["parameter"].property_value
-        )
-        behavior_type = get_behavior_type(upstream_execution)
-        if behavior_type == "PlateCoordinates":
-            upstream_map = upstream_execution.call.lookup().parameter_value_map()
-            coordinates = upstream_map["coordinates"]["value"]
-            upstream_execution = upstream_execution.get_token_source(
-                upstream_map["source"]["parameter"].property_value
-            )  # EmptyContainer
-            parameter_value_map = upstream_execution.call.lookup().parameter_value_map()
-            source_container = parameter_value_map["specification"]["value"]
-        elif behavior_type == "LoadContainerInRack":
-            upstream_execution = upstream_execution.get_token_source(
-                upstream_map["slots"]["parameter"].property_value
-            )  # EmptyRack
-            parameter_value_map = upstream_execution.call.lookup().parameter_value_map()
-            source_container = parameter_value_map["specification"]["value"]
-        elif behavior_type == "LoadContainerOnInstrument":
-            upstream_map = upstream_execution.call.lookup().parameter_value_map()
-            coordinates = upstream_map["slots"]["value"]
-            upstream_execution = upstream_execution.get_token_source(
-                upstream_map["container"]["parameter"].property_value
-            )  # EmptyContainer
-            parameter_value_map = upstream_execution.call.lookup().parameter_value_map()
-            source_container = parameter_value_map["specification"]["value"]
-
-        else:
-            raise Exception(f'Invalid input pin "source" for Transfer.')
-
-        # Map the source container to a variable name in the OT2 api script
-        source_name = None
-        for deck, labware in self.configuration.items():
-            if labware == source_container:
-                source_name = f"labware{deck}"
-                break
-        if not source_name:
-            raise Exception(f"{source_container} is not loaded.")
-
-        # Trace the "destination" pin back to the EmptyContainer execution
-        # to retrieve the ContainerSpec for the destination container
-        parameter_value_map = call.parameter_value_map()
-        upstream_execution = record.get_token_source(
-            parameter_value_map["destination"]["parameter"].property_value
+        # Look up the ContainerSpecs of the source and destination containers,
+        # and map them to variable names in the OT2 api script
+        source_container = self._lineage(record, "source").labware
+        source_name = self._labware_name(source_container)
+        destination_container = self._lineage(record, "destination").labware
+        destination_name = self._labware_name(
+            destination_container, get_sample_list(destination.mask)[0]
         )
-        behavior_type = get_behavior_type(upstream_execution)
-        if behavior_type == "PlateCoordinates":
-            upstream_map = upstream_execution.call.lookup().parameter_value_map()
-            coordinates = upstream_map["coordinates"]["value"]
-            upstream_execution = upstream_execution.get_token_source(
-                upstream_map["source"]["parameter"].property_value
-            )  # EmptyContainer
-            parameter_value_map = upstream_execution.call.lookup().parameter_value_map()
-            destination_container = parameter_value_map["specification"]["value"]
-
-        elif behavior_type == "LoadContainerOnInstrument":
-            upstream_map = upstream_execution.call.lookup().parameter_value_map()
-            coordinates = upstream_map["slots"]["value"]
-            upstream_execution = upstream_execution.get_token_source(
-                upstream_map["container"]["parameter"].property_value
-            )  # EmptyContainer
-            parameter_value_map = upstream_execution.call.lookup().parameter_value_map()
-            destination_container = parameter_value_map["specification"]["value"]
-
-        else:
-            raise Exception(f'Invalid input pin "destination" for Transfer.')
-        destination_name = None
-        for deck, labware in self.configuration.items():
-            if type(labware) is sbol3.Agent and hasattr(labware, "configuration"):
-                # If labware is a hardware module (i.e. Agent),
-                # then we need to look further to find out what conta
-                coordinate = get_sample_list(destination.mask)[0]
-                if coordinate in labware.configuration:
-                    labware = labware.configuration[coordinate]
-            if labware == destination_container:
-                destination_name = f"labware{deck}"
-                break
-        if not destination_name:
-            raise Exception(f"{destination_container} is not loaded.")
 
         # TODO: automatically choose pipette based on transferred volume
         if not self.configuration:
@@ -466,11 +555,34 @@ class OT2Specialization(BehaviorSpecialization):
 
         source_str = source.mask
         destination_str = destination.mask
-        for c_source in get_sample_list(source.mask):
-            for c_destination in get_sample_list(destination.mask):
-                self.script_steps += [
-                    f"{pipette.display_id}.transfer({value}, {source_name}['{c_source}'], {destination_name}['{c_destination}'])  {comment}"
-                ]
+        amount = parameter_value_map["amount"]["value"]
+        column_transfers = self._column_transfers(
+            pipette,
+            amount.value * MICROLITER_FACTORS.get(amount.unit, 1.0),
+            source_container,
+            source.mask,
+            destination_container,
+            destination.mask,
+        )
+        if column_transfers:
+            # Transfer whole columns at once with a multichannel pipette
+            pipette, columns = column_transfers
+            for source_column, destination_column in columns:
+                self.script_steps += self.tip_planner.liquid_handling(
+                    pipette.display_id,
+                    [f"{source_name}['{c}']" for c in source_column],
+                    [[f"{destination_name}['{c}']"] for c in destination_column],
+                    f"{pipette.display_id}.transfer({value}, {source_name}['{source_column[0]}'], {destination_name}['{destination_column[0]}'], new_tip='never')  {comment}",
+                )
+        else:
+            for c_source in get_sample_list(source.mask):
+                for c_destination in get_sample_list(destination.mask):
+                    self.script_steps += self.tip_planner.liquid_handling(
+                        pipette.display_id,
+                        [f"{source_name}['{c_source}']"],
+                        [[f"{destination_name}['{c_destination}']"]],
+                        f"{pipette.display_id}.transfer({value}, {source_name}['{c_source}'], {destination_name}['{c_destination}'], new_tip='never')  {comment}",
+                    )
 
         text = f"Transfer {value} {units} of resouce from {source_name} into {destination_name}"
         self.markdown_steps += [text]
@@ -492,47 +604,12 @@ class OT2Specialization(BehaviorSpecialization):
         mount = parameter_value_map["coordinates"]["value"] # using an arbitrary unused parameter defined in liquid_handling library
         # OT2Pipette = "left"
 
-        # Trace the "source" pin back to the EmptyContainer to retrieve the
-        # ContainerSpec for the destination container
-        upstream_execution = record.get_token_source("source")
-        behavior_type = get_behavior_type(upstream_execution)
-        if behavior_type == "LoadContainerInRack":
-            upstream_execution = upstream_execution.get_token_source(
-                "slots"
-            )  # EmptyRack
-            parameter_value_map = upstream_execution.call.lookup().parameter_value_map()
-            source_container = parameter_value_map["specification"]["value"]
-        else:
-            raise Exception(f'Invalid input pin "source" for Transfer.')
-
-        # Map the source container to a variable name in the OT2 api script
-        source_name = None
-        for deck, labware in self.configuration.items():
-            if labware == source_container:
-                source_name = f"labware{deck}"
-                break
-        if not source_name:
-            raise Exception(f"{source_container} is not loaded.")
-
-        # Trace the "destination" pin back to the EmptyContainer execution
-        # to retrieve the ContainerSpec for the destination container
-        upstream_execution = record.get_token_source("destination")
-        behavior_type = get_behavior_type(upstream_execution)
-        if behavior_type == "PlateCoordinates":
-            upstream_execution = get_token_source(
-                "source", upstream_execution
-            )  # EmptyContainer
-            parameter_value_map = upstream_execution.call.lookup().parameter_value_map()
-            destination_container = parameter_value_map["specification"]["value"]
-        else:
-            raise Exception(f'Invalid input pin "destination" for Transfer.')
-        destination_name = None
-        for deck, labware in self.configuration.items():
-            if labware == destination_container:
-                destination_name = f"labware{deck}"
-                break
-        if not destination_name:
-            raise Exception(f"{destination_container} is not loaded.")
+        # Map the source and destination containers to variable names in the
+        # OT2 api script
+        source_name = self._labware_name(self._lineage(record, "source").labware)
+        destination_name = self._labware_name(
+            self._lineage(record, "destination").labware
+        )
 
         # TODO: automatically choose pipette based on transferred volume
         if not self.configuration:
@@ -546,9 +623,175 @@ class OT2Specialization(BehaviorSpecialization):
         destination_str = destination.mask
         for c_source in get_sample_list(source.mask):
             for c_destination in get_sample_list(destination.mask):
-                self.script_steps += [
-                    f"{pipette.display_id}.transfer({value}, {source_name}['{c_source}'], {destination_name}['{c_destination}'])"
-                ]
+                self.script_steps += self.tip_planner.liquid_handling(
+                    pipette.display_id,
+                    [f"{source_name}['{c_source}']"],
+                    [[f"{destination_name}['{c_destination}']"]],
+                    f"{pipette.display_id}.transfer({value}, {source_name}['{c_source}'], {destination_name}['{c_destination}'], new_tip='never')",
+                )
+
+    def _column_transfers(
+        self,
+        pipette: sbol3.Agent,
+        volume: float,
+        source_container: labop.ContainerSpec,
+        source_coordinates: str,
+        destination_container: labop.ContainerSpec,
+        destination_coordinates: str,
+    ):
+        """
+        Pair up the columns of a transfer from whole columns of a plate into
+        whole columns of another, e.g., "A1:H1" into "A3:H3", for a
+        multichannel pipette.  Source columns are repeated when the
+        destination holds replicates of them.
+
+        Returns
+        -------
+        The multichannel pipette and a list of the coordinates of each pair
+        of source and destination columns, or None if the transferring
+        pipette is not a multichannel pipette or the columns do not line up.
+        The transferring pipette is used if volume (microliters) is in its
+        range, otherwise the first configured multichannel pipette whose
+        range it is in.
+        """
+        if pipette.display_id not in MULTICHANNEL_PIPETTES:
+            return None
+        in_range = [
+            p
+            for p in [pipette] + list(self.configuration.values())
+            if type(p) is sbol3.Agent
+            and p.display_id in MULTICHANNEL_VOLUMES
+            and MULTICHANNEL_VOLUMES[p.display_id][0]
+            <= volume
+            <= MULTICHANNEL_VOLUMES[p.display_id][1]
+        ]
+        pipette = in_range[0] if in_range else pipette
+
+        columns = []
+        for container, coordinates in [
+            (source_container, source_coordinates),
+            (destination_container, destination_coordinates),
+        ]:
+            if (
+                not isinstance(coordinates, str)
+                or PlateGeometry.from_container_spec(container).rows != CHANNELS
+            ):
+                return None
+            columns.append(full_columns(coordinates, CHANNELS))
+        source_columns, destination_columns = columns
+        if (
+            not source_columns
+            or not destination_columns
+            or len(destination_columns) % len(source_columns)
+        ):
+            return None
+
+        def wells(column):
+            return [f"{num2row(row + 1)}{column + 1}" for row in range(CHANNELS)]
+
+        replicates = len(destination_columns) // len(source_columns)
+        return pipette, [
+            (wells(s), wells(d))
+            for s, d in zip(source_columns * replicates, destination_columns)
+        ]
+
+    def dispense(
+        self, record: labop.ActivityNodeExecution, ex: labop.ProtocolExecution
+    ):
+        call = record.call.lookup()
+        parameter_value_map = call.parameter_value_map()
+        destination = parameter_value_map["destination"]["value"]
+        source = parameter_value_map["source"]["value"]
+        value = parameter_value_map["amount"]["value"].value
+        units = parameter_value_map["amount"]["value"].unit
+        units = tyto.OM.get_term_by_uri(units)
+
+        source_name = self._labware_name(self._lineage(record, "source").labware)
+        destination_name = self._labware_name(
+            self._lineage(record, "destination").labware
+        )
+
+        # Dispense does not name a pipette, so use the first single channel
+        # pipette mounted whose range holds the volume
+        amount = parameter_value_map["amount"]["value"]
+        volume = amount.value * MICROLITER_FACTORS.get(amount.unit, 1.0)
+        pipettes = [
+            self.configuration[m]
+            for m in ["left", "right"]
+            if m in self.configuration
+            and self.configuration[m].display_id in SINGLE_CHANNEL_VOLUMES
+        ]
+        if not pipettes:
+            raise Exception(
+                "Dispense call failed. Use ConfigureRobot to configure a single channel pipette"
+            )
+        in_range = [
+            p
+            for p in pipettes
+            if SINGLE_CHANNEL_VOLUMES[p.display_id][0]
+            <= volume
+            <= SINGLE_CHANNEL_VOLUMES[p.display_id][1]
+        ]
+        if not in_range:
+            raise Exception(
+                f"Dispense call failed. No configured pipette can dispense {value} {units}"
+            )
+        pipette = in_range[0]
+
+        comment = record.node.lookup().name
+        comment = (
+            "# " + comment
+            if comment
+            else "# Dispense ActivityNode name is not defined."
+        )
+
+        c_source = get_sample_list(source.mask)[0]
+        c_destinations = get_sample_list(destination.mask)
+        wells = [f"{destination_name}['{c}']" for c in c_destinations]
+        self.script_steps += self.tip_planner.liquid_handling(
+            pipette.display_id,
+            [f"{source_name}['{c_source}']"],
+            [wells],
+            f"{pipette.display_id}.distribute({value}, {source_name}['{c_source}'], [{', '.join(wells)}], new_tip='never')  {comment}",
+        )
+
+        text = f"Dispense {value} {units} of resource from {source_name} into each of {len(c_destinations)} wells of {destination_name}"
+        self.markdown_steps += [text]
+
+    def _lineage(
+        self, record: labop.ActivityNodeExecution, parameter: str
+    ) -> SampleLineage:
+        """
+        Look up the container, rack and coordinates of the samples on the
+        parameter pin of record.
+        """
+        samples = record.call.lookup().parameter_value_map()[parameter]["value"]
+        lineage = self.lineage.get(samples)
+        if lineage is None or lineage.labware is None:
+            raise Exception(
+                f'Invalid input pin "{parameter}" for {get_behavior_type(record)}.'
+            )
+        return lineage
+
+    def _labware_name(
+        self, container: labop.ContainerSpec, coordinate: str = None
+    ) -> str:
+        """
+        Get the variable name of the labware of container in the OT2 api
+        script.  The container may also be held at coordinate by a hardware
+        module.
+        """
+        for deck, labware in self.configuration.items():
+            if type(labware) is sbol3.Agent and hasattr(labware, "configuration"):
+                # If labware is a hardware module (i.e. Agent),
+                # then we need to look further to find out what container it holds
+                if coordinate in labware.configuration:
+                    labware = labware.configuration[coordinate]
+                elif container in labware.configuration.values():
+                    labware = container
+            if labware == container:
+                return f"labware{deck}"
+        raise Exception(f"{container} is not loaded.")
 
     def plate_coordinates(
         self, record: labop.ActivityNodeExecution, ex: labop.ProtocolExecution
@@ -656,11 +899,13 @@ class OT2Specialization(BehaviorSpecialization):
         instrument: sbol3.Agent = parameter_value_map["instrument"]["value"]
         samples: labop.SampleArray = parameter_value_map["samples"]["value"]
 
-        # Assume 96 well plate
-        aliquots = get_sample_list(geometry="A1:H12")
+        aliquots = get_sample_list(
+            geometry=PlateGeometry.from_container_spec(container_spec)
+        )
         samples.initial_contents = json.dumps(
             xr.DataArray(aliquots, dims=("aliquot")).to_dict()
         )
+        samples.mask = slots
 
         # upstream_ex = get_token_source('container', record)
         # container_spec = upstream_ex.call.lookup().parameter_value_map()['specification']['value']
@@ -733,6 +978,7 @@ class OT2Specialization(BehaviorSpecialization):
                 self.script_steps += [
                     f"{select_pipette}.tip_racks.append(labware{coords})"
                 ]
+                self.tip_racks.setdefault(select_pipette, []).append(coords)
 
     def configure_robot(
         self, record: labop.ActivityNodeExecution, ex: labop.ProtocolExecution
@@ -792,6 +1038,7 @@ class OT2Specialization(BehaviorSpecialization):
             self.script_steps += [
                 f"{instrument.display_id}.tip_racks.append(labware{deck})"
             ]
+            self.tip_racks.setdefault(instrument.display_id, []).append(deck)
 
     def pcr(
         self, record: labop.ActivityNodeExecution, execution: labop.ProtocolExecution
@@ -900,7 +1147,12 @@ class OT2Specialization(BehaviorSpecialization):
             else "# Mix ActivityNode name is not defined."
         )
         # labware 7 temporarily hard coded
-        self.script_steps += [f"{pipette.display_id}.mix({cycleCount}, {value}, labware7['{samples.mask}'])    {comment}"]
+        well = f"labware7['{samples.mask}']"
+        self.script_steps += self.tip_planner.mix(
+            pipette.display_id,
+            [well],
+            f"{pipette.display_id}.mix({cycleCount}, {value}, {well})    {comment}",
+        )
 
     def hold(
         self, record: labop.ActivityNodeExecution, ex: labop.ProtocolExecution
@@ -0,0 +1,253 @@
+"""
+Estimation of the run time of OT2 scripts.
+
+The estimate is computed from the lines of the script, without the Opentrons
+simulator: each pipette command takes a fixed time per motion (as in
+labop.transfer_merging) plus the time to aspirate and dispense its volume at
+the pipette's default flow rates, the gantry travels between deck slots at a
+constant speed, and the thermocycler ramps between temperatures at a constant
+rate and holds them for the requested times.
+"""
+
+import ast
+import math
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from typing import Dict, Iterable, List
+
+from labop.transfer_merging import (
+    ASPIRATE_SECONDS,
+    DISPENSE_SECONDS,
+    TIP_CHANGE_SECONDS,
+)
+from labop_convert.opentrons.deck_layout import DeckMoves, travel
+
+
+@dataclass
+class PipetteModel:
+    """Largest volume (microliters) and default flow rates (microliters/s)"""
+
+    max_volume: float
+    aspirate_rate: float
+    dispense_rate: float
+
+
+PIPETTE_MODELS = {
+    "p20_single_gen2": PipetteModel(20.0, 3.78, 7.56),
+    "p300_single_gen2": PipetteModel(300.0, 46.43, 92.86),
+    "p1000_single_gen2": PipetteModel(1000.0, 137.35, 274.7),
+    "p20_multi_gen2": PipetteModel(20.0, 7.6, 7.6),
+    "p300_multi_gen2": PipetteModel(300.0, 94.0, 94.0),
+    "p10_single": PipetteModel(10.0, 5.0, 10.0),
+    "p10_multi": PipetteModel(10.0, 5.0, 10.0),
+    "p50_single": PipetteModel(50.0, 25.0, 50.0),
+    "p50_multi": PipetteModel(50.0, 25.0, 50.0),
+    "p300_single": PipetteModel(300.0, 150.0, 300.0),
+    "p300_multi": PipetteModel(300.0, 150.0, 300.0),
+    "p1000_single": PipetteModel(1000.0, 500.0, 1000.0),
+}
+
+# Speed of the gantry between deck slots (mm/s)
+GANTRY_SPEED = 400.0
+
+# Thermocycler block and lid ramp rates (degrees C/s), starting temperature,
+# and time to open or close the lid
+BLOCK_RAMP_RATE = 2.0
+LID_RAMP_RATE = 0.5
+AMBIENT_TEMPERATURE = 25.0
+LID_SECONDS = 20.0
+
+HOLD_TIME_FACTORS = {
+    "hold_time_seconds": 1.0,
+    "hold_time_minutes": 60.0,
+    "hold_time_hours": 3600.0,
+}
+
+
+@dataclass
+class RunTimeEstimate:
+    """
+    Predicted seconds that an OT2 spends changing tips, aspirating and
+    dispensing, moving between deck slots, and waiting for modules or
+    delays.
+    """
+
+    tips: float = 0.0
+    pipetting: float = 0.0
+    travel: float = 0.0
+    waiting: float = 0.0
+
+    @property
+    def total(self) -> float:
+        return self.tips + self.pipetting + self.travel + self.waiting
+
+    def __str__(self) -> str:
+        minutes = math.ceil(self.total / 60.0)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours} h {minutes:02d} min" if hours else f"{minutes} min"
+
+
+class RunTimeEstimator:
+    """
+    Estimate the run time of an OT2 script from its lines, given one at a
+    time with add(), e.g., as the script is written, without keeping them.
+    """
+
+    def __init__(self):
+        self.moves = DeckMoves()
+        self._estimate = RunTimeEstimate()
+        self._temperatures = defaultdict(lambda: AMBIENT_TEMPERATURE)
+        self._variables = {}
+
+    def add(
+        self,
+        step: str,
+        tip_racks: Dict[str, List[str]] = None,
+        pick_ups_per_rack: Dict[str, int] = None,
+    ):
+        """
+        Add the time of a line of the script, given the deck slots of the
+        tip racks of each pipette (see deck_layout.DeckMoves.add).
+        """
+        self.moves.add(step, tip_racks or {}, pick_ups_per_rack or {})
+        estimate = self._estimate
+        try:
+            [statement] = ast.parse(step.strip()).body
+        except (SyntaxError, ValueError):
+            return  # Not a single statement, e.g., a comment
+        if isinstance(statement, ast.Assign):
+            try:
+                value = ast.literal_eval(statement.value)
+            except ValueError:
+                return
+            for target in statement.targets:
+                if isinstance(target, ast.Name):
+                    self._variables[target.id] = value
+            return
+        call = statement.value if isinstance(statement, ast.Expr) else None
+        if not (
+            isinstance(call, ast.Call)
+            and isinstance(call.func, ast.Attribute)
+            and isinstance(call.func.value, ast.Name)
+        ):
+            return
+        instrument, command = call.func.value.id, call.func.attr
+        args = [_value(a, self._variables) for a in call.args]
+        kwargs = {k.arg: _value(k.value, self._variables) for k in call.keywords}
+
+        temperatures = self._temperatures
+        if command in ["pick_up_tip", "drop_tip"]:
+            estimate.tips += TIP_CHANGE_SECONDS / 2
+        elif instrument in PIPETTE_MODELS:
+            estimate.pipetting += _pipetting_seconds(
+                PIPETTE_MODELS[instrument], command, args
+            )
+        elif command == "delay":
+            estimate.waiting += _number(kwargs.get("seconds")) + 60.0 * _number(
+                kwargs.get("minutes")
+            )
+        elif command in ["open_lid", "close_lid"]:
+            estimate.waiting += LID_SECONDS
+        elif command == "set_lid_temperature":
+            temperature = kwargs.get("temperature", args[0] if args else None)
+            estimate.waiting += _ramp(
+                temperatures, instrument + ".lid", temperature, LID_RAMP_RATE
+            )
+        elif command in ["set_block_temperature", "set_temperature"]:
+            temperature = kwargs.get("temperature", args[0] if args else None)
+            estimate.waiting += _ramp(
+                temperatures, instrument, temperature, BLOCK_RAMP_RATE
+            )
+            estimate.waiting += _hold_seconds(kwargs)
+        elif command == "execute_profile":
+            repetitions = int(_number(kwargs.get("repetitions"), 1))
+            for _ in range(repetitions):
+                for profile_step in kwargs.get("steps") or []:
+                    estimate.waiting += _ramp(
+                        temperatures,
+                        instrument,
+                        profile_step.get("temperature"),
+                        BLOCK_RAMP_RATE,
+                    )
+                    estimate.waiting += _hold_seconds(profile_step)
+
+    def estimate(self) -> RunTimeEstimate:
+        """Get the estimate of the run time of the lines added so far"""
+        return replace(self._estimate, travel=travel(self.moves.moves) / GANTRY_SPEED)
+
+
+def estimate_run_time(
+    script_steps: Iterable[str],
+    tip_racks: Dict[str, List[str]] = None,
+    pick_ups_per_rack: Dict[str, int] = None,
+) -> RunTimeEstimate:
+    """
+    Estimate the run time of the lines of an OT2 script, given the deck
+    slots of the tip racks of each pipette (see deck_layout.deck_moves).
+    """
+    estimator = RunTimeEstimator()
+    for step in script_steps:
+        estimator.add(step, tip_racks, pick_ups_per_rack)
+    return estimator.estimate()
+
+
+def _value(node: ast.AST, variables: Dict):
+    """Get the value of a literal or of a variable assigned a literal"""
+    if isinstance(node, ast.Name):
+        return variables.get(node.id)
+    if isinstance(node, ast.List):
+        return [_value(e, variables) for e in node.elts]
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        return None  # e.g., a well, such as labware1['A1']
+
+
+def _number(value, default: float = 0.0) -> float:
+    return float(value) if isinstance(value, (int, float)) else default
+
+
+def _hold_seconds(arguments: Dict) -> float:
+    return sum(
+        _number(arguments.get(k)) * factor for k, factor in HOLD_TIME_FACTORS.items()
+    )
+
+
+def _pipetting_seconds(pipette: PipetteModel, command: str, args: List) -> float:
+    if command == "transfer" and args:
+        volume = _number(args[0])
+        aspirations = max(math.ceil(volume / pipette.max_volume), 1)
+        return aspirations * (ASPIRATE_SECONDS + DISPENSE_SECONDS) + volume * (
+            1.0 / pipette.aspirate_rate + 1.0 / pipette.dispense_rate
+        )
+    if command == "distribute" and len(args) > 2:
+        volume = _number(args[0])
+        wells = len(args[2]) if isinstance(args[2], list) else 1
+        aspirations = max(math.ceil(wells * volume / pipette.max_volume), 1)
+        return (
+            aspirations * ASPIRATE_SECONDS
+            + wells * DISPENSE_SECONDS
+            + wells
+            * volume
+            * (1.0 / pipette.aspirate_rate + 1.0 / pipette.dispense_rate)
+        )
+    if command == "mix" and len(args) > 1:
+        cycles, volume = _number(args[0]), _number(args[1])
+        return ASPIRATE_SECONDS + cycles * volume * (
+            1.0 / pipette.aspirate_rate + 1.0 / pipette.dispense_rate
+        )
+    if command in ["aspirate", "dispense"] and args:
+        volume = _number(args[0])
+        if command == "aspirate":
+            return ASPIRATE_SECONDS + volume / pipette.aspirate_rate
+        return DISPENSE_SECONDS + volume / pipette.dispense_rate
+    return 0.0
+
+
+def _ramp(temperatures: Dict, module: str, temperature, rate: float) -> float:
+    """Time to ramp a module to temperature, which it then holds"""
+    if not isinstance(temperature, (int, float)):
+        return 0.0
+    seconds = abs(float(temperature) - temperatures[module]) / rate
+    temperatures[module] = float(temperature)
+    return seconds
@@ -0,0 +1,100 @@
+"""
+Planning of pipette tip use for OT2 scripts.
+
+By default, each transfer in an OT2 script picks up a new tip and drops it
+afterwards.  The TipPlanner keeps track of the liquid that each well holds and
+the liquid that each pipette's tip has touched, so that a tip is kept for as
+long as it only takes the same reagent and only dispenses into wells that hold
+nothing else.  Liquid handling commands are then emitted with
+new_tip='never', between explicit pick_up_tip() and drop_tip() commands.
+"""
+
+import math
+from collections import defaultdict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+# Tips held by a 96 tip rack
+TIPS_PER_RACK = 96
+
+
+class TipPlanner:
+    """
+    Decide when each pipette changes its tip.  Wells are named by their
+    expression in the OT2 script, e.g., "labware1['A1']", and pipettes by
+    their variable name.
+    """
+
+    def __init__(self):
+        # Reagents (or, if unknown, source wells) that each well holds
+        self.contents: Dict[str, Set[str]] = defaultdict(set)
+        # Reagents that the tip on each channel of each pipette has taken up,
+        # None if the pipette holds no tips
+        self.tip_reagents: Dict[str, Optional[Tuple[FrozenSet[str], ...]]] = {}
+        # Number of tips picked up by each pipette
+        self.tips: Dict[str, int] = defaultdict(int)
+
+    def fill(self, well: str, reagent: str):
+        """Record that reagent was put into well by the operator"""
+        self.contents[well].add(reagent)
+
+    def liquid_handling(
+        self,
+        pipette: str,
+        sources: List[str],
+        destinations: List[List[str]],
+        command: str,
+    ) -> List[str]:
+        """
+        Plan the tips for a command that moves liquid with pipette.  Each
+        channel of the pipette takes liquid from one of the sources, and
+        dispenses it into the corresponding list of destination wells.  The
+        command must not change tips itself, i.e., it must pass
+        new_tip='never'.
+
+        Returns
+        -------
+        Lines of the OT2 script: the command, after picking up new tips if
+        the pipette's tips hold other reagents, and followed by dropping the
+        tips if they touched other reagents in a destination well.
+        """
+        reagents = tuple(frozenset(self.contents[s] or {s}) for s in sources)
+        lines = []
+        if self.tip_reagents.get(pipette) != reagents:
+            lines += self.drop_tip(pipette)
+            lines.append(f"{pipette}.pick_up_tip()")
+            self.tips[pipette] += len(sources)
+            self.tip_reagents[pipette] = reagents
+        lines.append(command)
+
+        contaminated = False
+        for channel_reagents, channel_destinations in zip(reagents, destinations):
+            for destination in channel_destinations:
+                contaminated |= not self.contents[destination] <= channel_reagents
+                self.contents[destination] |= channel_reagents
+        if contaminated:
+            lines += self.drop_tip(pipette)
+        return lines
+
+    def mix(self, pipette: str, wells: List[str], command: str) -> List[str]:
+        """
+        Plan the tips for a command that mixes the liquid in wells, one well
+        per channel of pipette.  Mixing does not pick up tips by itself, so
+        the pipette keeps its tips if they only touched the liquid in wells,
+        and picks up new ones otherwise.
+        """
+        return self.liquid_handling(pipette, wells, [[w] for w in wells], command)
+
+    def drop_tip(self, pipette: str) -> List[str]:
+        """Drop the tips of pipette, if it holds any"""
+        if self.tip_reagents.get(pipette) is None:
+            return []
+        self.tip_reagents[pipette] = None
+        return [f"{pipette}.drop_tip()"]
+
+    def drop_tips(self) -> List[str]:
+        """Drop the tips of all pipettes, e.g., at the end of the script"""
+        return [line for p in list(self.tip_reagents) for line in self.drop_tip(p)]
+
+    def racks(self, pipette: str) -> int:
+        """Get the minimum number of tip racks needed by pipette"""
+        return math.ceil(self.tips[pipette] / TIPS_PER_RACK)
@@ -2,14 +2,30 @@
 Generic helper functions for dealing with plate coordinates
 """
 
+import functools
 import re
 from string import ascii_letters
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
 
 
 def get_sample_list(geometry="A1:H12"):
+    """
+    Get the coordinates of the samples in geometry, e.g., "A1:H12" or
+    "A1:B6,C3", in column-major order within each rectangle.  The geometry may
+    also be a PlateGeometry, which lists all of its wells.
+    """
+    if isinstance(geometry, PlateGeometry):
+        geometry = geometry.rectangle
+    return list(_sample_list(geometry))
+
+
+@functools.lru_cache(maxsize=1024)
+def _sample_list(geometry: str) -> Tuple[str]:
     row_col_pairs = coordinate_rect_to_row_col_pairs(geometry)
-    aliquots = [f"{num2row(r+1)}{c+1}" for (r, c) in row_col_pairs]
-    return aliquots
+    return tuple(f"{num2row(r+1)}{c+1}" for (r, c) in row_col_pairs)
 
 
 def num2row(num: int):
@@ -50,26 +66,246 @@ def row2num(col: str):
     return num
 
 
+_COORDINATE_PATTERN = re.compile("^([a-zA-Z]+)([0-9]+)$")
+
+
+@functools.lru_cache(maxsize=4096)
 def coordinate_to_row_col(coord: str):
-    m = re.match("^([a-zA-Z]+)([0-9]+)$", coord)
+    m = _COORDINATE_PATTERN.match(coord)
     if m is None:
         raise Exception(f"Invalid coordinate: {coord}")
     # convert column to index and then adjust to zero-based indices
     return (row2num(m.group(1)) - 1), (int(m.group(2)) - 1)
 
 
+@functools.lru_cache(maxsize=1024)
+def coordinate_rectangles(coords: str) -> Tuple[Tuple[int, int, int, int]]:
+    """
+    Parse a comma separated list of coordinates and rectangles, such as
+    "A1:B6,C3", into zero-based (first row, first column, last row, last column)
+    rectangles.
+    """
+    rectangles = []
+    for part in coords.split(","):
+        part = part.strip()
+        num_separators = part.count(":")
+        if num_separators == 0:
+            row, col = coordinate_to_row_col(part)
+            rectangles.append((row, col, row, col))
+        elif num_separators == 1:
+            first, last = part.split(":")
+            rectangles.append(
+                coordinate_to_row_col(first) + coordinate_to_row_col(last)
+            )
+        else:
+            raise Exception(f"Invalid coordinates: {coords}")
+    return tuple(rectangles)
+
+
+def full_columns(coords: str, rows: int) -> Optional[List[int]]:
+    """
+    Get the zero-based columns selected by coords, in order, if coords select
+    only whole columns of a plate with the given number of rows, e.g.,
+    "A1:H2,A5:H5" for a 96 well plate.  Otherwise, returns None.
+    """
+    columns = []
+    for frow, fcol, srow, scol in coordinate_rectangles(coords):
+        if frow != 0 or srow != rows - 1:
+            return None
+        columns += range(fcol, scol + 1)
+    return columns
+
+
 def coordinate_rect_to_row_col_pairs(coords: str):
-    num_separators = coords.count(":")
-    if num_separators == 0:
-        return [coordinate_to_row_col(coords)]
-    elif num_separators == 1:
-        parts = coords.split(":")
-        frow, fcol = coordinate_to_row_col(parts[0])
-        srow, scol = coordinate_to_row_col(parts[1])
-
-        indices = []
-        for i in range(fcol, scol + 1):
-            for j in range(frow, srow + 1):
-                indices.append((j, i))
-        return indices
-    raise Exception(f"Invalid coordinates: {coords}")
+    return [
+        (j, i)
+        for (frow, fcol, srow, scol) in coordinate_rectangles(coords)
+        for i in range(fcol, scol + 1)
+        for j in range(frow, srow + 1)
+    ]
+
+
+# Rows and columns of the standard plate and rack formats, by number of wells
+STANDARD_GEOMETRIES = {
+    6: (2, 3),
+    12: (3, 4),
+    24: (4, 6),
+    48: (6, 8),
+    96: (8, 12),
+    384: (16, 24),
+    1536: (32, 48),
+}
+
+_WELL_COUNT_PATTERN = re.compile("([0-9]+)_?(?:Well|Tube|TipRack)", re.IGNORECASE)
+
+
+class PlateGeometry:
+    """
+    Layout of the wells of a plate or rack with `rows` x `columns` wells.
+
+    Wells are ordered canonically in row-major order (A1, A2, ..., A12, B1, ...).
+    The order of every well is precomputed so that data indexed by coordinate
+    strings can be put in canonical order with a single integer take.
+    """
+
+    _standard_geometries = {}
+
+    def __init__(self, rows: int, columns: int):
+        self.rows = rows
+        self.columns = columns
+
+    def __repr__(self):
+        return f"PlateGeometry({self.rows}, {self.columns})"
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, PlateGeometry)
+            and self.rows == other.rows
+            and self.columns == other.columns
+        )
+
+    def __hash__(self):
+        return hash((self.rows, self.columns))
+
+    @classmethod
+    def from_well_count(cls, well_count: int) -> "PlateGeometry":
+        """Get the (shared) geometry of a standard plate format"""
+        if well_count not in STANDARD_GEOMETRIES:
+            raise ValueError(f"No standard plate geometry with {well_count} wells")
+        if well_count not in cls._standard_geometries:
+            cls._standard_geometries[well_count] = cls(*STANDARD_GEOMETRIES[well_count])
+        return cls._standard_geometries[well_count]
+
+    @classmethod
+    def from_container_spec(cls, spec, default_well_count=96) -> "PlateGeometry":
+        """
+        Get the geometry of the container described by a labop.ContainerSpec,
+        using the well count in its query, e.g., "cont:Plate384Well" or
+        "cont:Opentrons24TubeRackwithEppendorf1.5mLSafe-LockSnapcap".  Falls
+        back to the standard plate with default_well_count wells.
+        """
+        query = spec.queryString if spec is not None and spec.queryString else ""
+        for match in _WELL_COUNT_PATTERN.finditer(query):
+            well_count = int(match.group(1))
+            if well_count in STANDARD_GEOMETRIES:
+                return cls.from_well_count(well_count)
+        return cls.from_well_count(default_well_count)
+
+    @property
+    def size(self) -> int:
+        return self.rows * self.columns
+
+    @property
+    def rectangle(self) -> str:
+        """Coordinates of the rectangle spanning all wells, e.g., "A1:H12" """
+        return f"A1:{num2row(self.rows)}{self.columns}"
+
+    @functools.cached_property
+    def index_grid(self) -> np.ndarray:
+        """(rows x columns) grid of the canonical index of each well"""
+        return _read_only(np.arange(self.size).reshape(self.rows, self.columns))
+
+    @functools.cached_property
+    def row_grid(self) -> np.ndarray:
+        """Zero-based row of each well, in canonical order"""
+        return _read_only(self.index_grid.ravel() // self.columns)
+
+    @functools.cached_property
+    def column_grid(self) -> np.ndarray:
+        """Zero-based column of each well, in canonical order"""
+        return _read_only(self.index_grid.ravel() % self.columns)
+
+    @functools.cached_property
+    def wells(self) -> np.ndarray:
+        """Coordinates of all wells, in canonical order"""
+        rows = np.array([num2row(r + 1) for r in range(self.rows)])
+        columns = np.array([str(c + 1) for c in range(self.columns)])
+        return _read_only(np.char.add(rows[:, None], columns[None, :]).ravel())
+
+    @functools.cached_property
+    def _well_index(self) -> pd.Index:
+        return pd.Index(self.wells)
+
+    @functools.cached_property
+    def _well_keys(self) -> np.ndarray:
+        return _read_only(_well_key(self.row_grid, self.column_grid))
+
+    def indices(self, coordinates: str) -> np.ndarray:
+        """
+        Get the canonical indices of the wells in coordinates, e.g.,
+        "A1:B6,C3", in the same order as get_sample_list().
+        """
+        selections = []
+        for frow, fcol, srow, scol in coordinate_rectangles(coordinates):
+            if not (0 <= frow <= srow < self.rows and 0 <= fcol <= scol < self.columns):
+                raise ValueError(f"Coordinates {coordinates} are outside of {self}")
+            selections.append(
+                self.index_grid[frow : srow + 1, fcol : scol + 1].ravel(order="F")
+            )
+        return np.concatenate(selections)
+
+    def coordinates(self, coordinates: str) -> np.ndarray:
+        """Get the well coordinates selected by coordinates, e.g., "A1:B6,C3" """
+        return self.wells[self.indices(coordinates)]
+
+    def mask(self, coordinates: str) -> np.ndarray:
+        """Get a boolean array over all wells that selects coordinates"""
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.indices(coordinates)] = True
+        return mask
+
+    def well_keys(self, coordinates) -> np.ndarray:
+        """
+        Get an integer sort key for each coordinate.  Sorting by the keys puts
+        the coordinates in canonical order.  Coordinates outside the geometry
+        are parsed individually, and any strings that are not coordinates sort
+        last, in lexicographic order.
+        """
+        coordinates = np.asarray(coordinates)
+        indices = self._well_index.get_indexer(coordinates)
+        keys = self._well_keys[indices]
+        misses = np.flatnonzero(indices < 0)
+        if len(misses):
+            invalid = []
+            for i in misses:
+                try:
+                    keys[i] = _well_key(*coordinate_to_row_col(coordinates[i]))
+                except Exception:
+                    invalid.append(i)
+            if invalid:
+                ranks = np.argsort(np.argsort(coordinates[invalid]))
+                keys[invalid] = np.iinfo(np.int64).max - len(invalid) + ranks
+        return keys
+
+    def row_columns(self, coordinates) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the zero-based row and column of each coordinate"""
+        keys = self.well_keys(coordinates)
+        return keys >> 32, keys & 0xFFFFFFFF
+
+    def well_order(self, coordinates) -> np.ndarray:
+        """Get the positions that put coordinates in canonical order"""
+        return np.argsort(self.well_keys(coordinates), kind="stable")
+
+    def sort(self, data, dim="sample"):
+        """
+        Put an xarray DataArray or Dataset in canonical order along dim, which is
+        indexed by coordinate strings.
+        """
+        order = self.well_order(data.coords[dim].values)
+        if np.all(order[:-1] < order[1:]):
+            return data  # Already sorted
+        return data.isel({dim: order})
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+def _well_key(row, column):
+    return (np.int64(row) << 32) | np.int64(column)
+
+
+# Geometry of the largest standard (1536 well) plate.  Coordinates of any
+# smaller plate share its canonical order.
+DEFAULT_PLATE_GEOMETRY = PlateGeometry.from_well_count(1536)
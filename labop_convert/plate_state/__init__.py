@@ -0,0 +1 @@
+from .plate_state_specialization import *
@@ -0,0 +1,499 @@
+"""
+Simulate the volume and composition of every well of every container along a
+ProtocolExecution.
+
+The state of each container is a numpy array of amounts, with one row per
+well and one column per component.  Liquid handling steps are applied as
+vectorized updates over the selected wells.  The array of a container is
+copied the first time a step updates it and modified in place after that, so
+each step keeps a snapshot of the state that shares the arrays of the
+containers it did not touch.
+"""
+
+import logging
+from typing import Dict, List, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import sbol3
+import xarray as xr
+
+import labop
+from labop.sample_maps import TransferMatrix
+from labop.strings import Strings
+from labop.units import MICROLITER_FACTORS
+from labop_convert.behavior_specialization import BehaviorSpecialization
+from labop_convert.plate_coordinates import get_sample_list
+from labop_convert.replay import replay_execution
+
+l = logging.getLogger(__file__)
+l.setLevel(logging.ERROR)
+
+LIQUID_HANDLING = "https://bioprotocols.org/labop/primitives/liquid_handling/"
+SAMPLE_ARRAYS = "https://bioprotocols.org/labop/primitives/sample_arrays/"
+
+
+class PlateStateException(Exception):
+    pass
+
+
+class PlateStateSpecialization(BehaviorSpecialization):
+    """
+    Track the amount (in microliters) of each component in every well as the
+    protocol is executed.  Use it as a specialization of an ExecutionEngine,
+    or call simulate() on a completed ProtocolExecution.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.reset()
+
+    def _init_behavior_func_map(self) -> dict:
+        return {
+            SAMPLE_ARRAYS + "EmptyContainer": self.empty_container,
+            LIQUID_HANDLING + "Provision": self.provision,
+            LIQUID_HANDLING + "Transfer": self.transfer,
+            LIQUID_HANDLING + "TransferInto": self.transfer,
+            LIQUID_HANDLING + "Dispense": self.transfer,
+            LIQUID_HANDLING + "TransferByMap": self.transfer_by_map,
+            LIQUID_HANDLING + "Dilute": self.dilute,
+            LIQUID_HANDLING + "SerialDilution": self.serial_dilution,
+            SAMPLE_ARRAYS + "PoolSamples": self.pool_samples,
+            LIQUID_HANDLING + "Discard": self.discard,
+        }
+
+    def reset(self):
+        self.components: List[str] = []
+        self._component_index: Dict[str, int] = {}
+        self.wells: Dict[str, np.ndarray] = {}
+        self._well_index: Dict[str, pd.Index] = {}
+        self._amounts: Dict[str, np.ndarray] = {}
+        # Containers whose arrays are not in a snapshot yet, and so can be
+        # modified in place
+        self._unshared: Set[str] = set()
+        self.steps: List[str] = []
+        self._step_index: Dict[str, int] = {}
+        self._snapshots: List[Dict[str, np.ndarray]] = []
+
+    def on_begin(self, execution: labop.ProtocolExecution):
+        super().on_begin(execution)
+        self.reset()
+
+    def on_end(self, execution: labop.ProtocolExecution):
+        pass
+
+    def simulate(self, execution: labop.ProtocolExecution):
+        """
+        Simulate the steps of a completed ProtocolExecution.
+        """
+        replay_execution(execution, [self])
+        return self
+
+    def process(self, record, execution: labop.ProtocolExecution):
+        super().process(record, execution)
+        if isinstance(record, labop.CallBehaviorExecution):
+            self._step_index[record.identity] = len(self.steps)
+            self.steps.append(record.identity)
+            self._snapshots.append(self._amounts)
+            self._amounts = dict(self._amounts)
+            self._unshared = set()
+
+    def handle(self, record, execution):
+        # Steps that do not move liquid leave the state unchanged
+        pass
+
+    ###########################################
+    # Queries
+
+    def state(self, step=-1) -> Dict[str, xr.DataArray]:
+        """
+        Get the contents of each container after a step, given by its index,
+        its ActivityNodeExecution, or the identity of the execution.
+        """
+        snapshot = self._snapshots[self._get_step(step)]
+        return {
+            container: self._to_data_array(container, amounts)
+            for container, amounts in snapshot.items()
+        }
+
+    def container_state(self, container, step=-1) -> xr.DataArray:
+        """
+        Get the contents of a container after a step.
+        """
+        container = container if isinstance(container, str) else container.identity
+        snapshot = self._snapshots[self._get_step(step)]
+        if container not in snapshot:
+            raise PlateStateException(
+                f"Container {container} does not exist at step {step}"
+            )
+        return self._to_data_array(container, snapshot[container])
+
+    def volumes(self, container, step=-1) -> xr.DataArray:
+        """
+        Get the total volume of each well in a container after a step.
+        """
+        return self.container_state(container, step=step).sum(dim="contents")
+
+    def _get_step(self, step) -> int:
+        if isinstance(step, labop.ActivityNodeExecution):
+            step = step.identity
+        if isinstance(step, str):
+            return self._step_index[step]
+        return step
+
+    def _to_data_array(self, container: str, amounts: np.ndarray) -> xr.DataArray:
+        return xr.DataArray(
+            _pad(amounts, len(self.components)),
+            name=container,
+            dims=(Strings.SAMPLE, "contents"),
+            attrs={"units": "uL"},
+            coords={
+                Strings.SAMPLE: self.wells[container],
+                "contents": list(self.components),
+            },
+        )
+
+    ###########################################
+    # State updates
+
+    def _component(self, component: str) -> int:
+        if component not in self._component_index:
+            self._component_index[component] = len(self.components)
+            self.components.append(component)
+        return self._component_index[component]
+
+    def _container(self, sample_array: labop.SampleArray) -> str:
+        container = sample_array.identity
+        if container not in self.wells:
+            wells = np.asarray(sample_array.to_data_array()[Strings.SAMPLE].data)
+            self.wells[container] = wells
+            self._well_index[container] = pd.Index(wells)
+            self._set_amounts(container, np.zeros((len(wells), len(self.components))))
+        return container
+
+    def _get_amounts(self, container: str) -> np.ndarray:
+        return _pad(self._amounts[container], len(self.components))
+
+    def _set_amounts(self, container: str, amounts: np.ndarray):
+        self._amounts[container] = amounts
+        self._unshared.add(container)
+
+    def _writable(self, container: str) -> np.ndarray:
+        """
+        Get the amounts of a container to update in place, copying them if
+        they are in a snapshot of an earlier step.
+        """
+        amounts = self._amounts[container]
+        if container not in self._unshared or amounts.shape[1] < len(self.components):
+            padded = _pad(amounts, len(self.components))
+            self._set_amounts(container, padded.copy() if padded is amounts else padded)
+        return self._amounts[container]
+
+    def _select(
+        self, samples: labop.SampleCollection, coordinates: str = None
+    ) -> Tuple[str, np.ndarray]:
+        """
+        Get the container and well indices of a SampleArray or SampleMask.
+        """
+        if isinstance(samples, labop.SampleMask):
+            container = self._container(samples.source.lookup())
+            wells = samples.get_coordinates()
+        elif isinstance(samples, labop.SampleArray):
+            container = self._container(samples)
+            wells = self.wells[container]
+        else:
+            raise PlateStateException(f"Cannot select wells of {samples}")
+        if coordinates:
+            wells = np.asarray(wells)[np.isin(wells, get_sample_list(coordinates))]
+        indices = self._well_index[container].get_indexer(wells)
+        if (indices < 0).any():
+            raise PlateStateException(
+                f"Wells {np.asarray(wells)[indices < 0].tolist()} are not in container {container}"
+            )
+        return container, indices
+
+    def _add(self, container: str, indices: np.ndarray, component: str, amount):
+        column = self._component(component)
+        amounts = self._writable(container)
+        np.add.at(amounts[:, column], indices, amount)
+
+    def _remove(self, container: str, indices: np.ndarray, amount):
+        amounts = self._writable(container)
+        totals = amounts[indices].sum(axis=1)
+        remaining = np.divide(
+            np.maximum(totals - amount, 0.0),
+            totals,
+            out=np.zeros_like(totals),
+            where=totals > 0,
+        )
+        amounts[indices] *= remaining[:, np.newaxis]
+
+    def _transfer_matrix(
+        self,
+        source: str,
+        rows: np.ndarray,
+        destination: str,
+        columns: np.ndarray,
+        amount,
+    ) -> TransferMatrix:
+        """
+        Get the TransferMatrix that moves amount from each source well rows[i]
+        to the destination well columns[i].
+        """
+        return TransferMatrix(
+            self.wells[source],
+            self.wells[destination],
+            rows,
+            columns,
+            np.broadcast_to(np.asarray(amount, dtype=float), rows.shape),
+        )
+
+    def _move(self, source: str, destination: str, matrix: TransferMatrix):
+        """
+        Move the volume of each entry of matrix from its source well to its
+        destination well.  The entries from a source well are taken in order,
+        so once the well is empty the remaining entries move nothing.  Wells
+        with no tracked contents are treated as containing the source
+        container itself.
+        """
+        rows, columns = matrix.rows, matrix.columns
+        totals = self._get_amounts(source).sum(axis=1)
+        empty = totals <= 0
+        if empty[rows].any():
+            self._component(source)
+        amounts = self._get_amounts(source)
+        concentration = np.divide(
+            amounts[rows],
+            totals[rows, np.newaxis],
+            out=np.zeros((len(rows), amounts.shape[1])),
+            where=~empty[rows, np.newaxis],
+        )
+        if empty[rows].any():
+            concentration[empty[rows], self._component_index[source]] = 1.0
+        # A well cannot give more than it holds
+        volumes = matrix.limit(np.where(empty, np.inf, totals))
+        moved = concentration * volumes[:, np.newaxis]
+
+        source_amounts = self._writable(source)
+        np.subtract.at(source_amounts, rows, moved)
+        source_amounts[rows] = np.maximum(source_amounts[rows], 0.0)
+
+        destination_amounts = self._writable(destination)
+        np.add.at(destination_amounts, columns, moved)
+
+    ###########################################
+    # Primitives
+
+    def empty_container(
+        self, record: labop.ActivityNodeExecution, execution: labop.ProtocolExecution
+    ):
+        parameter_value_map = record.call.lookup().parameter_value_map()
+        self._container(parameter_value_map["samples"]["value"])
+
+    def provision(
+        self, record: labop.ActivityNodeExecution, execution: labop.ProtocolExecution
+    ):
+        parameter_value_map = record.call.lookup().parameter_value_map()
+        resource = parameter_value_map["resource"]["value"]
+        destination = parameter_value_map["destination"]["value"]
+        amount = _microliters(parameter_value_map["amount"]["value"])
+        container, indices = self._select(destination)
+        self._add(container, indices, resource.identity, amount)
+
+    def transfer(
+        self, record: labop.ActivityNodeExecution, execution: labop.ProtocolExecution
+    ):
+        parameter_value_map = record.call.lookup().parameter_value_map()
+        source = parameter_value_map["source"]["value"]
+        destination = parameter_value_map["destination"]["value"]
+        amount = _microliters(parameter_value_map["amount"]["value"])
+        coordinates = (
+            parameter_value_map["coordinates"]["value"]
+            if "coordinates" in parameter_value_map
+            else None
+        )
+        source_container, source_indices = self._select(source)
+        destination_container, destination_indices = self._select(
+            destination, coordinates
+        )
+        rows, columns = _pair(source_indices, destination_indices)
+        self._move(
+            source_container,
+            destination_container,
+            self._transfer_matrix(
+                source_container, rows, destination_container, columns, amount
+            ),
+        )
+
+    def transfer_by_map(
+        self, record: labop.ActivityNodeExecution, execution: labop.ProtocolExecution
+    ):
+        parameter_value_map = record.call.lookup().parameter_value_map()
+        source = parameter_value_map["source"]["value"]
+        destination = parameter_value_map["destination"]["value"]
+        plan = parameter_value_map["plan"]["value"]
+        source_container, _ = self._select(source)
+        destination_container, _ = self._select(destination)
+        # The plan gives the volume for each pair of source and destination
+        # samples, so only the nonzero entries are moved
+        matrix = plan.transfer_matrix(
+            record.document.find(source_container),
+            record.document.find(destination_container),
+        )
+        rows = self._well_index[source_container].get_indexer(matrix.source_samples)
+        columns = self._well_index[destination_container].get_indexer(
+            matrix.target_samples
+        )
+        if (rows < 0).any() or (columns < 0).any():
+            raise PlateStateException(
+                f"The plan of {record.identity} maps wells that are not in {source_container} or {destination_container}"
+            )
+        self._move(
+            source_container,
+            destination_container,
+            self._transfer_matrix(
+                source_container,
+                rows[matrix.rows],
+                destination_container,
+                columns[matrix.columns],
+                matrix.volumes,
+            ),
+        )
+
+    def dilute(
+        self, record: labop.ActivityNodeExecution, execution: labop.ProtocolExecution
+    ):
+        parameter_value_map = record.call.lookup().parameter_value_map()
+        source = parameter_value_map["source"]["value"]
+        destination = parameter_value_map["destination"]["value"]
+        diluent = parameter_value_map["diluent"]["value"]
+        amount = _microliters(parameter_value_map["amount"]["value"])
+        dilution_factor = _number(parameter_value_map["dilution_factor"]["value"])
+
+        source_container, source_indices = self._select(source)
+        destination_container, destination_indices = self._select(destination)
+        rows, columns = _pair(source_indices, destination_indices)
+        self._move(
+            source_container,
+            destination_container,
+            self._transfer_matrix(
+                source_container,
+                rows,
+                destination_container,
+                columns,
+                amount / dilution_factor,
+            ),
+        )
+        self._add(
+            destination_container,
+            columns,
+            diluent.identity,
+            amount - amount / dilution_factor,
+        )
+
+    def serial_dilution(
+        self, record: labop.ActivityNodeExecution, execution: labop.ProtocolExecution
+    ):
+        parameter_value_map = record.call.lookup().parameter_value_map()
+        source = parameter_value_map["source"]["value"]
+        destination = parameter_value_map["destination"]["value"]
+        diluent = parameter_value_map["diluent"]["value"]
+        amount = _microliters(parameter_value_map["amount"]["value"])
+        dilution_factor = _number(parameter_value_map["dilution_factor"]["value"])
+        series = int(_number(parameter_value_map["series"]["value"]))
+
+        source_container, source_indices = self._select(source)
+        destination_container, destination_indices = self._select(destination)
+        if len(destination_indices) < len(source_indices) * series:
+            raise PlateStateException(
+                f"SerialDilution of {len(source_indices)} samples in a series of {series} needs {len(source_indices) * series} destination wells, but only {len(destination_indices)} were given"
+            )
+        # Each source sample is diluted along its own row of the series
+        dilutions = destination_indices[: len(source_indices) * series].reshape(
+            len(source_indices), series
+        )
+        transferred = amount / dilution_factor
+        previous_container, previous = source_container, source_indices
+        for step in range(series):
+            self._add(
+                destination_container,
+                dilutions[:, step],
+                diluent.identity,
+                amount - transferred,
+            )
+            self._move(
+                previous_container,
+                destination_container,
+                self._transfer_matrix(
+                    previous_container,
+                    previous,
+                    destination_container,
+                    dilutions[:, step],
+                    transferred,
+                ),
+            )
+            previous_container, previous = destination_container, dilutions[:, step]
+
+    def pool_samples(
+        self, record: labop.ActivityNodeExecution, execution: labop.ProtocolExecution
+    ):
+        parameter_value_map = record.call.lookup().parameter_value_map()
+        source = parameter_value_map["source"]["value"]
+        destination = parameter_value_map["destination"]["value"]
+        volume = _microliters(parameter_value_map["volume"]["value"])
+        source_container, source_indices = self._select(source)
+        destination_container, destination_indices = self._select(destination)
+        # Samples are pooled in order, so the replicates of each sample are
+        # collected in the same destination well
+        columns = destination_indices[
+            np.arange(len(source_indices)) % len(destination_indices)
+        ]
+        self._move(
+            source_container,
+            destination_container,
+            self._transfer_matrix(
+                source_container, source_indices, destination_container, columns, volume
+            ),
+        )
+
+    def discard(
+        self, record: labop.ActivityNodeExecution, execution: labop.ProtocolExecution
+    ):
+        parameter_value_map = record.call.lookup().parameter_value_map()
+        samples = parameter_value_map["samples"]["value"]
+        amount = _microliters(parameter_value_map["amount"]["value"])
+        container, indices = self._select(samples)
+        self._remove(container, indices, amount)
+
+
+def _pad(amounts: np.ndarray, n_components: int) -> np.ndarray:
+    if amounts.shape[1] < n_components:
+        return np.pad(amounts, ((0, 0), (0, n_components - amounts.shape[1])))
+    return amounts
+
+
+def _pair(
+    source_indices: np.ndarray, destination_indices: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pair source and destination wells in order.  A single source well is
+    dispensed to every destination well, and sources are repeated when the
+    destination holds replicates of each source.
+    """
+    if len(source_indices) == 0 or len(destination_indices) % len(source_indices):
+        raise PlateStateException(
+            f"Cannot transfer {len(source_indices)} samples to {len(destination_indices)} wells"
+        )
+    replicates = len(destination_indices) // len(source_indices)
+    return np.tile(source_indices, replicates), destination_indices
+
+
+def _number(value: Union[float, int, sbol3.Measure]) -> float:
+    return float(value.value if hasattr(value, "value") else value)
+
+
+def _microliters(measure: sbol3.Measure) -> float:
+    if measure.unit not in MICROLITER_FACTORS:
+        l.warning(f"Unknown volume unit {measure.unit}, assuming microliters")
+        return float(measure.value)
+    return float(measure.value) * MICROLITER_FACTORS[measure.unit]
@@ -0,0 +1,131 @@
+"""
+Replay of completed protocol executions through specializations.
+
+replay_execution() regenerates the output of specializations, such as the
+markdown or an OT2 script, from a ProtocolExecution that was executed and
+saved earlier, e.g., in an .nt file.  The records of the execution are streamed
+through initialize_protocol(), on_begin(), process(), and on_end() of each
+specialization in the order that the ExecutionEngine processed them, without
+executing the protocol again.
+"""
+
+import heapq
+from typing import Dict, List, Union
+
+import sbol3
+
+import labop
+from labop_convert.behavior_specialization import BehaviorSpecialization
+
+
+def replay_execution(
+    source: Union[str, sbol3.Document, labop.ProtocolExecution],
+    specializations: List[BehaviorSpecialization],
+    out_dir: str = None,
+    data_dir: str = None,
+) -> List[labop.ProtocolExecution]:
+    """
+    Specialize saved protocol executions.
+
+    Parameters
+    ----------
+    source: a file with a saved document, a document, or one of its
+        ProtocolExecutions.  All the ProtocolExecutions of a document are
+        replayed, those of subprotocols before the protocols that call them.
+    specializations: the specializations that the executions are replayed
+        through
+    out_dir: directory for the output of the specializations
+    data_dir: directory of the files of the sample data that are stored
+        outside of the document (see labop.add_external_data_dir())
+
+    Returns
+    -------
+    The ProtocolExecutions that were replayed, in order
+    """
+    if isinstance(source, str):
+        doc = sbol3.Document()
+        doc.read(source)
+        source = doc
+    if data_dir is not None:
+        labop.add_external_data_dir(
+            source if isinstance(source, sbol3.Document) else source.document,
+            data_dir,
+        )
+    if isinstance(source, sbol3.Document):
+        executions = subprotocols_first(
+            [o for o in source.objects if type(o) is labop.ProtocolExecution]
+        )
+    else:
+        executions = [source]
+
+    for execution in executions:
+        for specialization in specializations:
+            specialization.initialize_protocol(execution, out_dir=out_dir)
+            specialization.on_begin(execution)
+        try:
+            for record in ordered_records(execution):
+                for specialization in specializations:
+                    specialization.process(record, execution)
+            for specialization in specializations:
+                specialization.on_end(execution)
+        except Exception:
+            for specialization in specializations:
+                specialization.on_failure(execution)
+            raise
+    return executions
+
+
+def ordered_records(
+    execution: labop.ProtocolExecution,
+) -> List[labop.ActivityNodeExecution]:
+    """
+    Sort the records of an execution so that each record follows the records
+    that produced the tokens that it consumed.  The records of a document that
+    was read from a file are not necessarily in the order they were executed.
+    """
+    records = list(execution.executions)
+    position = {record.identity: i for i, record in enumerate(records)}
+    sources: Dict[str, set] = {}
+    consumers: Dict[str, List[str]] = {record.identity: [] for record in records}
+    for record in records:
+        sources[record.identity] = {
+            str(flow.lookup().token_source) for flow in record.incoming_flows
+        }.intersection(position)
+        for source in sources[record.identity]:
+            consumers[source].append(record.identity)
+
+    # Among the records that are ready, prefer the ones listed first
+    ready = [position[r] for r, s in sources.items() if not s]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        record = records[heapq.heappop(ready)]
+        ordered.append(record)
+        for consumer in consumers[record.identity]:
+            sources[consumer].discard(record.identity)
+            if not sources[consumer]:
+                heapq.heappush(ready, position[consumer])
+    if len(ordered) < len(records):
+        raise ValueError(f"The records of {execution.identity} form a cycle")
+    return ordered
+
+
+def subprotocols_first(
+    executions: List[labop.ProtocolExecution],
+) -> List[labop.ProtocolExecution]:
+    """
+    Order executions so that the executions of subprotocols precede the
+    executions of the protocols that call them.
+    """
+    ordered = []
+
+    def visit(execution):
+        if execution in ordered:
+            return
+        for subprotocol_execution in execution.get_subprotocol_executions():
+            visit(subprotocol_execution)
+        ordered.append(execution)
+
+    for execution in executions:
+        visit(execution)
+    return ordered
@@ -0,0 +1,134 @@
+"""
+Lineage of the sample collections in a protocol execution.
+
+Converters need to know which container, and which rack, the samples on an
+input pin of a liquid handling step were allocated in.  Tracing each pin back
+through PlateCoordinates, LoadContainerInRack, etc. with get_token_source()
+walks the upstream flows of the execution on every call.  LineageIndex instead
+records, once for each execution record, where the samples output by the
+primitives that allocate and select samples come from, so that converters look
+up a sample collection in constant time.
+"""
+
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional
+
+import labop
+
+SAMPLE_ARRAYS = "https://bioprotocols.org/labop/primitives/sample_arrays/"
+
+
+@dataclass
+class SampleLineage:
+    """
+    Origin of a sample collection: the container that holds the samples, the
+    rack (or plate) that is loaded on the instrument deck, and the
+    coordinates of the samples in the rack or container.
+    """
+
+    container: Optional[labop.ContainerSpec] = None
+    rack: Optional[labop.ContainerSpec] = None
+    coordinates: Optional[str] = None
+    # The local name of the primitive that output the samples, e.g.,
+    # "PlateCoordinates"
+    behavior_type: Optional[str] = None
+
+    @property
+    def labware(self) -> Optional[labop.ContainerSpec]:
+        """The spec of the labware that is loaded on the deck"""
+        return self.rack if self.rack is not None else self.container
+
+
+class LineageIndex:
+    """
+    Index from the identity of each SampleCollection output by a primitive of
+    the sample_arrays library to its SampleLineage.  The index follows the
+    records of the execution as they are appended, so it is built only once.
+    """
+
+    def __init__(self, execution: labop.ProtocolExecution):
+        self.execution = execution
+        self.lineage: Dict[str, SampleLineage] = {}
+        # Number of records of the execution indexed so far
+        self._indexed = 0
+        # Records whose source samples were not indexed yet, e.g., because the
+        # records of an execution read from a file are not in order
+        self._pending: List[labop.CallBehaviorExecution] = []
+
+    def __getitem__(self, samples: labop.SampleCollection) -> SampleLineage:
+        lineage = self.get(samples)
+        if lineage is None:
+            raise KeyError(f"Cannot find where {samples.identity} come from")
+        return lineage
+
+    def get(self, samples: labop.SampleCollection) -> Optional[SampleLineage]:
+        if samples.identity not in self.lineage:
+            self._update()
+        return self.lineage.get(samples.identity)
+
+    def _update(self):
+        records = self.execution.executions[self._indexed :]
+        self._indexed += len(records)
+        for record in records:
+            if isinstance(record, labop.CallBehaviorExecution) and not self._index(
+                record
+            ):
+                self._pending.append(record)
+        indexed = True
+        while self._pending and indexed:
+            pending = [r for r in self._pending if not self._index(r)]
+            indexed = len(pending) < len(self._pending)
+            self._pending = pending
+
+    def _index(self, record: labop.CallBehaviorExecution) -> bool:
+        """
+        Index the samples output by record.  Returns False if the lineage of
+        the source samples of record is not known yet.
+        """
+        behavior = str(record.node.lookup().behavior)
+        if not behavior.startswith(SAMPLE_ARRAYS):
+            return True
+        behavior_type = behavior[len(SAMPLE_ARRAYS) :]
+        values = {
+            k: v["value"] for k, v in record.call.lookup().parameter_value_map().items()
+        }
+
+        def source(parameter):
+            if parameter not in values:
+                return None
+            return self.lineage.get(values[parameter].identity)
+
+        if behavior_type == "EmptyContainer":
+            output = "samples"
+            lineage = SampleLineage(container=values.get("specification"))
+        elif behavior_type == "EmptyRack":
+            output = "slots"
+            lineage = SampleLineage(rack=values.get("specification"))
+        elif behavior_type == "LoadContainerInRack":
+            output = "samples"
+            rack = source("slots")
+            if rack is None:
+                return False
+            lineage = SampleLineage(
+                container=values.get("container"),
+                rack=rack.rack,
+                coordinates=values.get("coordinates", "A1"),
+            )
+        elif behavior_type == "LoadContainerOnInstrument":
+            output = "samples"
+            lineage = SampleLineage(
+                container=values.get("specification"),
+                coordinates=values.get("slots", "A1"),
+            )
+        elif behavior_type == "PlateCoordinates":
+            output = "samples"
+            lineage = source("source")
+            if lineage is None:
+                return False
+            lineage = replace(lineage, coordinates=values.get("coordinates"))
+        else:
+            return True
+        if output in values:
+            lineage.behavior_type = behavior_type
+            self.lineage[values[output].identity] = lineage
+        return True
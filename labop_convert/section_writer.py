@@ -0,0 +1,142 @@
+"""
+Streaming output for specializations.
+
+A SectionWriter writes the text of a script or document to its sink as soon
+as it is produced, so that the output of a long execution appears while it
+runs instead of being assembled in memory at the end.  Sections that can only
+be written at the end, such as the list of materials, are reserved with
+placeholder() and back-patched with fill() when the writer is closed.  If
+the output cannot be completed, e.g., because the execution failed, discard()
+closes the writer without leaving a truncated file behind.
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional, TextIO, Tuple, Union
+
+# Characters of the text after a placeholder that are held in memory before
+# the text spills to a temporary file, when the sink cannot be read back
+SPOOL_SIZE = 1 << 20
+
+# Characters copied at a time when back-patching
+CHUNK_SIZE = 1 << 16
+
+
+class SectionWriter:
+    """
+    Write text to a file, or to a file-like sink, with placeholders for
+    sections that are filled in later.
+
+    When the sink can be read back (e.g., a file that the writer opens, or an
+    io.StringIO), the text after the first placeholder is written to the sink
+    as it is produced, and close() moves it after the filled sections.
+    Otherwise, that text is spooled to a temporary file until close().
+    """
+
+    def __init__(self, sink: Union[str, TextIO]):
+        if isinstance(sink, str):
+            self.sink = open(sink, "w+")
+            self._owns_sink = True
+        else:
+            self.sink = sink
+            self._owns_sink = False
+        self.sections: Dict[str, Optional[str]] = {}
+        # Offset of each placeholder in the text written after the first one
+        self._placeholders: List[Tuple[int, str]] = []
+        self._tail_length = 0
+        # Position of the first placeholder in a sink that can be read back,
+        # or else the spool for the text after it
+        self._tail_start = None
+        self._tail: Optional[TextIO] = None
+
+    def __enter__(self) -> "SectionWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, text: str):
+        if self._placeholders:
+            self._tail_length += len(text)
+        (self._tail or self.sink).write(text)
+
+    def placeholder(self, name: str):
+        """Reserve the current position for the section called name"""
+        if name in self.sections:
+            raise ValueError(f"Section {name} is already reserved")
+        if not self._placeholders:
+            if _rewritable(self.sink):
+                self._tail_start = self.sink.tell()
+            else:
+                self._tail = tempfile.SpooledTemporaryFile(
+                    max_size=SPOOL_SIZE, mode="w+"
+                )
+        self._placeholders.append((self._tail_length, name))
+        self.sections[name] = None
+
+    def fill(self, name: str, text: str):
+        """Set the text of a reserved section"""
+        if name not in self.sections:
+            raise KeyError(f"Section {name} is not reserved")
+        self.sections[name] = text
+
+    def flush(self):
+        (self._tail or self.sink).flush()
+
+    def close(self):
+        """Back-patch the reserved sections, and close the sink if it was opened"""
+        if self._placeholders:
+            tail = self._tail
+            if tail is None:
+                # Move the text after the first placeholder out of the way
+                tail = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode="w+")
+                self.sink.seek(self._tail_start)
+                shutil.copyfileobj(self.sink, tail, CHUNK_SIZE)
+                self.sink.seek(self._tail_start)
+                self.sink.truncate()
+            tail.seek(0)
+            position = 0
+            for offset, name in self._placeholders:
+                self._copy(tail, offset - position)
+                position = offset
+                self.sink.write(self.sections[name] or "")
+            shutil.copyfileobj(tail, self.sink, CHUNK_SIZE)
+            tail.close()
+            self._placeholders = []
+            self._tail = None
+        if self._owns_sink:
+            self.sink.close()
+        else:
+            self.sink.flush()
+
+    def discard(self):
+        """
+        Close the writer without back-patching, and remove the file if the
+        writer opened it.  Does nothing if the writer is already closed.
+        """
+        if self._tail is not None:
+            self._tail.close()
+            self._tail = None
+        self._placeholders = []
+        if self._owns_sink and not self.sink.closed:
+            self.sink.close()
+            os.remove(self.sink.name)
+
+    def _copy(self, source: TextIO, length: int):
+        while length > 0:
+            text = source.read(min(length, CHUNK_SIZE))
+            if not text:
+                break
+            self.sink.write(text)
+            length -= len(text)
+
+
+def _rewritable(sink: TextIO) -> bool:
+    try:
+        return sink.seekable() and sink.readable()
+    except (AttributeError, ValueError):
+        return False
@@ -2,7 +2,8 @@ from setuptools import setup
 
 test_deps = ["nbmake", "pytest-xdist", "pre-commit", "nbstripout"]
 notebook_deps = ["ipython", "ipywidgets"]
-extras = {"test": test_deps, "notebook": notebook_deps}
+export_deps = ["pyarrow", "zarr"]
+extras = {"test": test_deps, "notebook": notebook_deps, "export": export_deps}
 
 setup(
     name="labop",
@@ -32,6 +33,7 @@ setup(
         "labop_convert.autoprotocol",
         "labop_convert.markdown",
         "labop_convert.opentrons",
+        "labop_convert.plate_state",
         "labop.lib",
         "labop.utils",
         "labop_time",
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+from importlib.util import find_spec
+
+import numpy as np
+import sbol3
+import xarray as xr
+from tyto import OM
+
+import labop
+from labop.execution_engine import ExecutionEngine
+from labop.utils.helpers import initialize_protocol
+
+OUT_DIR = os.path.join(os.path.dirname(__file__), "out")
+if not os.path.exists(OUT_DIR):
+    os.mkdir(OUT_DIR)
+
+
+class TestDataExport(unittest.TestCase):
+    def setUp(self):
+        protocol, doc = initialize_protocol()
+        plate = protocol.primitive_step(
+            "EmptyContainer", specification=labop.ContainerSpec("deep96")
+        )
+        coordinates = protocol.primitive_step(
+            "PlateCoordinates", source=plate.output_pin("samples"), coordinates="A1:B12"
+        )
+        protocol.primitive_step(
+            "MeasureAbsorbance",
+            samples=coordinates.output_pin("samples"),
+            wavelength=sbol3.Measure(600, OM.nanometer),
+        )
+        ee = ExecutionEngine(use_ordinal_time=True, out_dir=OUT_DIR, failsafe=False)
+        self.execution = ee.execute(
+            protocol,
+            sbol3.Agent("test_agent"),
+            id="test_execution",
+            parameter_values=[],
+        )
+        [(provenance, dataset)] = self.execution.iter_data()
+        self.provenance = provenance
+        self.dataset = dataset
+
+    def test_iter_data(self):
+        assert self.provenance["execution"] == "test_execution"
+        assert self.provenance["primitive"] == "MeasureAbsorbance"
+        assert self.provenance["plate"].endswith("SampleArray1")
+        assert self.provenance["output"] == "measurements"
+        data = self.execution.document.find(self.provenance["data"])
+        assert isinstance(data, labop.Dataset)
+        assert (
+            self.dataset[labop.Strings.MEASUREMENT].attrs["identity"]
+            == data.data.identity
+        )
+
+    @unittest.skipUnless(find_spec("pyarrow"), "pyarrow is not installed")
+    def test_export_parquet(self):
+        import pyarrow.parquet as pq
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            labop.export_data([self.execution, self.execution], tmpdir)
+            partition = os.path.join(
+                tmpdir,
+                "execution=test_execution",
+                "primitive=MeasureAbsorbance",
+                f"plate={self.provenance['plate']}",
+            )
+            assert len(os.listdir(partition)) == 1
+            table = pq.read_table(tmpdir).to_pandas()
+            assert len(table) == 96
+            assert set(table["node"]) == {self.provenance["node"]}
+            assert table["execution"].astype(str).unique().tolist() == [
+                "test_execution"
+            ]
+            assert table[labop.Strings.MEASUREMENT].isnull().all()
+            assert set(table["wavelength"]) == set(
+                self.dataset["wavelength"].values.ravel()
+            )
+
+    @unittest.skipUnless(find_spec("zarr"), "zarr is not installed")
+    def test_export_zarr(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.execution.export_data(tmpdir, store_format=labop.Strings.ZARR)
+            group = "/".join(
+                [f"{p}={self.provenance[p]}" for p in labop.PARTITIONS]
+                + [self.provenance["node"].rsplit("/", 1)[-1] + "-measurements"]
+            )
+            dataset = xr.open_zarr(tmpdir, group=group)
+            assert dataset.attrs["primitive"] == "MeasureAbsorbance"
+            assert dataset.sizes[labop.Strings.SAMPLE] == 96
+            assert np.isnan(dataset[labop.Strings.MEASUREMENT].values).all()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+import json
+import os
+import re
+import tempfile
+import unittest
+from collections import Counter
+
+import sbol3
+import tyto
+
+import labop
+from labop.execution_engine import ExecutionEngine
+from labop.utils.helpers import initialize_protocol
+from labop_convert.opentrons.deck_layout import (
+    deck_moves,
+    optimize_layout,
+    relabel_script,
+    travel,
+)
+from labop_convert.opentrons.opentrons_specialization import (
+    REVERSE_LABWARE_MAP,
+    OT2Specialization,
+)
+
+PREFIX_MAP = json.dumps(
+    {"cont": "https://sift.net/container-ontology/container-ontology#"}
+)
+
+
+class TestDeckLayout(unittest.TestCase):
+    def test_optimize_layout(self):
+        script = [
+            "labware1 = protocol.load_labware('corning_96_wellplate_360ul_flat', '1')",
+            "labware9 = protocol.load_labware('opentrons_96_tiprack_300ul', '9')",
+        ]
+        for well in ["A1", "A2", "A3"]:
+            script += [
+                "p300.pick_up_tip()",
+                f"p300.transfer(20, labware1['A1'], labware5['{well}'], new_tip='never')",
+                "p300.drop_tip()",
+            ]
+        moves = deck_moves(script, {"p300": ["9"]}, {})
+        assert moves == Counter(
+            {("12", "9"): 2, ("9", "1"): 3, ("1", "5"): 3, ("5", "12"): 3}
+        )
+
+        # The plate in slot 5 is a module's, so only slots 1 and 9 can move
+        layout = optimize_layout(moves, ["1", "9"], ["1", "2", "3", "6", "8", "9"])
+        assert travel(moves, layout) < travel(moves)
+        assert set(layout.values()).isdisjoint(["5", "12"])
+
+        new_tips = layout.get("9", "9")
+        assert relabel_script(script[1], layout) == (
+            f"labware{new_tips} = protocol.load_labware('opentrons_96_tiprack_300ul', '{new_tips}')"
+        )
+
+    def test_ot2_script(self):
+        protocol, doc = initialize_protocol()
+        specs = {
+            name: labop.ContainerSpec(
+                name,
+                name=name,
+                queryString=REVERSE_LABWARE_MAP[api_name],
+                prefixMap=PREFIX_MAP,
+            )
+            for name, api_name in [
+                ("reagents", "corning_96_wellplate_360ul_flat"),
+                ("assay", "corning_96_wellplate_360ul_flat"),
+                ("tips", "opentrons_96_tiprack_300ul"),
+            ]
+        }
+        plates = {}
+        for name, deck in [("reagents", "1"), ("assay", "11"), ("tips", "3")]:
+            if name != "tips":
+                plates[name] = protocol.primitive_step(
+                    "EmptyContainer", specification=specs[name]
+                )
+            protocol.primitive_step(
+                "LoadRackOnInstrument", rack=specs[name], coordinates=deck
+            )
+        p300 = sbol3.Agent("p300_single")
+        doc.add(p300)
+        protocol.primitive_step("ConfigureRobot", instrument=p300, mount="left")
+
+        for source, destination in [("A1", "B1"), ("A2", "B2"), ("A3", "B3")]:
+            protocol.primitive_step(
+                "Transfer",
+                source=protocol.primitive_step(
+                    "PlateCoordinates",
+                    source=plates["reagents"].output_pin("samples"),
+                    coordinates=source,
+                ).output_pin("samples"),
+                destination=protocol.primitive_step(
+                    "PlateCoordinates",
+                    source=plates["assay"].output_pin("samples"),
+                    coordinates=destination,
+                ).output_pin("samples"),
+                amount=sbol3.Measure(20, tyto.OM.microliter),
+                pipette="left",
+            )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "deck_layout")
+            specialization = OT2Specialization(filename, optimize_layout=True)
+            ee = ExecutionEngine(
+                use_ordinal_time=True,
+                out_dir=tmpdir,
+                specializations=[specialization],
+                failsafe=False,
+            )
+            ee.execute(
+                protocol,
+                sbol3.Agent("test_agent"),
+                id="test_execution",
+                parameter_values=[],
+            )
+            with open(filename + ".py") as f:
+                script = f.read()
+            with open(filename + ".md") as f:
+                markdown = f.read()
+
+        decks = {
+            spec.name: deck
+            for deck, spec in specialization.configuration.items()
+            if type(spec) is labop.ContainerSpec
+        }
+        original = {"reagents": "1", "assay": "11", "tips": "3"}
+        assert decks != original
+        moves = deck_moves(script.splitlines(), {"p300_single": [decks["tips"]]}, {})
+        assert travel(moves) < travel(
+            moves, {decks[name]: original[name] for name in decks}
+        )
+
+        # Every labware that the script uses is loaded in its new slot
+        for name, deck in decks.items():
+            assert re.search(
+                rf"labware{deck} = protocol.load_labware\('[^']*', '{deck}'\)", script
+            )
+            assert f"Load `{name}` in Deck {deck}" in markdown
+        assert f"labware{decks['tips']}" in script
+        assert f"labware{decks['reagents']}['A1']" in script
+        assert f"labware{decks['assay']}['B1']" in script
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,10 @@
 import unittest
 
+import xarray as xr
+
 import labop
 from labop_convert.markdown.protocol_to_markdown import reduce_range_set
+from labop_convert.plate_coordinates import PlateGeometry
 
 
 class TestLocationUtilities(unittest.TestCase):
@@ -25,5 +28,56 @@ class TestLocationUtilities(unittest.TestCase):
             reduce_range_set({})  # must have at least one range
 
 
+class TestPlateGeometry(unittest.TestCase):
+    def test_well_order(self):
+        geometry = PlateGeometry(8, 12)
+        assert geometry.wells[:3].tolist() == ["A1", "A2", "A3"]
+        assert geometry.wells[-1] == "H12"
+        coordinates = ["B1", "A10", "AA1", "A2", "not_a_well"]
+        assert geometry.well_order(coordinates).tolist() == [3, 1, 0, 2, 4]
+
+    def test_sort(self):
+        geometry = PlateGeometry(8, 12)
+        data = xr.DataArray(
+            [1, 2, 3], dims=("sample"), coords={"sample": ["B1", "A10", "A9"]}
+        )
+        sorted_data = geometry.sort(data)
+        assert sorted_data["sample"].data.tolist() == ["A9", "A10", "B1"]
+        assert sorted_data.data.tolist() == [3, 2, 1]
+        assert geometry.sort(sorted_data) is sorted_data
+
+    def test_from_container_spec(self):
+        spec = labop.ContainerSpec(
+            "tube_rack",
+            queryString="cont:Opentrons24TubeRackwithEppendorf1.5mLSafe-LockSnapcap",
+            prefixMap={
+                "cont": "https://sift.net/container-ontology/container-ontology#"
+            },
+        )
+        assert PlateGeometry.from_container_spec(spec) == PlateGeometry(4, 6)
+        # Opentrons load names are lowercase
+        spec.queryString = "opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap"
+        assert PlateGeometry.from_container_spec(spec) == PlateGeometry(4, 6)
+        spec.queryString = "corning_384_wellplate_112ul_flat"
+        assert PlateGeometry.from_container_spec(spec) == PlateGeometry(16, 24)
+        assert PlateGeometry.from_container_spec(None).rectangle == "A1:H12"
+        assert PlateGeometry.from_well_count(384).rectangle == "A1:P24"
+        assert PlateGeometry.from_well_count(1536).rectangle == "A1:AF48"
+
+    def test_indices(self):
+        geometry = PlateGeometry(8, 12)
+        assert geometry.coordinates("A1:B2,C3").tolist() == [
+            "A1",
+            "B1",
+            "A2",
+            "B2",
+            "C3",
+        ]
+        assert geometry.indices("A1:B2").tolist() == [0, 12, 1, 13]
+        assert geometry.mask("A1:H1").sum() == 8
+        with self.assertRaises(ValueError):
+            geometry.indices("A1:I1")
+
+
 if __name__ == "__main__":
     unittest.main()
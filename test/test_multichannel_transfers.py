@@ -0,0 +1,196 @@
+import json
+import os
+import tempfile
+import unittest
+
+import sbol3
+import tyto
+
+import labop
+from labop.execution_engine import ExecutionEngine
+from labop.utils.helpers import initialize_protocol
+from labop_convert.opentrons.opentrons_specialization import (
+    REVERSE_LABWARE_MAP,
+    OT2Specialization,
+)
+from labop_convert.plate_coordinates import full_columns
+
+PREFIX_MAP = json.dumps(
+    {"cont": "https://sift.net/container-ontology/container-ontology#"}
+)
+
+
+class TestMultichannelTransfers(unittest.TestCase):
+    def test_full_columns(self):
+        assert full_columns("A1:H2,A5:H5", 8) == [0, 1, 4]
+        assert full_columns("A1:H12", 8) == list(range(12))
+        assert full_columns("A1:G1", 8) is None
+        assert full_columns("A1:H1,B2", 8) is None
+
+    def execute(self, pipettes, transfers, dispenses=[]):
+        """
+        Execute a protocol with the pipettes on the left and right mounts,
+        the transfers (source, destination, microliters, mount), and the
+        dispenses (source, destination, microliters) between two plates, and
+        get its OT2 script and markdown.
+        """
+        protocol, doc = initialize_protocol()
+        specs = {
+            name: labop.ContainerSpec(
+                name,
+                name=name,
+                queryString=REVERSE_LABWARE_MAP[api_name],
+                prefixMap=PREFIX_MAP,
+            )
+            for name, api_name in [
+                ("reagents", "corning_96_wellplate_360ul_flat"),
+                ("tips", "opentrons_96_tiprack_300ul"),
+                ("assay", "corning_96_wellplate_360ul_flat"),
+            ]
+        }
+        plates = {}
+        for deck, name in enumerate(specs, 1):
+            if name != "tips":
+                plates[name] = protocol.primitive_step(
+                    "EmptyContainer", specification=specs[name]
+                )
+            protocol.primitive_step(
+                "LoadRackOnInstrument", rack=specs[name], coordinates=str(deck)
+            )
+        for mount, name in zip(["left", "right"], pipettes):
+            pipette = sbol3.Agent(name)
+            doc.add(pipette)
+            protocol.primitive_step("ConfigureRobot", instrument=pipette, mount=mount)
+
+        for source, destination, volume, mount in transfers:
+            protocol.primitive_step(
+                "Transfer",
+                source=protocol.primitive_step(
+                    "PlateCoordinates",
+                    source=plates["reagents"].output_pin("samples"),
+                    coordinates=source,
+                ).output_pin("samples"),
+                destination=protocol.primitive_step(
+                    "PlateCoordinates",
+                    source=plates["assay"].output_pin("samples"),
+                    coordinates=destination,
+                ).output_pin("samples"),
+                amount=sbol3.Measure(volume, tyto.OM.microliter),
+                pipette=mount,
+            )
+        for source, destination, volume in dispenses:
+            protocol.primitive_step(
+                "Dispense",
+                source=protocol.primitive_step(
+                    "PlateCoordinates",
+                    source=plates["reagents"].output_pin("samples"),
+                    coordinates=source,
+                ).output_pin("samples"),
+                destination=protocol.primitive_step(
+                    "PlateCoordinates",
+                    source=plates["assay"].output_pin("samples"),
+                    coordinates=destination,
+                ).output_pin("samples"),
+                amount=sbol3.Measure(volume, tyto.OM.microliter),
+            )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "multichannel")
+            specialization = OT2Specialization(filename)
+            ee = ExecutionEngine(
+                use_ordinal_time=True,
+                out_dir=tmpdir,
+                specializations=[specialization],
+                failsafe=False,
+            )
+            ee.execute(
+                protocol,
+                sbol3.Agent("test_agent"),
+                id="test_execution",
+                parameter_values=[],
+            )
+            with open(filename + ".py") as f:
+                script = f.read()
+            with open(filename + ".md") as f:
+                markdown = f.read()
+            # The output is also read from the files by the specialization
+            assert specialization.script == script
+            assert specialization.markdown == markdown
+        # The steps are not kept once they are written
+        assert specialization.script_steps == []
+        assert specialization.markdown_steps == []
+        return script, markdown
+
+    def test_ot2_script(self):
+        script, markdown = self.execute(
+            ["p300_single", "p300_multi_gen2"],
+            [("A1:H1", "A1:H12", 20, "right"), ("A2", "B2", 20, "left")],
+        )
+
+        # One 8-channel transfer into each column, all with the same tips
+        assert script.count("p300_multi_gen2.transfer(") == 12
+        assert (
+            "p300_multi_gen2.transfer(20.0, labware1['A1'], labware3['A12'], new_tip='never')"
+            in script
+        )
+        assert script.count("p300_multi_gen2.pick_up_tip()") == 1
+        assert script.count("p300_single.transfer(") == 1
+        assert "* 1 tip rack for `p300_multi_gen2` (8 tips)" in markdown
+
+    def test_named_pipette(self):
+        # Whole columns are transferred one well at a time by a single channel
+        # pipette, even if a multichannel pipette is configured
+        script, _ = self.execute(
+            ["p300_single", "p300_multi_gen2"], [("A1:H1", "A1:H1", 20, "left")]
+        )
+        assert script.count("p300_single.transfer(") == 64
+        assert "p300_multi_gen2.transfer(" not in script
+
+    def test_volume_range(self):
+        # The multichannel pipette whose range holds the volume transfers
+        # each source column into the destination column paired with it
+        script, _ = self.execute(
+            ["p20_multi_gen2", "p300_multi_gen2"], [("A1:H2", "A3:H4", 100, "left")]
+        )
+        assert "p20_multi_gen2.transfer(" not in script
+        for source, destination in [("A1", "A3"), ("A2", "A4")]:
+            assert (
+                f"p300_multi_gen2.transfer(100.0, labware1['{source}'], labware3['{destination}'], new_tip='never')"
+                in script
+            )
+        assert script.count("p300_multi_gen2.transfer(") == 2
+
+    def test_whole_plate(self):
+        # Each column of a plate goes into the same column of the other
+        script, _ = self.execute(
+            ["p300_single", "p300_multi_gen2"], [("A1:H12", "A1:H12", 20, "right")]
+        )
+        assert script.count(".transfer(") == 12
+        for column in range(1, 13):
+            assert (
+                f"p300_multi_gen2.transfer(20.0, labware1['A{column}'], labware3['A{column}'], new_tip='never')"
+                in script
+            )
+
+    def test_dispense(self):
+        # A Dispense uses the first single channel pipette whose range holds
+        # the volume
+        script, _ = self.execute(
+            ["p20_single_gen2", "p300_single_gen2"], [], [("A1", "A1:A4", 100)]
+        )
+        assert (
+            "p300_single_gen2.distribute(100.0, labware1['A1'], [labware3['A1'], labware3['A2'], labware3['A3'], labware3['A4']], new_tip='never')"
+            in script
+        )
+        assert "p20_single_gen2." not in script
+
+    def test_dispense_out_of_range(self):
+        with self.assertRaises(Exception) as context:
+            self.execute(
+                ["p20_single_gen2", "p300_multi_gen2"], [], [("A1", "A1:A4", 100)]
+            )
+        assert "No configured pipette can dispense" in str(context.exception)
+
+
+if __name__ == "__main__":
+    unittest.main()
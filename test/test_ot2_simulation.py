@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from dataclasses import replace
+from importlib.util import find_spec
+
+from labop.utils.ot2_simulation import SimulationReport, simulate_ot2_scripts
+
+SCRIPT = """\
+from opentrons import protocol_api
+
+metadata = {{'apiLevel': '2.11'}}
+
+def run(protocol: protocol_api.ProtocolContext):
+    labware1 = protocol.load_labware('corning_96_wellplate_360ul_flat', '1')
+    labware2 = protocol.load_labware('opentrons_96_tiprack_300ul', '2')
+    p300_single = protocol.load_instrument('p300_single', 'left')
+    p300_single.tip_racks.append(labware2)
+    p300_single.transfer({volume}, labware1['A1'], labware1['B2'])
+"""
+
+
+class TestOT2Simulation(unittest.TestCase):
+    @unittest.skipUnless(find_spec("opentrons"), "opentrons is not installed")
+    def test_skip_unchanged_scripts(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filenames = [os.path.join(tmpdir, f"script{i}.py") for i in range(3)]
+            for i, filename in enumerate(filenames):
+                with open(filename, "w") as f:
+                    f.write(SCRIPT.format(volume=10 * (i + 1)))
+            report_file = os.path.join(tmpdir, "report.json")
+
+            report = simulate_ot2_scripts(filenames, report_file, max_workers=2)
+            assert [r.filename for r in report.results] == filenames
+            assert not any(r.skipped for r in report.results)
+            assert len({r.digest for r in report.results}) == 3
+            assert all(r.runlog and r.error is None for r in report.results)
+            assert all(r.run_time > 0 for r in report.results)
+
+            with open(filenames[1], "w") as f:
+                f.write(SCRIPT.format(volume=50))
+            rerun = simulate_ot2_scripts(filenames, report_file, max_workers=2)
+            assert [r.skipped for r in rerun.results] == [True, False, True]
+            assert rerun.results[0] == replace(report.results[0], skipped=True)
+            assert SimulationReport.read(report_file) == rerun
+
+            forced = simulate_ot2_scripts(filenames, report_file, force=True)
+            assert not any(r.skipped for r in forced.results)
+
+    def test_retry_failed_scripts(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "script.py")
+            with open(filename, "w") as f:
+                f.write(SCRIPT.format(volume=10) + "    raise ValueError()\n")
+            report_file = os.path.join(tmpdir, "report.json")
+
+            [result] = simulate_ot2_scripts([filename], report_file).results
+            assert result.error is not None
+            [rerun] = simulate_ot2_scripts([filename], report_file).results
+            assert not rerun.skipped
+            assert rerun.error is not None
+
+
+if __name__ == "__main__":
+    unittest.main()
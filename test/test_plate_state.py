@@ -0,0 +1,258 @@
+import os
+import unittest
+
+import numpy as np
+import sbol3
+import tyto
+import xarray as xr
+
+import labop
+from labop.execution_engine import ExecutionEngine
+from labop.utils.helpers import initialize_protocol
+from labop_convert import PlateStateSpecialization
+
+OUT_DIR = os.path.join(os.path.dirname(__file__), "out")
+if not os.path.exists(OUT_DIR):
+    os.mkdir(OUT_DIR)
+
+
+class TestPlateState(unittest.TestCase):
+    def setUp(self):
+        protocol, doc = initialize_protocol()
+        spec = labop.ContainerSpec(
+            "plate",
+            name="plate",
+            queryString="cont:Corning96WellPlate",
+            prefixMap={
+                "cont": "https://sift.net/container-ontology/container-ontology#"
+            },
+        )
+        water = sbol3.Component(
+            "water", "https://identifiers.org/pubchem.substance:24901740"
+        )
+        dye = sbol3.Component(
+            "dye", "https://identifiers.org/pubchem.substance:24901740"
+        )
+        doc.add(water)
+        doc.add(dye)
+
+        plate = protocol.primitive_step("EmptyContainer", specification=spec)
+        column1 = protocol.primitive_step(
+            "PlateCoordinates", source=plate.output_pin("samples"), coordinates="A1:H1"
+        )
+        column2 = protocol.primitive_step(
+            "PlateCoordinates", source=plate.output_pin("samples"), coordinates="A2:H2"
+        )
+        columns3_5 = protocol.primitive_step(
+            "PlateCoordinates", source=plate.output_pin("samples"), coordinates="A3:H5"
+        )
+        protocol.primitive_step(
+            "Provision",
+            resource=dye,
+            destination=column1.output_pin("samples"),
+            amount=sbol3.Measure(100, tyto.OM.microliter),
+        )
+        protocol.primitive_step(
+            "Transfer",
+            source=column1.output_pin("samples"),
+            destination=column2.output_pin("samples"),
+            amount=sbol3.Measure(60, tyto.OM.microliter),
+        )
+        protocol.primitive_step(
+            "SerialDilution",
+            source=column2.output_pin("samples"),
+            destination=columns3_5.output_pin("samples"),
+            diluent=water,
+            amount=sbol3.Measure(100, tyto.OM.microliter),
+            dilution_factor=2,
+            series=3,
+        )
+        protocol.primitive_step(
+            "Discard",
+            samples=column1.output_pin("samples"),
+            amount=sbol3.Measure(0.05, tyto.OM.milliliter),
+        )
+        self.protocol = protocol
+        self.dye = dye
+        self.water = water
+
+    def test_simulate(self):
+        ee = ExecutionEngine(
+            use_ordinal_time=True,
+            out_dir=OUT_DIR,
+            specializations=[PlateStateSpecialization()],
+            failsafe=False,
+        )
+        execution = ee.execute(
+            self.protocol,
+            sbol3.Agent("test_agent"),
+            id="test_execution",
+            parameter_values=[],
+        )
+        [live_state] = ee.specializations
+        simulator = PlateStateSpecialization().simulate(execution)
+        assert simulator.steps == live_state.steps
+
+        [plate] = simulator.wells.keys()
+        final = simulator.container_state(plate)
+        dye = final.sel(contents=self.dye.identity)
+        water = final.sel(contents=self.water.identity)
+        assert np.allclose(final.sel(sample="A1"), 0.0)
+        assert np.allclose(dye.sel(sample="A2"), 10.0)
+        assert np.allclose(dye.sel(sample="A3"), 25.0)
+        assert np.allclose(dye.sel(sample="A4"), 12.5)
+        assert np.allclose(dye.sel(sample="A5"), 12.5)
+        assert np.allclose(water.sel(sample="A5"), 87.5)
+        assert np.allclose(dye.sel(sample="H5"), 12.5)
+        assert np.allclose(simulator.volumes(plate).sel(sample="A6"), 0.0)
+
+        # Earlier steps are unchanged by later ones
+        provision_step = [
+            step
+            for step, record in enumerate(simulator.steps)
+            if "Provision"
+            in str(execution.document.find(record).node.lookup().behavior)
+        ][0]
+        after_provision = simulator.container_state(plate, provision_step)
+        assert np.allclose(after_provision.sel(sample="A1").sum(), 100.0)
+        assert np.allclose(after_provision.sel(sample="A2").sum(), 0.0)
+        assert np.allclose(simulator.container_state(plate, 0), 0.0)
+
+    def test_transfer_from_one_well(self):
+        protocol, doc = initialize_protocol()
+        spec = labop.ContainerSpec(
+            "plate",
+            name="plate",
+            queryString="cont:Corning96WellPlate",
+            prefixMap={
+                "cont": "https://sift.net/container-ontology/container-ontology#"
+            },
+        )
+        dye = sbol3.Component(
+            "dye", "https://identifiers.org/pubchem.substance:24901740"
+        )
+        doc.add(dye)
+        plate = protocol.primitive_step("EmptyContainer", specification=spec)
+        source = protocol.primitive_step(
+            "PlateCoordinates", source=plate.output_pin("samples"), coordinates="A1"
+        )
+        destination = protocol.primitive_step(
+            "PlateCoordinates", source=plate.output_pin("samples"), coordinates="A2:C2"
+        )
+        protocol.primitive_step(
+            "Provision",
+            resource=dye,
+            destination=source.output_pin("samples"),
+            amount=sbol3.Measure(100, tyto.OM.microliter),
+        )
+        protocol.primitive_step(
+            "Transfer",
+            source=source.output_pin("samples"),
+            destination=destination.output_pin("samples"),
+            amount=sbol3.Measure(40, tyto.OM.microliter),
+        )
+        ee = ExecutionEngine(
+            use_ordinal_time=True,
+            out_dir=OUT_DIR,
+            specializations=[PlateStateSpecialization()],
+            failsafe=False,
+        )
+        ee.execute(
+            protocol,
+            sbol3.Agent("test_agent"),
+            id="test_execution",
+            parameter_values=[],
+        )
+        [simulator] = ee.specializations
+        [plate] = simulator.wells.keys()
+        volumes = simulator.volumes(plate)
+        # The well runs dry on the last destination, so no volume is created
+        assert np.allclose(
+            volumes.sel(sample=["A1", "A2", "B2", "C2"]), [0.0, 40.0, 40.0, 20.0]
+        )
+        assert np.allclose(volumes.sum(), 100.0)
+
+    def test_transfer_by_map(self):
+        protocol, doc = initialize_protocol()
+        spec = labop.ContainerSpec(
+            "plate",
+            name="plate",
+            queryString="cont:Corning96WellPlate",
+            prefixMap={
+                "cont": "https://sift.net/container-ontology/container-ontology#"
+            },
+        )
+        dye = sbol3.Component(
+            "dye", "https://identifiers.org/pubchem.substance:24901740"
+        )
+        doc.add(dye)
+        arrays = {}
+        for name in ["source", "target"]:
+            arrays[name] = labop.SampleArray.from_container_spec(spec)
+            arrays[name].name = name
+            arrays[name] = protocol.primitive_step(
+                "EmptyContainer", specification=spec, sample_array=arrays[name]
+            )
+        protocol.primitive_step(
+            "Provision",
+            resource=dye,
+            destination=arrays["source"].output_pin("samples"),
+            amount=sbol3.Measure(100, tyto.OM.microliter),
+        )
+        volumes = np.zeros((1, 1, 2, 3))
+        volumes[0, 0, 0, 0] = 30.0  # A1 -> A1
+        volumes[0, 0, 0, 1] = 50.0  # A1 -> B1
+        volumes[0, 0, 1, 2] = 20.0  # A2 -> A2
+        plan = labop.SampleMap(
+            values=labop.serialize_sample_format(
+                xr.DataArray(
+                    volumes,
+                    dims=(
+                        "source_array",
+                        "target_array",
+                        "source_aliquot",
+                        "target_aliquot",
+                    ),
+                    coords={
+                        "source_array": ["source"],
+                        "target_array": ["target"],
+                        "source_aliquot": ["A1", "A2"],
+                        "target_aliquot": ["A1", "B1", "A2"],
+                    },
+                )
+            ),
+        )
+        protocol.primitive_step(
+            "TransferByMap",
+            source=arrays["source"].output_pin("samples"),
+            destination=arrays["target"].output_pin("samples"),
+            plan=plan,
+            amount=sbol3.Measure(0, tyto.OM.microliter),
+            temperature=sbol3.Measure(30, tyto.OM.degree_Celsius),
+        )
+
+        ee = ExecutionEngine(
+            use_ordinal_time=True,
+            out_dir=OUT_DIR,
+            specializations=[PlateStateSpecialization()],
+            failsafe=False,
+        )
+        execution = ee.execute(
+            protocol,
+            sbol3.Agent("test_agent"),
+            id="test_execution",
+            parameter_values=[],
+        )
+        [simulator] = ee.specializations
+        volumes = {
+            execution.document.find(container).name: simulator.volumes(container)
+            for container in simulator.wells
+        }
+        source, target = volumes["source"], volumes["target"]
+        assert np.allclose(source.sel(sample=["A1", "A2", "B1"]), [20.0, 80.0, 100.0])
+        assert np.allclose(target.sel(sample=["A1", "B1", "A2"]), [30.0, 50.0, 20.0])
+        assert np.allclose(target.sum(), 100.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
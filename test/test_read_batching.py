@@ -0,0 +1,190 @@
+import tempfile
+import unittest
+
+import numpy as np
+import sbol3
+from tyto import OM
+
+import labop
+import labop.read_batching
+from labop.execution_engine import ExecutionEngine
+from labop.lab_interface import set_lab_interface
+from labop.synthetic_lab_interface import SyntheticLabInterface
+from labop.utils.helpers import initialize_protocol
+from labop_convert.behavior_specialization import DefaultBehaviorSpecialization
+
+
+class CountingLabInterface(SyntheticLabInterface):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        # Number of reads taken, batched or not
+        self.reads = 0
+
+    def measure_many(self, reads):
+        self.batches.append([read.method for read in reads])
+        return super().measure_many(reads)
+
+    def measure_absorbance(self, *args, **kwargs):
+        self.reads += 1
+        return super().measure_absorbance(*args, **kwargs)
+
+    def measure_fluorescence(self, *args, **kwargs):
+        self.reads += 1
+        return super().measure_fluorescence(*args, **kwargs)
+
+
+class UntimedLabInterface(SyntheticLabInterface):
+    # Overrides written before kinetic reads did not take a time
+    def measure_absorbance(self, coordinates, wavelength, sample_format):
+        return super().measure_absorbance(coordinates, wavelength, sample_format)
+
+    def measure_fluorescence(
+        self, coordinates, excitation, emission, bandpass, sample_format
+    ):
+        return super().measure_fluorescence(
+            coordinates, excitation, emission, bandpass, sample_format
+        )
+
+
+class EngineWithoutPlateReads(ExecutionEngine):
+    # Like an execution that was not set up by ExecutionEngine.initialize()
+    def initialize(self, *args, **kwargs):
+        super().initialize(*args, **kwargs)
+        self.ex.plate_reads = None
+
+
+class InterruptAfterAbsorbance(DefaultBehaviorSpecialization):
+    def process(self, record, execution):
+        super().process(record, execution)
+        behavior = getattr(record.node.lookup(), "behavior", None)
+        if str(behavior).endswith("MeasureAbsorbance"):
+            raise RuntimeError("Interrupted")
+
+
+class TestReadBatching(unittest.TestCase):
+    def make_protocol(self):
+        protocol, doc = initialize_protocol()
+        plate = protocol.primitive_step(
+            "EmptyContainer", specification=labop.ContainerSpec("deep96")
+        )
+        coordinates = protocol.primitive_step(
+            "PlateCoordinates", source=plate.output_pin("samples"), coordinates="A1:H6"
+        )
+        measures = [
+            protocol.primitive_step(
+                "MeasureAbsorbance",
+                samples=coordinates.output_pin("samples"),
+                wavelength=sbol3.Measure(600, OM.nanometer),
+            )
+        ] + [
+            protocol.primitive_step(
+                "MeasureFluorescence",
+                samples=coordinates.output_pin("samples"),
+                excitationWavelength=sbol3.Measure(excitation, OM.nanometer),
+                emissionWavelength=sbol3.Measure(excitation + 30, OM.nanometer),
+                emissionBandpassWidth=sbol3.Measure(20, OM.nanometer),
+            )
+            for excitation in [485, 530]
+        ]
+        # Reading other samples ends the batch
+        protocol.primitive_step(
+            "MeasureAbsorbance",
+            samples=plate.output_pin("samples"),
+            wavelength=sbol3.Measure(600, OM.nanometer),
+        )
+        return protocol, measures
+
+    def execute(self, lab, specializations=None, engine=ExecutionEngine):
+        protocol, _ = self.make_protocol()
+        previous = set_lab_interface(lab)
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                ee = engine(
+                    use_ordinal_time=True,
+                    out_dir=tmpdir,
+                    failsafe=False,
+                    specializations=specializations
+                    or [DefaultBehaviorSpecialization()],
+                )
+                self.engine = ee
+                execution = ee.execute(
+                    protocol,
+                    sbol3.Agent("test_agent"),
+                    id="test_execution",
+                    parameter_values=[],
+                )
+        finally:
+            set_lab_interface(previous)
+        return {
+            provenance["node"]: dataset[labop.Strings.MEASUREMENT]
+            for provenance, dataset in execution.iter_data()
+        }
+
+    def test_batches(self):
+        protocol, measures = self.make_protocol()
+        batches = protocol.plate_read_batches()
+        assert list(batches.values()) == [measures]
+        assert list(batches.keys()) == [measures[0].identity]
+
+    def test_measure_many(self):
+        lab = CountingLabInterface(seed=5)
+        batched = self.execute(lab)
+        assert lab.batches == [
+            ["measure_absorbance", "measure_fluorescence", "measure_fluorescence"]
+        ]
+        assert len(batched) == 4
+
+        labop.read_batching.batch_plate_reads = False
+        try:
+            lab = CountingLabInterface(seed=5)
+            unbatched = self.execute(lab)
+        finally:
+            labop.read_batching.batch_plate_reads = True
+        assert lab.batches == []
+
+        # Each measurement gets its own reads, as if taken one at a time
+        for node, reads in batched.items():
+            assert reads.notnull().sum() >= 48
+            assert np.array_equal(reads.values, unbatched[node].values, equal_nan=True)
+        _, measures = self.make_protocol()
+        fluorescence = [batched[m.identity].mean().item() for m in measures[1:]]
+        absorbance = batched[measures[0].identity].mean().item()
+        assert fluorescence[0] != fluorescence[1]
+        assert absorbance < 2.0 < fluorescence[0]
+
+    def test_execution_without_plate_reads(self):
+        # The execution gets a PlateReads when its first batch is read
+        lab = CountingLabInterface(seed=5)
+        reads = self.execute(lab, engine=EngineWithoutPlateReads)
+        assert len(lab.batches) == 1
+        assert isinstance(self.engine.ex.plate_reads, labop.PlateReads)
+        # No read is taken again outside of the batch
+        normal = CountingLabInterface(seed=5)
+        expected = self.execute(normal)
+        assert lab.reads == normal.reads
+        for node, values in expected.items():
+            assert np.array_equal(values.values, reads[node].values, equal_nan=True)
+
+    def test_untimed_reads(self):
+        reads = self.execute(UntimedLabInterface(seed=5))
+        assert len(reads) == 4
+
+    def test_interrupted_batch(self):
+        with self.assertRaises(RuntimeError):
+            self.execute(CountingLabInterface(seed=5), [InterruptAfterAbsorbance()])
+        # The fluorescence reads of the batch were left over
+        prefetched = self.engine.ex.plate_reads.prefetched
+        assert sum(len(values) for values in prefetched.values()) == 2
+
+        # ... but belong to the interrupted execution only
+        lab = CountingLabInterface(seed=6)
+        resumed = self.execute(lab)
+        assert len(lab.batches) == 1
+        fresh = self.execute(CountingLabInterface(seed=6))
+        for node, reads in fresh.items():
+            assert np.array_equal(reads.values, resumed[node].values, equal_nan=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import json
+import os
+import tempfile
+import unittest
+
+import sbol3
+import tyto
+
+import labop
+from labop.execution_engine import ExecutionEngine
+from labop.utils.helpers import initialize_protocol
+from labop_convert import MarkdownSpecialization
+from labop_convert.opentrons.opentrons_specialization import (
+    REVERSE_LABWARE_MAP,
+    OT2Specialization,
+)
+from labop_convert.replay import ordered_records, replay_execution
+
+PREFIX_MAP = json.dumps(
+    {"cont": "https://sift.net/container-ontology/container-ontology#"}
+)
+
+
+class TestReplay(unittest.TestCase):
+    def build_protocol(self):
+        protocol, doc = initialize_protocol()
+        specs = {
+            name: labop.ContainerSpec(
+                name,
+                name=name,
+                queryString=REVERSE_LABWARE_MAP[api_name],
+                prefixMap=PREFIX_MAP,
+            )
+            for name, api_name in [
+                ("reagents", "corning_96_wellplate_360ul_flat"),
+                ("assay", "corning_96_wellplate_360ul_flat"),
+                ("tips", "opentrons_96_tiprack_300ul"),
+            ]
+        }
+        plates = {}
+        for deck, name in enumerate(specs, 1):
+            if name != "tips":
+                plates[name] = protocol.primitive_step(
+                    "EmptyContainer", specification=specs[name]
+                )
+            protocol.primitive_step(
+                "LoadRackOnInstrument", rack=specs[name], coordinates=str(deck)
+            )
+        p300 = sbol3.Agent("p300_single")
+        doc.add(p300)
+        protocol.primitive_step("ConfigureRobot", instrument=p300, mount="left")
+
+        for source, destination in [("A1", "B1"), ("A2", "B2:B3")]:
+            protocol.primitive_step(
+                "Transfer",
+                source=protocol.primitive_step(
+                    "PlateCoordinates",
+                    source=plates["reagents"].output_pin("samples"),
+                    coordinates=source,
+                ).output_pin("samples"),
+                destination=protocol.primitive_step(
+                    "PlateCoordinates",
+                    source=plates["assay"].output_pin("samples"),
+                    coordinates=destination,
+                ).output_pin("samples"),
+                amount=sbol3.Measure(20, tyto.OM.microliter),
+                pipette="left",
+            )
+        return protocol, doc
+
+    def replay(self, protocol, doc, specializations, outputs):
+        """
+        Execute protocol with the specializations made by
+        specializations(out_dir), then replay the saved execution with new
+        ones, and read the lines of the outputs of both.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            executed_dir = os.path.join(tmpdir, "executed")
+            replayed_dir = os.path.join(tmpdir, "replayed")
+            for out_dir in [executed_dir, replayed_dir]:
+                os.mkdir(out_dir)
+
+            ee = ExecutionEngine(
+                use_ordinal_time=True,
+                out_dir=executed_dir,
+                specializations=specializations(executed_dir),
+                failsafe=False,
+            )
+            ex = ee.execute(
+                protocol,
+                sbol3.Agent("test_agent"),
+                id="test_execution",
+                parameter_values=[],
+            )
+            filename = os.path.join(tmpdir, "execution.nt")
+            doc.write(filename, sbol3.SORTED_NTRIPLES)
+
+            replayed = replay_execution(
+                filename, specializations(replayed_dir), out_dir=replayed_dir
+            )
+            assert [x.identity for x in replayed] == [ex.identity]
+            lines = {}
+            for out_dir in [executed_dir, replayed_dir]:
+                for name in outputs:
+                    with open(os.path.join(out_dir, name)) as f:
+                        # The markdown is timestamped
+                        lines[out_dir, name] = [
+                            l for l in f if not l.startswith("Timestamp")
+                        ]
+        return ex, [
+            (lines[executed_dir, name], lines[replayed_dir, name]) for name in outputs
+        ]
+
+    def test_replay_ot2(self):
+        protocol, doc = self.build_protocol()
+        ex, [script, markdown] = self.replay(
+            protocol,
+            doc,
+            lambda out_dir: [OT2Specialization(os.path.join(out_dir, "replay"))],
+            ["replay.py", "replay.md"],
+        )
+        executed, replayed = script
+        assert replayed == executed
+        assert (
+            "    p300_single.transfer(20.0, labware1['A2'], labware2['B3'], new_tip='never')  # Transfer ActivityNode name is not defined.\n"
+            in replayed
+        )
+        # The materials are listed in the order of the objects in the document
+        executed, replayed = markdown
+        assert sorted(replayed) == sorted(executed)
+        steps = executed.index("## Steps\n")
+        assert replayed[steps:] == executed[steps:]
+
+        # Every record follows the records whose tokens it consumed
+        records = ordered_records(ex)
+        assert len(records) == len(ex.executions)
+        position = {r.identity: i for i, r in enumerate(records)}
+        for record in records:
+            for flow in record.incoming_flows:
+                source = flow.lookup().token_source
+                assert position[str(source)] < position[record.identity]
+
+    def test_replay_markdown(self):
+        protocol, doc = initialize_protocol()
+        plate = protocol.primitive_step(
+            "EmptyContainer",
+            specification=labop.ContainerSpec(
+                "plate",
+                name="plate",
+                queryString="cont:Plate96Well",
+                prefixMap=PREFIX_MAP,
+            ),
+        )
+        wells = protocol.primitive_step(
+            "PlateCoordinates", source=plate.output_pin("samples"), coordinates="A1"
+        )
+        protocol.primitive_step(
+            "MeasureAbsorbance",
+            samples=wells.output_pin("samples"),
+            wavelength=sbol3.Measure(600, tyto.OM.nanometer),
+        )
+        _, [(executed, replayed)] = self.replay(
+            protocol,
+            doc,
+            lambda out_dir: [MarkdownSpecialization("replay.md")],
+            ["replay.md"],
+        )
+        assert replayed == executed
+
+
+if __name__ == "__main__":
+    unittest.main()
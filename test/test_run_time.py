@@ -0,0 +1,62 @@
+import math
+import unittest
+
+from labop.transfer_merging import TIP_CHANGE_SECONDS
+from labop_convert.opentrons.run_time import (
+    BLOCK_RAMP_RATE,
+    LID_RAMP_RATE,
+    LID_SECONDS,
+    estimate_run_time,
+)
+
+SCRIPT = """\
+labware1 = protocol.load_labware('corning_96_wellplate_360ul_flat', '1')
+labware2 = protocol.load_labware('opentrons_96_tiprack_300ul', '2')
+p300_single = protocol.load_instrument('p300_single', 'left')
+p300_single.tip_racks.append(labware2)
+p300_single.pick_up_tip()
+p300_single.transfer(20.0, labware1['A1'], labware1['C1'], new_tip='never')  # Transfer
+p300_single.distribute(50.0, labware1['A1'], [labware1['A2'], labware1['B2']], new_tip='never')  # Dispense
+p300_single.drop_tip()
+# Incubate
+thermocycler_module.close_lid()
+thermocycler_module.set_lid_temperature(temperature=47)
+thermocycler_module.set_block_temperature(temperature=37, hold_time_minutes=30)
+profile = [{'temperature': 95, 'hold_time_seconds': 30}, {'temperature': 55, 'hold_time_seconds': 30}]
+thermocycler_module.execute_profile(steps=profile, repetitions=2)
+protocol.delay(seconds=10)
+"""
+
+
+class TestRunTime(unittest.TestCase):
+    def test_estimate_run_time(self):
+        estimate = estimate_run_time(SCRIPT.splitlines(), {"p300_single": ["2"]})
+
+        assert estimate.tips == TIP_CHANGE_SECONDS
+        assert estimate.pipetting > 0
+        assert estimate.travel > 0
+        ramps = (
+            (37 - 25) / BLOCK_RAMP_RATE
+            + (95 - 37) / BLOCK_RAMP_RATE
+            + 40 / BLOCK_RAMP_RATE * 3
+        )
+        assert math.isclose(
+            estimate.waiting,
+            LID_SECONDS + 22 / LID_RAMP_RATE + ramps + (30 * 60 + 4 * 30 + 10),
+        )
+        assert math.isclose(
+            estimate.total,
+            estimate.tips + estimate.pipetting + estimate.travel + estimate.waiting,
+        )
+        assert str(estimate) == f"{int(estimate.total // 60 + 1)} min"
+
+        # Larger volumes take longer, and more aspirations
+        longer = estimate_run_time(
+            [line.replace("20.0", "500.0") for line in SCRIPT.splitlines()],
+            {"p300_single": ["2"]},
+        )
+        assert longer.pipetting > estimate.pipetting
+
+
+if __name__ == "__main__":
+    unittest.main()
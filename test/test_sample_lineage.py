@@ -0,0 +1,214 @@
+import json
+import os
+import tempfile
+import unittest
+
+import sbol3
+import tyto
+
+import labop
+from labop.execution_engine import ExecutionEngine
+from labop.utils.helpers import initialize_protocol
+from labop_convert.opentrons.opentrons_specialization import (
+    REVERSE_LABWARE_MAP,
+    OT2Specialization,
+)
+from labop_convert.sample_lineage import LineageIndex
+
+PREFIX_MAP = json.dumps(
+    {"cont": "https://sift.net/container-ontology/container-ontology#"}
+)
+
+
+class TestSampleLineage(unittest.TestCase):
+    def test_lineage_index(self):
+        protocol, doc = initialize_protocol()
+        plate = labop.ContainerSpec(
+            "plate",
+            name="plate",
+            queryString="cont:Corning96WellPlate360uLFlat",
+            prefixMap=PREFIX_MAP,
+        )
+        rack = labop.ContainerSpec(
+            "rack",
+            name="rack",
+            queryString="cont:Opentrons24TubeRack",
+            prefixMap=PREFIX_MAP,
+        )
+        tube = labop.ContainerSpec(
+            "tube",
+            name="tube",
+            queryString="cont:StockReagent",
+            prefixMap=PREFIX_MAP,
+        )
+
+        empty_plate = protocol.primitive_step("EmptyContainer", specification=plate)
+        wells = protocol.primitive_step(
+            "PlateCoordinates",
+            source=empty_plate.output_pin("samples"),
+            coordinates="A1:B2",
+        )
+        empty_rack = protocol.primitive_step("EmptyRack", specification=rack)
+        tubes = protocol.primitive_step(
+            "LoadContainerInRack",
+            slots=empty_rack.output_pin("slots"),
+            container=tube,
+            coordinates="C1",
+        )
+
+        ee = ExecutionEngine(use_ordinal_time=True, failsafe=False)
+        ex = ee.execute(
+            protocol,
+            sbol3.Agent("test_agent"),
+            id="test_execution",
+            parameter_values=[],
+        )
+
+        def samples(step, output="samples"):
+            [record] = [
+                r
+                for r in ex.executions
+                if isinstance(r, labop.CallBehaviorExecution)
+                and r.node == step.identity
+            ]
+            return record.call.lookup().parameter_value_map()[output]["value"]
+
+        index = LineageIndex(ex)
+        lineage = index[samples(wells)]
+        assert lineage.container == plate
+        assert lineage.rack is None
+        assert lineage.labware == plate
+        assert lineage.coordinates == "A1:B2"
+        assert lineage.behavior_type == "PlateCoordinates"
+        assert index[samples(empty_plate)].coordinates is None
+
+        lineage = index[samples(tubes)]
+        assert lineage.container == tube
+        assert lineage.rack == rack
+        assert lineage.labware == rack
+        assert lineage.coordinates == "C1"
+        assert index[samples(empty_rack, "slots")].labware == rack
+
+        # The records are indexed only once
+        indexed = len(index.lineage)
+        assert index.get(sbol3.Agent("unknown")) is None
+        assert len(index.lineage) == indexed
+        with self.assertRaises(KeyError):
+            index[sbol3.Agent("unknown")]
+
+    def test_ot2_lineage(self):
+        protocol, doc = initialize_protocol()
+        specs = {
+            name: labop.ContainerSpec(
+                name,
+                name=name,
+                queryString=REVERSE_LABWARE_MAP[api_name],
+                prefixMap=PREFIX_MAP,
+            )
+            for name, api_name in [
+                ("tips", "opentrons_96_tiprack_300ul"),
+                ("tube_rack", "opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap"),
+                ("assay", "corning_96_wellplate_360ul_flat"),
+                ("plate", "nest_96_wellplate_200ul_flat"),
+            ]
+        }
+        tube = labop.ContainerSpec(
+            "tube",
+            name="tube",
+            queryString="https://sift.net/container-ontology/container-ontology#MicrofugeTube",
+            prefixMap=PREFIX_MAP,
+        )
+        pipette = sbol3.Agent("p300_single")
+        module = sbol3.Agent("temperature_module", name="Temperature Module GEN1")
+        dye = sbol3.Component(
+            "dye", "https://identifiers.org/pubchem.substance:24901740"
+        )
+        doc.add([pipette, module, dye])
+
+        protocol.primitive_step("ConfigureRobot", instrument=module, mount="4")
+        for deck, name in enumerate(["tips", "tube_rack", "assay"], 1):
+            protocol.primitive_step(
+                "LoadRackOnInstrument", rack=specs[name], coordinates=str(deck)
+            )
+        protocol.primitive_step("ConfigureRobot", instrument=pipette, mount="left")
+
+        # A tube in the rack holds the dye, and a plate sits on the module
+        tubes = protocol.primitive_step(
+            "LoadContainerInRack",
+            slots=protocol.primitive_step(
+                "EmptyRack", specification=specs["tube_rack"]
+            ).output_pin("slots"),
+            container=tube,
+            coordinates="A1",
+        )
+        protocol.primitive_step(
+            "Provision",
+            resource=dye,
+            destination=tubes.output_pin("samples"),
+            amount=sbol3.Measure(1000, tyto.OM.microliter),
+        )
+        plate = protocol.primitive_step(
+            "LoadContainerOnInstrument",
+            specification=specs["plate"],
+            slots="A1",
+            instrument=module,
+        )
+        assay = protocol.primitive_step("EmptyContainer", specification=specs["assay"])
+
+        def wells(step, coordinates):
+            return protocol.primitive_step(
+                "PlateCoordinates",
+                source=step.output_pin("samples"),
+                coordinates=coordinates,
+            ).output_pin("samples")
+
+        protocol.primitive_step(
+            "Transfer",
+            source=tubes.output_pin("samples"),
+            destination=plate.output_pin("samples"),
+            amount=sbol3.Measure(100, tyto.OM.microliter),
+            pipette="left",
+        )
+        protocol.primitive_step(
+            "Dispense",
+            source=plate.output_pin("samples"),
+            destination=wells(assay, "A1:A3"),
+            amount=sbol3.Measure(50, tyto.OM.microliter),
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "lineage")
+            ee = ExecutionEngine(
+                use_ordinal_time=True,
+                out_dir=tmpdir,
+                specializations=[OT2Specialization(filename)],
+                failsafe=False,
+            )
+            ee.execute(
+                protocol,
+                sbol3.Agent("test_agent"),
+                id="test_execution",
+                parameter_values=[],
+            )
+            with open(filename + ".py") as f:
+                script = f.read()
+            with open(filename + ".md") as f:
+                markdown = f.read()
+
+        assert "into `tube` located in A1 of `tube_rack`" in markdown
+        # The plate on the module is loaded on deck 4 through the module
+        assert "labware4 = temperature_module.load_labware(" in script
+        assert (
+            "p300_single.transfer(100.0, labware2['A1'], labware4['A1'], new_tip='never')"
+            in script
+        )
+        assert (
+            "p300_single.distribute(50.0, labware4['A1'], [labware3['A1'], labware3['A2'], labware3['A3']], new_tip='never')"
+            in script
+        )
+        # The tip only touched the dye, which Provision put in the tube
+        assert script.count("p300_single.pick_up_tip()") == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,15 @@
 import filecmp
+import json
 import logging
 import os
 import tempfile
 import unittest
 from importlib.machinery import SourceFileLoader
-from importlib.util import module_from_spec, spec_from_loader
+from importlib.util import find_spec, module_from_spec, spec_from_loader
+from urllib.parse import unquote
 
+import numpy as np
+import pandas as pd
 import sbol3
 import tyto
 import xarray as xr
@@ -146,6 +150,10 @@ class TestProtocolEndToEnd(unittest.TestCase):
 
         execution.to_dot().render(os.path.join(OUT_DIR, f"{protocol.name}_execution"))
 
+        # The data template has not been filled in, so nothing is loaded
+        data_file = os.path.join(OUT_DIR, f"{filename}_data.xlsx")
+        assert execution.load_data_sheets(data_file) == []
+
         # dataset = execution.parameter_values[0].value.get_value()
         # xr_dataset = labop.sort_samples(dataset.to_dataset())
         # df = xr_dataset.to_dataframe()
@@ -247,5 +255,491 @@ class TestProtocolEndToEnd(unittest.TestCase):
         print("File identical with test file")
 
 
+class TestSampleFormatEncoding(unittest.TestCase):
+    def test_binary_round_trip(self):
+        samples = get_sample_list(geometry="A1:P24")
+        data = xr.DataArray(
+            [float(i) for i in range(len(samples))],
+            name="data",
+            dims=(labop.Strings.SAMPLE),
+            coords={labop.Strings.SAMPLE: samples},
+        )
+        serialized = labop.serialize_sample_format(data)
+        assert serialized.startswith(labop.BINARY_ENCODING_TAG)
+        assert len(serialized) < len(
+            labop.serialize_sample_format(data, encoding=labop.Strings.JSON)
+        )
+        assert labop.deserialize_sample_format(serialized).equals(
+            labop.sort_samples(data)
+        )
+
+        metadata = xr.Dataset(
+            {"reagent": xr.DataArray(["water"] * len(samples), dims="sample")},
+            coords={labop.Strings.SAMPLE: samples},
+        )
+        assert labop.deserialize_sample_format(
+            labop.serialize_sample_format(metadata)
+        ).equals(labop.sort_samples(metadata))
+
+    def test_legacy_json_is_readable(self):
+        data = xr.DataArray(
+            [1.0, nan],
+            name="data",
+            dims=(labop.Strings.SAMPLE),
+            coords={labop.Strings.SAMPLE: ["A1", "A2"]},
+        )
+        legacy = labop.serialize_sample_format(data, encoding=labop.Strings.JSON)
+        binary = labop.serialize_sample_format(data)
+        assert labop.deserialize_sample_format(legacy).equals(
+            labop.deserialize_sample_format(binary)
+        )
+        assert labop.deserialize_sample_format(
+            labop.serialize_sample_format({"A1": None})
+        ) == {"A1": None}
+
+    def test_deserialization_cache(self):
+        data = xr.DataArray(
+            [1.0, 2.0],
+            name="data",
+            dims=(labop.Strings.SAMPLE),
+            coords={labop.Strings.SAMPLE: ["A1", "A2"]},
+        )
+        serialized = labop.serialize_sample_format(data)
+        first = labop.deserialize_sample_format(serialized)
+        first.name = "renamed"
+        with self.assertRaises(ValueError):
+            first[0] = 10.0  # cached values are read-only
+        second = labop.deserialize_sample_format(serialized)
+        assert second.name == "data"
+        assert second.equals(data)
+
+
+class TestSampleMask(unittest.TestCase):
+    def setUp(self):
+        self.protocol, doc = initialize_protocol()
+        spec = labop.ContainerSpec(
+            "plate",
+            queryString="cont:Corning96WellPlate",
+            prefixMap={
+                "cont": "https://sift.net/container-ontology/container-ontology#"
+            },
+        )
+        doc.add(spec)
+        self.sample_array = labop.SampleArray.from_container_spec(spec)
+        self.protocol.primitive_step(
+            "EmptyContainer", specification=spec, sample_array=self.sample_array
+        )
+
+    def test_from_coordinates(self):
+        mask = labop.SampleMask.from_coordinates(self.sample_array, "A1:B2")
+        assert mask.to_data_array().dtype == bool
+        assert mask.get_coordinates() == ["A1", "A2", "B1", "B2"]
+        assert self.sample_array.mask(mask).sizes["sample"] == 4
+
+    def test_set_operations(self):
+        first = labop.SampleMask.from_coordinates(self.sample_array, "A1:B2")
+        second = labop.SampleMask.from_coordinates(self.sample_array, "B1:C2")
+        assert first.union(second).get_coordinates() == [
+            "A1",
+            "A2",
+            "B1",
+            "B2",
+            "C1",
+            "C2",
+        ]
+        assert first.intersection(second).get_coordinates() == ["B1", "B2"]
+        complement = first.complement().get_coordinates()
+        assert len(complement) == 92
+        assert "A1" not in complement and "A3" in complement
+
+    def test_legacy_masks(self):
+        # Masks used to hold the contents of the selected samples, which may
+        # be zero or have more than one dimension
+        for contents in [
+            np.zeros(96),
+            np.arange(96 * 3, dtype=float).reshape(96, 3),
+        ]:
+            dims = (labop.Strings.SAMPLE, "component")[: contents.ndim]
+            source = xr.DataArray(
+                contents,
+                dims=dims,
+                coords={labop.Strings.SAMPLE: get_sample_list(geometry="A1:H12")},
+            )
+            mask = labop.SampleMask(source=self.sample_array)
+            mask.mask = labop.serialize_sample_format(
+                source.sel({labop.Strings.SAMPLE: ["A1", "B2"]})
+            )
+            self.protocol.primitive_step(
+                "PlateCoordinates", source=mask, coordinates="A1"
+            )
+            assert mask.to_data_array().dtype == bool
+            assert mask.get_coordinates() == ["A1", "B2"]
+            assert len(mask.complement().get_coordinates()) == 94
+            assert self.sample_array.mask(mask).sizes["sample"] == 2
+
+
+class TestDatasetMerge(unittest.TestCase):
+    def setUp(self):
+        protocol, doc = initialize_protocol()
+        self.execution = labop.ProtocolExecution("test_execution", protocol=protocol)
+        doc.add(self.execution)
+        self.samples = get_sample_list("A1:H12")
+
+    def add_to_execution(self, dataset):
+        self.execution.flows.append(
+            labop.ActivityEdgeFlow(value=uml.LiteralIdentified(value=dataset))
+        )
+        return dataset
+
+    def measurement(self, offset):
+        data = labop.SampleData(
+            values=labop.serialize_sample_format(
+                xr.DataArray(
+                    np.arange(len(self.samples)) + offset,
+                    dims=(labop.Strings.SAMPLE),
+                    coords={labop.Strings.SAMPLE: self.samples},
+                )
+            )
+        )
+        return self.add_to_execution(labop.Dataset(data=data))
+
+    def test_nested_datasets_are_memoized(self):
+        first = self.measurement(1.0)
+        second = self.measurement(2.0)
+        joint = self.add_to_execution(labop.Dataset(dataset=[first, second]))
+        top = self.add_to_execution(labop.Dataset(dataset=[joint, first]))
+
+        labop.clear_dataset_cache()
+        merged = top.to_dataset()
+        assert len(merged.data_vars) == 2
+        # The merge of each Dataset in the DAG is cached once, and the merge of
+        # first is reused by top
+        info = labop.dataset_cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 4, 4)
+        # The payloads are only hashed once
+        digest = first.data._payload_digests["values"]
+        assert top.to_dataset().identical(merged)
+        assert labop.dataset_cache_info().hits == 2
+        assert first.data._payload_digests["values"] is digest
+
+        # Changing nested data invalidates the merge
+        first.data.values = labop.serialize_sample_format(
+            xr.DataArray(
+                np.zeros(len(self.samples)),
+                dims=(labop.Strings.SAMPLE),
+                coords={labop.Strings.SAMPLE: self.samples},
+            )
+        )
+        assert float(top.to_dataset()[first.data.identity].sum()) == 0.0
+
+    def test_humanize(self):
+        document = self.execution.document
+        water = sbol3.Component(
+            "water", "https://identifiers.org/pubchem.substance:24901740"
+        )
+        water.name = "Water"
+        document.add(water)
+        contents = [water.identity, "water", "none"] * 32
+        metadata = labop.SampleMetadata(
+            descriptions=labop.serialize_sample_format(
+                xr.Dataset(
+                    {"contents": (labop.Strings.SAMPLE, contents)},
+                    coords={labop.Strings.SAMPLE: self.samples},
+                )
+            )
+        )
+        dataset = self.measurement(1.0)
+        dataset.data.name = "absorbance"
+        dataset.metadata = [metadata]
+
+        labop.clear_humanize_cache()
+        humanized = dataset.to_dataset(humanize=True)
+        assert "absorbance" in humanized.data_vars
+        contents = humanized["contents"].sel({labop.Strings.SAMPLE: self.samples})
+        assert contents.data[:3].tolist() == [str(water), str(water), "none"]
+        # Objects added after the document was indexed are found
+        none = sbol3.Component(
+            "none", "https://identifiers.org/pubchem.substance:24901740"
+        )
+        none.name = "Nothing"
+        document.add(none)
+        humanized = dataset.to_dataset(humanize=True)
+        contents = humanized["contents"].sel({labop.Strings.SAMPLE: self.samples})
+        assert contents.data[2] == "Nothing"
+
+    def test_data_sheets(self):
+        dataset = self.measurement(1.0)
+        dataset.data.name = "absorbance"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "data.xlsx")
+            dataset.update_data_sheet(path, "dataset_0")
+            dataset.data.update_data_sheet(path, "data_1")
+            sheets = labop.read_data_sheets(path)
+            assert list(sheets.keys()) == ["dataset_0", "data_1"]
+            assert len(sheets["data_1"]) == len(self.samples)
+
+            # Data filled into the template is loaded into the SampleData
+            sheets["data_1"]["absorbance"] = 0.5
+            labop.write_data_sheets(path, sheets)
+            dataset.data.update_data_sheet(path, "data_1")
+            values = labop.deserialize_sample_format(dataset.data.values)
+            assert np.allclose(values, 0.5)
+            assert list(labop.read_data_sheets(path).keys()) == [
+                "dataset_0",
+                "data_1",
+            ]
+
+    def test_load_data_sheets(self):
+        data = [self.measurement(0.0).data for _ in range(3)]
+        sheets = {
+            f"data_{i}": sd.to_data_sheet().sample(frac=1.0, random_state=i)
+            for i, sd in enumerate(data)
+        }
+        for sheet in sheets.values():
+            sheet[sheet.columns[1]] = 2.0 * sheet[labop.Strings.SAMPLE].map(
+                {s: i for i, s in enumerate(self.samples)}
+            )
+        sheets["data_2"][sheets["data_2"].columns[1]] = np.nan
+        sheets[labop.DATA_SHEET_INDEX] = labop.data_sheet_index(
+            {f"data_{i}": sd.identity for i, sd in enumerate(data)}
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "data.xlsx")
+            labop.write_data_sheets(path, sheets)
+            updated = self.execution.load_data_sheets(path)
+            assert updated == data[:2]
+            for sd in updated:
+                values = sd.to_data_array().sel({labop.Strings.SAMPLE: self.samples})
+                assert np.allclose(values, 2.0 * np.arange(len(self.samples)))
+            values = data[2].to_data_array().sel({labop.Strings.SAMPLE: self.samples})
+            assert np.allclose(values, np.arange(len(self.samples)))
+
+            # Sheets must list the samples of their SampleData
+            sheets["data_0"] = sheets["data_0"].iloc[1:]
+            labop.write_data_sheets(path, sheets)
+            with self.assertRaises(ValueError):
+                self.execution.load_data_sheets(path)
+
+    @unittest.skipUnless(find_spec("dask"), "dask is not installed")
+    def test_chunked_merge(self):
+        joint = self.add_to_execution(
+            labop.Dataset(dataset=[self.measurement(1.0), self.measurement(2.0)])
+        )
+        lazy = joint.to_dataset(chunks={labop.Strings.SAMPLE: 32})
+        for variable in lazy.data_vars.values():
+            assert variable.chunks == ((32, 32, 32),)
+        assert lazy.compute().identical(joint.to_dataset())
+
+
+class TestKineticMeasurement(unittest.TestCase):
+    def setUp(self):
+        # The data template is rewritten by the tests, so it is not shared
+        self.out_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.out_dir.cleanup)
+        self.execute([2, 4, 6])
+
+    def execute(self, hours):
+        protocol, doc = initialize_protocol()
+        plate = protocol.primitive_step(
+            "EmptyContainer", specification=labop.ContainerSpec("deep96")
+        )
+        coordinates = protocol.primitive_step(
+            "PlateCoordinates", source=plate.output_pin("samples"), coordinates="A1:B12"
+        )
+        measure = protocol.primitive_step(
+            "MeasureAbsorbance",
+            samples=coordinates.output_pin("samples"),
+            wavelength=sbol3.Measure(600, OM.nanometer),
+            timepoints=[sbol3.Measure(t, OM.hour) for t in hours],
+        )
+        protocol.designate_output(
+            "measurements",
+            "http://bioprotocols.org/labop#Dataset",
+            source=measure.output_pin("measurements"),
+        )
+        self.protocol = protocol
+        self.ee = ExecutionEngine(
+            use_ordinal_time=True,
+            out_dir=self.out_dir.name,
+            failsafe=False,
+            dataset_file="kinetic_measurement_data",
+        )
+        self.execution = self.ee.execute(
+            protocol,
+            sbol3.Agent("test_agent"),
+            id="test_execution",
+            parameter_values=[],
+        )
+        [(provenance, _)] = self.execution.iter_data()
+        self.dataset = self.execution.document.find(provenance["data"])
+        self.sample_data = self.dataset.data
+
+    def test_time_dimension(self):
+        assert len(self.sample_data.values.split(labop.CHUNK_SEPARATOR)) == 3
+        values = self.sample_data.to_data_array()
+        assert values.dims == (labop.Strings.TIME, labop.Strings.SAMPLE)
+        assert values[labop.Strings.TIME].data.tolist() == [2, 4, 6]
+        assert values[labop.Strings.TIME].attrs["unit"] == OM.hour
+
+        reads = values.isel({labop.Strings.TIME: 0}, drop=True).fillna(0.5)
+        self.sample_data.append(reads, time=8)
+        values = self.sample_data.to_data_array()
+        assert values[labop.Strings.TIME].data.tolist() == [2, 4, 6, 8]
+        assert np.allclose(values.sel({labop.Strings.TIME: 8}), 0.5)
+        assert values.sel({labop.Strings.TIME: [2, 4, 6]}).isnull().all()
+
+        dataset = self.dataset.to_dataset()
+        assert dataset[self.sample_data.identity].dims == values.dims
+        assert dataset["wavelength"].dims == (labop.Strings.SAMPLE,)
+        assert "timepoints" not in dataset
+
+    def test_successive_appends(self):
+        reads = (
+            self.sample_data.to_data_array()
+            .isel({labop.Strings.TIME: 0}, drop=True)
+            .fillna(0.0)
+        )
+        for time in [8, 10, 12]:
+            self.sample_data.append(reads + time, time=time)
+
+        # Serializing the document joins the appended chunks
+        document = self.execution.document.write_string(sbol3.SORTED_NTRIPLES)
+        chunks = self.sample_data.values.split(labop.CHUNK_SEPARATOR)
+        assert len(chunks) == 6
+        assert chunks[-1] in document
+        values = self.sample_data.to_data_array()
+        assert values[labop.Strings.TIME].data.tolist() == [2, 4, 6, 8, 10, 12]
+        for time in [8, 10, 12]:
+            assert np.allclose(values.sel({labop.Strings.TIME: time}), time)
+
+    def test_one_timepoint(self):
+        self.execute([2])
+        values = self.sample_data.to_data_array()
+        assert values[labop.Strings.TIME].data.tolist() == [2]
+        # A single timepoint is not per-sample metadata either
+        assert "timepoints" not in self.dataset.to_dataset()
+
+    def test_data_sheets(self):
+        data_file = self.ee.data_template_path()
+        sheets = labop.read_data_sheets(data_file)
+        [sheet_name] = [
+            sheet
+            for sheet, data in self.ee.data_id_map.items()
+            if data == self.sample_data.identity
+        ]
+        sheet = sheets[sheet_name]
+        assert len(sheet) == 3 * 24
+        sheet[sheet.columns[-1]] = sheet[labop.Strings.TIME]
+        labop.write_data_sheets(data_file, sheets)
+        assert self.execution.load_data_sheets(data_file) == [self.sample_data]
+        values = self.sample_data.to_data_array()
+        assert np.allclose(values.sel({labop.Strings.TIME: 4}), 4)
+
+    def test_reused_engine(self):
+        # Sheets added to the workbook between executions are kept
+        data_file = self.ee.data_template_path()
+        sheets = labop.read_data_sheets(data_file)
+        sheets["notes"] = pd.DataFrame({"note": ["filled in by hand"]})
+        labop.write_data_sheets(data_file, sheets)
+        execution = self.ee.execute(
+            self.protocol,
+            sbol3.Agent("test_agent"),
+            id="second_execution",
+            parameter_values=[],
+        )
+        sheets = labop.read_data_sheets(data_file)
+        assert sheets["notes"]["note"].tolist() == ["filled in by hand"]
+        # The index only lists the data of the second execution
+        [(provenance, _)] = execution.iter_data()
+        sample_data = execution.document.find(provenance["data"]).data
+        assert list(self.ee.data_id_map.values()) == [sample_data.identity]
+
+
+class TestFluorescenceSpectrum(unittest.TestCase):
+    def execute(self, tmpdir, **kwargs):
+        protocol, doc = initialize_protocol()
+        plate = protocol.primitive_step(
+            "EmptyContainer", specification=labop.ContainerSpec("deep96")
+        )
+        coordinates = protocol.primitive_step(
+            "PlateCoordinates", source=plate.output_pin("samples"), coordinates="A1:B12"
+        )
+        measure = protocol.primitive_step(
+            "MeasureFluorescenceSpectrum",
+            samples=coordinates.output_pin("samples"),
+            excitationWavelength=sbol3.Measure(488, OM.nanometer),
+        )
+        protocol.designate_output(
+            "measurements",
+            "http://bioprotocols.org/labop#Dataset",
+            source=measure.output_pin("measurements"),
+        )
+        ee = ExecutionEngine(
+            use_ordinal_time=True, out_dir=tmpdir, failsafe=False, **kwargs
+        )
+        execution = ee.execute(
+            protocol,
+            sbol3.Agent("test_agent"),
+            id="test_execution",
+            parameter_values=[],
+        )
+        [(provenance, _)] = execution.iter_data()
+        return doc, execution.document.find(provenance["data"])
+
+    def test_in_document(self):
+        # Unless the engine is given a data_dir, the spectra stay in the
+        # document
+        with tempfile.TemporaryDirectory() as tmpdir:
+            _, dataset = self.execute(tmpdir)
+            assert dataset.data.values.startswith(labop.BINARY_ENCODING_TAG)
+            assert not os.path.exists(os.path.join(tmpdir, "data"))
+            assert dataset.data.to_data_array().shape == (24, 551)
+
+    def test_spectrum(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            doc, dataset = self.execute(tmpdir, data_dir=os.path.join(tmpdir, "data"))
+
+            # The spectra are stored in a file rather than in the document
+            assert dataset.data.values.startswith(labop.EXTERNAL_ENCODING_TAG)
+            assert len(dataset.data.values) < 10000
+            assert len(os.listdir(os.path.join(tmpdir, "data"))) == 1
+
+            spectra = dataset.data.to_data_array()
+            assert spectra.dims == (
+                labop.Strings.SAMPLE,
+                labop.Strings.EMISSION_WAVELENGTH,
+            )
+            assert spectra.shape == (24, 551)
+            assert isinstance(spectra.variable._data, np.memmap)
+
+            # Slicing by wavelength does not read the spectra into memory
+            green = spectra.sel(
+                {labop.Strings.EMISSION_WAVELENGTH: slice(500.0, 550.0)}
+            )
+            assert green.shape == (24, 51)
+            assert np.shares_memory(green.values, spectra.values)
+            merged = dataset.to_dataset()[dataset.data.identity]
+            assert merged.dims == spectra.dims
+            assert merged.sizes[labop.Strings.EMISSION_WAVELENGTH] == 551
+            labop.clear_dataset_cache()
+
+            # The document names the file without its directory, so that it
+            # can be read from elsewhere given the directory of the data
+            header = json.loads(
+                unquote(dataset.data.values[len(labop.EXTERNAL_ENCODING_TAG) :])
+            )
+            assert header["file"] == os.listdir(os.path.join(tmpdir, "data"))[0]
+            path = os.path.join(tmpdir, "execution.nt")
+            doc.write(path, sbol3.SORTED_NTRIPLES)
+            reloaded = sbol3.Document()
+            reloaded.read(path)
+            values = reloaded.find(dataset.data.identity)
+            with self.assertRaises(Exception):
+                values.to_data_array()
+            labop.add_external_data_dir(reloaded, os.path.join(tmpdir, "data"))
+            assert values.to_data_array().equals(spectra)
+            labop.clear_dataset_cache()
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -4,6 +4,7 @@ import os
 import tempfile
 import unittest
 
+import numpy as np
 import xarray as xr
 
 from labop.data import serialize_sample_format
@@ -21,6 +22,7 @@ import labop
 import uml
 from labop.execution_engine import ExecutionEngine
 from labop_convert.plate_coordinates import (
+    PlateGeometry,
     coordinate_rect_to_row_col_pairs,
     coordinate_to_row_col,
     get_sample_list,
@@ -433,5 +435,89 @@ class TestProtocolEndToEnd(unittest.TestCase):
         self.assertEqual(coordinate_to_row_col("H12"), (7, 11))
 
 
+class TestTransferMatrix(unittest.TestCase):
+    def test_matches_dense_transfer(self):
+        rng = np.random.default_rng(0)
+        for well_count in [96, 384, 1536]:
+            with self.subTest(well_count=well_count):
+                wells = PlateGeometry.from_well_count(well_count).wells
+                source_contents = xr.DataArray(
+                    rng.random((well_count, 3)) * 100.0,
+                    dims=(Strings.SAMPLE, "contents"),
+                    coords={Strings.SAMPLE: wells, "contents": ["a", "b", "c"]},
+                )
+                target_contents = xr.zeros_like(source_contents)
+                volumes = np.zeros((well_count, well_count))
+                volumes[np.arange(well_count), rng.permutation(well_count)] = 5.0
+                volumes[0, :8] = 1.0
+                transfer = xr.DataArray(
+                    volumes,
+                    dims=("source_aliquot", "target_aliquot"),
+                    coords={"source_aliquot": wells, "target_aliquot": wells},
+                )
+
+                matrix = labop.TransferMatrix.from_data_array(transfer)
+                assert matrix.nnz == np.count_nonzero(volumes)
+                assert matrix.to_data_array().equals(transfer)
+
+                source_result, target_result = matrix.apply(
+                    source_contents, target_contents
+                )
+                dense_source, dense_target = labop.dense_transfer(
+                    source_contents, target_contents, transfer
+                )
+                xr.testing.assert_allclose(
+                    source_result, dense_source.transpose(*source_result.dims)
+                )
+                xr.testing.assert_allclose(
+                    target_result, dense_target.transpose(*target_result.dims)
+                )
+
+    def test_limit(self):
+        aliquots = get_sample_list("A1:A3")
+        contents = xr.DataArray(
+            [[40.0, 20.0], [0.0, 0.0], [0.0, 0.0]],
+            dims=(Strings.SAMPLE, "contents"),
+            coords={Strings.SAMPLE: aliquots, "contents": ["a", "b"]},
+        )
+        # A1 holds 60, so the second transfer from it only gets the last 10
+        matrix = labop.TransferMatrix(aliquots, aliquots, [0, 0], [1, 2], [50.0, 50.0])
+        assert matrix.limit([60.0, 0.0, 0.0]).tolist() == [50.0, 10.0]
+        source_result, target_result = matrix.apply(contents, contents)
+        assert np.allclose(source_result.sel(sample="A1"), 0.0)
+        assert np.allclose(target_result.sum(dim="contents"), [60.0, 50.0, 10.0])
+
+    def test_sample_map_transfer_matrix(self):
+        aliquots = get_sample_list("A1:A2")
+        source = labop.SampleArray(name="source")
+        target = labop.SampleArray(name="target")
+        plan = labop.SampleMap(
+            sources=[source],
+            targets=[target],
+            values=serialize_sample_format(
+                xr.DataArray(
+                    [[[[0.0, 10.0], [0.0, 0.0]]]],
+                    dims=(
+                        "source_array",
+                        "target_array",
+                        "source_aliquot",
+                        "target_aliquot",
+                    ),
+                    coords={
+                        "source_array": ["source"],
+                        "target_array": ["target"],
+                        "source_aliquot": aliquots,
+                        "target_aliquot": aliquots,
+                    },
+                )
+            ),
+        )
+        matrix = plan.transfer_matrix(source, target)
+        assert matrix.shape == (2, 2)
+        assert matrix.rows.tolist() == [0]
+        assert matrix.columns.tolist() == [1]
+        assert matrix.volumes.tolist() == [10.0]
+
+
 if __name__ == "__main__":
     unittest.main()
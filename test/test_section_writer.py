@@ -0,0 +1,161 @@
+import io
+import os
+import tempfile
+import unittest
+
+import sbol3
+import tyto
+
+import labop
+from labop.execution_engine import ExecutionEngine
+from labop.utils.helpers import initialize_protocol
+from labop_convert import MarkdownSpecialization
+from labop_convert.opentrons.opentrons_specialization import OT2Specialization
+from labop_convert.section_writer import SectionWriter
+
+
+class UnreadableSink(io.StringIO):
+    def readable(self):
+        return False
+
+    def seekable(self):
+        return False
+
+
+class TestSectionWriter(unittest.TestCase):
+    def write_sections(self, writer: SectionWriter):
+        writer.write("# Protocol\n")
+        writer.placeholder("materials")
+        writer.write("## Steps\n")
+        writer.placeholder("empty")
+        for i in range(1, 4):
+            writer.write(f"{i}. Step {i}\n")
+        writer.placeholder("summary")
+        writer.write("Done\n")
+        writer.fill("materials", "## Materials\n* Plate\n")
+        writer.fill("summary", "3 steps\n")
+
+    expected = (
+        "# Protocol\n## Materials\n* Plate\n## Steps\n"
+        "1. Step 1\n2. Step 2\n3. Step 3\n3 steps\nDone\n"
+    )
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "protocol.md")
+            writer = SectionWriter(filename)
+            self.write_sections(writer)
+            writer.flush()
+            # The steps are written before the sections are filled
+            with open(filename) as f:
+                assert (
+                    f.read()
+                    == "# Protocol\n## Steps\n1. Step 1\n2. Step 2\n3. Step 3\nDone\n"
+                )
+            writer.close()
+            with open(filename) as f:
+                assert f.read() == self.expected
+
+    def test_file_like(self):
+        for sink in [io.StringIO(), UnreadableSink()]:
+            with SectionWriter(sink) as writer:
+                self.write_sections(writer)
+            assert sink.getvalue() == self.expected
+            assert not sink.closed
+
+    def test_discard(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "protocol.md")
+            with self.assertRaises(ValueError):
+                with SectionWriter(filename) as writer:
+                    self.write_sections(writer)
+                    raise ValueError()
+            assert writer.sink.closed
+            assert not os.path.exists(filename)
+            # Discarding a closed writer keeps its file
+            with SectionWriter(filename) as writer:
+                self.write_sections(writer)
+            writer.discard()
+            assert os.path.exists(filename)
+
+    def test_failed_execution(self):
+        protocol, doc = initialize_protocol()
+        plate = protocol.primitive_step(
+            "EmptyContainer",
+            specification=labop.ContainerSpec(
+                "plate",
+                name="plate",
+                queryString="cont:Plate96Well",
+                prefixMap={
+                    "cont": "https://sift.net/container-ontology/container-ontology#"
+                },
+            ),
+        )
+        wells = protocol.primitive_step(
+            "PlateCoordinates", source=plate.output_pin("samples"), coordinates="A1"
+        ).output_pin("samples")
+        # The OT2 specialization fails on a Transfer that names no pipette
+        protocol.primitive_step(
+            "Transfer",
+            source=wells,
+            destination=wells,
+            amount=sbol3.Measure(10, tyto.OM.microliter),
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "protocol")
+            specializations = [
+                OT2Specialization(filename),
+                MarkdownSpecialization("markdown.md"),
+            ]
+            ee = ExecutionEngine(
+                out_dir=tmpdir, specializations=specializations, failsafe=False
+            )
+            with self.assertRaises(KeyError):
+                ee.execute(protocol, sbol3.Agent("test_agent"), id="test_execution")
+            assert specializations[0].script_writer.sink.closed
+            assert sorted(os.listdir(tmpdir)) == []
+
+    def test_markdown_file(self):
+        protocol, doc = initialize_protocol()
+        protocol.primitive_step(
+            "EmptyContainer",
+            specification=labop.ContainerSpec(
+                "plate",
+                name="plate",
+                queryString="cont:Plate96Well",
+                prefixMap={
+                    "cont": "https://sift.net/container-ontology/container-ontology#"
+                },
+            ),
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            specialization = MarkdownSpecialization("markdown.md")
+            ee = ExecutionEngine(
+                out_dir=tmpdir, specializations=[specialization], failsafe=False
+            )
+            execution = ee.execute(
+                protocol, sbol3.Agent("test_agent"), id="test_execution"
+            )
+            filename = os.path.join(tmpdir, "markdown.md")
+            with open(filename) as f:
+                markdown = f.read()
+            assert execution.markdown == markdown
+            assert specialization.data == markdown
+            # The markdown is only read from the file when it is used
+            with open(filename, "a") as f:
+                f.write("Edited\n")
+            assert execution.markdown == markdown + "Edited\n"
+            execution.markdown = "# Replaced\n"
+            assert execution.markdown == "# Replaced\n"
+
+    def test_placeholders(self):
+        writer = SectionWriter(io.StringIO())
+        writer.placeholder("materials")
+        with self.assertRaises(ValueError):
+            writer.placeholder("materials")
+        with self.assertRaises(KeyError):
+            writer.fill("steps", "")
+
+
+if __name__ == "__main__":
+    unittest.main()
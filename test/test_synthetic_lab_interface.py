@@ -0,0 +1,123 @@
+import tempfile
+import unittest
+
+import numpy as np
+import sbol3
+from tyto import OM
+
+import labop
+from labop.execution_engine import ExecutionEngine
+from labop.lab_interface import LabInterface, get_lab_interface, set_lab_interface
+from labop.synthetic_lab_interface import (
+    DilutionSeries,
+    GrowthCurve,
+    NoiseModel,
+    SyntheticLabInterface,
+)
+from labop.utils.helpers import initialize_protocol
+from labop_convert.plate_coordinates import get_sample_list
+
+
+class TestSyntheticLabInterface(unittest.TestCase):
+    def setUp(self):
+        self.samples = get_sample_list("A1:H12")
+
+    def read(self, serialized):
+        return labop.deserialize_sample_format(serialized).sel(
+            {labop.Strings.SAMPLE: self.samples}
+        )
+
+    def test_seeded(self):
+        reads = [
+            self.read(
+                SyntheticLabInterface(seed=seed).measure_absorbance(
+                    self.samples, 600, labop.Strings.XARRAY
+                )
+            )
+            for seed in [1, 1, 2]
+        ]
+        assert np.array_equal(reads[0], reads[1])
+        assert not np.array_equal(reads[0], reads[2])
+
+    def test_growth_curve(self):
+        lab = SyntheticLabInterface(absorbance=GrowthCurve(variation=0.0))
+        reads = np.stack(
+            [
+                self.read(
+                    lab.measure_absorbance(
+                        self.samples,
+                        600,
+                        labop.Strings.XARRAY,
+                        time=sbol3.Measure(t, OM.hour),
+                    )
+                ).values
+                for t in [0, 4, 8, 24]
+            ]
+        )
+        means = reads.mean(axis=1)
+        assert np.all(np.diff(means) > 0)
+        assert np.isclose(means[0], 0.05, atol=0.01)
+        assert np.isclose(means[-1], 1.04, atol=0.02)
+
+    def test_dilution_series(self):
+        lab = SyntheticLabInterface(
+            fluorescence=DilutionSeries(top=1024.0),
+            noise=NoiseModel(additive=0.0, proportional=0.0),
+        )
+        reads = self.read(
+            lab.measure_fluorescence(self.samples, 488, 530, 30, labop.Strings.XARRAY)
+        )
+        row_a = reads.sel({labop.Strings.SAMPLE: get_sample_list("A1:A12")})
+        assert row_a.values.tolist() == [1024.0 / 2**c for c in range(11)] + [0.0]
+
+    def test_spectrum(self):
+        lab = SyntheticLabInterface(noise=NoiseModel(0.0, 0.0))
+        spectra = self.read(
+            lab.measure_fluorescence_spectrum(self.samples, 488, labop.Strings.XARRAY)
+        )
+        peaks = spectra[labop.Strings.EMISSION_WAVELENGTH][
+            spectra.argmax(labop.Strings.EMISSION_WAVELENGTH)
+        ]
+        assert np.all(peaks[:88] == 518.0)
+
+    def test_kinetic_execution(self):
+        protocol, doc = initialize_protocol()
+        plate = protocol.primitive_step(
+            "EmptyContainer", specification=labop.ContainerSpec("deep96")
+        )
+        measure = protocol.primitive_step(
+            "MeasureAbsorbance",
+            samples=plate.output_pin("samples"),
+            wavelength=sbol3.Measure(600, OM.nanometer),
+            timepoints=[sbol3.Measure(t, OM.minute) for t in [0, 120, 240]],
+        )
+        protocol.designate_output(
+            "measurements",
+            "http://bioprotocols.org/labop#Dataset",
+            source=measure.output_pin("measurements"),
+        )
+        previous = set_lab_interface(SyntheticLabInterface(seed=3))
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                ee = ExecutionEngine(
+                    use_ordinal_time=True, out_dir=tmpdir, failsafe=False
+                )
+                execution = ee.execute(
+                    protocol,
+                    sbol3.Agent("test_agent"),
+                    id="test_execution",
+                    parameter_values=[],
+                )
+        finally:
+            set_lab_interface(previous)
+        assert type(get_lab_interface()) is LabInterface
+        [(provenance, _)] = execution.iter_data()
+        reads = execution.document.find(provenance["data"]).data.to_data_array()
+        assert reads.sizes == {labop.Strings.TIME: 3, labop.Strings.SAMPLE: 96}
+        assert not reads.isnull().any()
+        means = reads.mean(labop.Strings.SAMPLE).values
+        assert np.all(np.diff(means) > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import json
+import os
+import re
+import tempfile
+import unittest
+
+import sbol3
+import tyto
+
+import labop
+from labop.execution_engine import ExecutionEngine
+from labop.utils.helpers import initialize_protocol
+from labop_convert.opentrons.opentrons_specialization import (
+    REVERSE_LABWARE_MAP,
+    OT2Specialization,
+)
+from labop_convert.opentrons.tip_planning import TipPlanner
+
+PREFIX_MAP = json.dumps(
+    {"cont": "https://sift.net/container-ontology/container-ontology#"}
+)
+
+
+class TestTipPlanning(unittest.TestCase):
+    def test_reuse_tips(self):
+        planner = TipPlanner()
+        planner.fill("tubes['A1']", "buffer")
+        planner.fill("tubes['A2']", "buffer")
+        planner.fill("tubes['B1']", "dye")
+
+        lines = []
+        for source, destination in [
+            ("tubes['A1']", "plate['A1']"),
+            ("tubes['A2']", "plate['A2']"),
+            ("tubes['B1']", "plate['A3']"),
+            ("tubes['A1']", "plate['A4']"),
+            # Touches the dye in A3, so the tip must not go back to the buffer
+            ("tubes['A1']", "plate['A3']"),
+            ("tubes['A1']", "plate['A5']"),
+        ]:
+            lines += planner.liquid_handling(
+                "p300", [source], [[destination]], f"transfer {destination}"
+            )
+        lines += planner.drop_tips()
+
+        assert lines == [
+            "p300.pick_up_tip()",
+            "transfer plate['A1']",
+            "transfer plate['A2']",
+            "p300.drop_tip()",
+            "p300.pick_up_tip()",
+            "transfer plate['A3']",
+            "p300.drop_tip()",
+            "p300.pick_up_tip()",
+            "transfer plate['A4']",
+            "transfer plate['A3']",
+            "p300.drop_tip()",
+            "p300.pick_up_tip()",
+            "transfer plate['A5']",
+            "p300.drop_tip()",
+        ]
+        assert planner.tips["p300"] == 4
+        assert planner.racks("p300") == 1
+
+    def test_mix(self):
+        planner = TipPlanner()
+        planner.fill("tubes['A1']", "buffer")
+        lines = planner.liquid_handling(
+            "p300", ["tubes['A1']"], [["plate['A1']"]], "transfer plate['A1']"
+        )
+        # The tip only touched the buffer, so it is kept for mixing the buffer
+        lines += planner.mix("p300", ["plate['A1']"], "mix plate['A1']")
+        # Mixing needs a tip, even if the pipette does not hold one
+        lines += planner.drop_tips()
+        lines += planner.mix("p300", ["plate['A1']"], "mix plate['A1']")
+        # A well holding something else gets a new tip
+        lines += planner.mix("p300", ["plate['A2']"], "mix plate['A2']")
+        lines += planner.drop_tips()
+
+        assert lines == [
+            "p300.pick_up_tip()",
+            "transfer plate['A1']",
+            "mix plate['A1']",
+            "p300.drop_tip()",
+            "p300.pick_up_tip()",
+            "mix plate['A1']",
+            "p300.drop_tip()",
+            "p300.pick_up_tip()",
+            "mix plate['A2']",
+            "p300.drop_tip()",
+        ]
+
+    def test_ot2_script(self):
+        protocol, doc = initialize_protocol()
+        specs = {
+            name: labop.ContainerSpec(
+                name,
+                name=name,
+                queryString=REVERSE_LABWARE_MAP[api_name],
+                prefixMap=PREFIX_MAP,
+            )
+            for name, api_name in [
+                ("plate", "corning_96_wellplate_360ul_flat"),
+                ("tips", "opentrons_96_tiprack_300ul"),
+            ]
+        }
+        plate = protocol.primitive_step("EmptyContainer", specification=specs["plate"])
+        protocol.primitive_step(
+            "LoadRackOnInstrument", rack=specs["plate"], coordinates="1"
+        )
+        protocol.primitive_step(
+            "LoadRackOnInstrument", rack=specs["tips"], coordinates="2"
+        )
+        p300 = sbol3.Agent("p300_single", name="P300 Single")
+        doc.add(p300)
+        protocol.primitive_step("ConfigureRobot", instrument=p300, mount="left")
+
+        def wells(coordinates):
+            return protocol.primitive_step(
+                "PlateCoordinates",
+                source=plate.output_pin("samples"),
+                coordinates=coordinates,
+            ).output_pin("samples")
+
+        for source, destination in [("A1", "B1:B6"), ("A2", "C1"), ("A1", "C2")]:
+            protocol.primitive_step(
+                "Transfer",
+                source=wells(source),
+                destination=wells(destination),
+                amount=sbol3.Measure(20, tyto.OM.microliter),
+                pipette="left",
+            )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "tip_planning")
+            ee = ExecutionEngine(
+                use_ordinal_time=True,
+                out_dir=tmpdir,
+                specializations=[OT2Specialization(filename)],
+                failsafe=False,
+            )
+            ee.execute(
+                protocol,
+                sbol3.Agent("test_agent"),
+                id="test_execution",
+                parameter_values=[],
+            )
+            with open(filename + ".py") as f:
+                script = f.read()
+            with open(filename + ".md") as f:
+                markdown = f.read()
+
+        assert script.count("p300_single.transfer(") == 8
+        assert script.count("new_tip='never'") == 8
+        assert script.count("p300_single.pick_up_tip()") == 3
+        assert script.count("p300_single.drop_tip()") == 3
+        assert script.rstrip().endswith("p300_single.drop_tip()")
+        assert "* 1 tip rack for `p300_single` (3 tips)" in markdown
+        assert re.search(r"Estimated run time: \d+ min", markdown)
+
+
+if __name__ == "__main__":
+    unittest.main()
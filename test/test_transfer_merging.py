@@ -0,0 +1,258 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import sbol3
+import tyto
+
+import labop
+import uml
+from labop.execution_engine import ExecutionEngine
+from labop.utils.helpers import initialize_protocol
+from labop_convert import MarkdownSpecialization, PlateStateSpecialization
+
+
+class TestTransferMerging(unittest.TestCase):
+    def make_protocol(
+        self,
+        transfers=[
+            ("A1", 1, 50),
+            ("A1", 2, 50),
+            ("B1", 3, 50),
+            ("A1", 4, 50),
+            ("A1", 5, 100),
+        ],
+        provision=True,
+        interleaved=False,
+        shared_source=True,
+    ):
+        """
+        Make a protocol with the transfers (source well, destination column,
+        microliters) from a reagent plate into an assay plate.  The
+        PlateCoordinates selecting the wells are made before all of the
+        transfers, unless interleaved, in which case each transfer follows
+        those selecting its wells (and, unless shared_source, its own
+        selection of its source well).
+        """
+        protocol, doc = initialize_protocol()
+        plates = [
+            protocol.primitive_step(
+                "EmptyContainer",
+                specification=labop.ContainerSpec(
+                    name,
+                    name=name,
+                    queryString="cont:Plate96Well",
+                    prefixMap={
+                        "cont": "https://sift.net/container-ontology/container-ontology#"
+                    },
+                ),
+            )
+            for name in ["reagents", "assay"]
+        ]
+
+        def select(plate, coordinates):
+            return protocol.primitive_step(
+                "PlateCoordinates",
+                source=plates[plate].output_pin("samples"),
+                coordinates=coordinates,
+            ).output_pin("samples")
+
+        wells = {}
+        for plate, coordinates in [(0, "A1"), (0, "B1")] + [
+            (1, f"A{column}:H{column}") for column in range(1, 6)
+        ]:
+            if not interleaved or (
+                shared_source and coordinates in {t[0] for t in transfers}
+            ):
+                wells[coordinates] = select(plate, coordinates)
+        if provision:
+            dye = sbol3.Component(
+                "dye", "https://identifiers.org/pubchem.substance:24901740"
+            )
+            doc.add(dye)
+        for source in ["A1", "B1"] if provision else []:
+            protocol.primitive_step(
+                "Provision",
+                resource=dye,
+                destination=wells[source],
+                amount=sbol3.Measure(5000, tyto.OM.microliter),
+            )
+
+        return protocol, [
+            protocol.primitive_step(
+                "Transfer",
+                source=wells[source] if source in wells else select(0, source),
+                destination=(
+                    wells[f"A{column}:H{column}"]
+                    if f"A{column}:H{column}" in wells
+                    else select(1, f"A{column}:H{column}")
+                ),
+                amount=sbol3.Measure(amount, tyto.OM.microliter),
+            )
+            for source, column, amount in transfers
+        ]
+
+    def execute(self, protocol, out_dir, specializations):
+        ee = ExecutionEngine(
+            use_ordinal_time=True,
+            out_dir=out_dir,
+            specializations=specializations,
+            failsafe=False,
+        )
+        ee.execute(
+            protocol,
+            sbol3.Agent("test_agent"),
+            id="test_execution",
+            parameter_values=[],
+        )
+
+    def control_sequence(self, protocol):
+        """Get the nodes of a protocol in control flow order"""
+        nodes = [protocol.get_last_step()]
+        while protocol.incoming_edges(nodes[0]):
+            [flow] = [
+                e
+                for e in protocol.incoming_edges(nodes[0])
+                if isinstance(e, uml.ControlFlow)
+            ]
+            nodes.insert(0, flow.source.lookup())
+        return nodes
+
+    def behaviors(self, nodes):
+        return [
+            n.behavior.lookup().display_id
+            for n in nodes
+            if isinstance(n, uml.CallBehaviorAction)
+        ]
+
+    def coordinates(self, protocol):
+        """Get the coordinates selected by the PlateCoordinates of a protocol"""
+        return sorted(
+            n.input_pin("coordinates").value.get_value()
+            for n in protocol.nodes
+            if isinstance(n, uml.CallBehaviorAction)
+            and n.behavior.lookup().display_id == "PlateCoordinates"
+        )
+
+    def test_merge_transfers(self):
+        protocol, transfers = self.make_protocol()
+        n_warnings = len(protocol.validate().warnings)
+        report = protocol.merge_transfers()
+
+        [(dispense, merged)] = report.dispenses.items()
+        assert merged == [transfers[i].identity for i in [0, 1, 3]]
+        assert report.seconds_saved > 0
+        assert report.seconds_after < report.seconds_before / 4
+        validation = protocol.validate()
+        assert not validation.errors
+        assert len(validation.warnings) <= n_warnings
+
+        # The PlateCoordinates that selected the merged destinations are removed
+        assert self.coordinates(protocol) == [
+            "A1",
+            "A1:H1,A2:H2,A4:H4",
+            "A3:H3",
+            "A5:H5",
+            "B1",
+        ]
+
+        # Transfers are reordered to follow the Dispense
+        nodes = self.control_sequence(protocol)
+        assert self.behaviors(nodes)[-4:] == [
+            "PlateCoordinates",
+            "Dispense",
+            "Transfer",
+            "Transfer",
+        ]
+        assert nodes[-3].identity == dispense
+        assert [n.identity for n in nodes[-2:]] == [
+            transfers[2].identity,
+            transfers[4].identity,
+        ]
+
+    def test_interleaved(self):
+        # Each transfer follows the PlateCoordinates selecting its wells, with
+        # the source well selected once or before each transfer
+        for shared_source in [True, False]:
+            protocol, transfers = self.make_protocol(
+                [("A1", 1, 50), ("A1", 2, 50), ("A1", 3, 50)],
+                provision=False,
+                interleaved=True,
+                shared_source=shared_source,
+            )
+            report = protocol.merge_transfers()
+
+            [(dispense, merged)] = report.dispenses.items()
+            assert merged == [t.identity for t in transfers]
+            assert not protocol.validate().errors
+            assert self.coordinates(protocol) == ["A1", "A1:H1,A2:H2,A3:H3"]
+            nodes = self.control_sequence(protocol)
+            assert self.behaviors(nodes)[-3:] == [
+                "PlateCoordinates",
+                "PlateCoordinates",
+                "Dispense",
+            ]
+            assert nodes[-1].identity == dispense
+
+            with tempfile.TemporaryDirectory() as tmpdir:
+                filename = os.path.join(tmpdir, "protocol.md")
+                self.execute(protocol, tmpdir, [MarkdownSpecialization(filename)])
+                with open(filename) as f:
+                    markdown = f.read()
+            assert "Dispense 50.0 microliter from well A1 of `reagents`" in markdown
+
+    def test_interleaved_used_elsewhere(self):
+        # PlateCoordinates that are also used after the transfers stay where
+        # they are, and the transfers on either side are merged separately
+        protocol, transfers = self.make_protocol(
+            [("A1", 1, 50), ("A1", 2, 50), ("A1", 3, 50)],
+            provision=False,
+            interleaved=True,
+        )
+        destination = protocol.flow_source(
+            next(iter(transfers[1].input_pins("destination")))
+        )
+        protocol.primitive_step(
+            "MeasureAbsorbance",
+            samples=destination,
+            wavelength=sbol3.Measure(600, tyto.OM.nanometer),
+        )
+        report = protocol.merge_transfers()
+
+        [(_, merged)] = report.dispenses.items()
+        assert merged == [transfers[1].identity, transfers[2].identity]
+        assert not protocol.validate().errors
+        assert self.coordinates(protocol) == ["A1", "A1:H1", "A2:H2", "A2:H2,A3:H3"]
+
+    def test_simulate(self):
+        original = PlateStateSpecialization()
+        merged = PlateStateSpecialization()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            protocol, _ = self.make_protocol()
+            self.execute(protocol, tmpdir, [original])
+            protocol, _ = self.make_protocol()
+            protocol.merge_transfers()
+            self.execute(protocol, tmpdir, [merged])
+
+        assert len(merged.steps) < len(original.steps)
+        for plate in original.wells:
+            assert np.allclose(
+                original.container_state(plate), merged.container_state(plate)
+            )
+
+    def test_markdown(self):
+        protocol, _ = self.make_protocol(
+            [("A1", 1, 50), ("A1", 2, 50)], provision=False
+        )
+        protocol.merge_transfers()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "protocol.md")
+            self.execute(protocol, tmpdir, [MarkdownSpecialization(filename)])
+            with open(filename) as f:
+                markdown = f.read()
+        assert "Dispense 50.0 microliter from well A1 of `reagents`" in markdown
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -705,6 +705,31 @@ def activity_deconflict_objectflow_sources(self, source: ActivityNode) -> Activi
 Activity.deconflict_objectflow_sources = activity_deconflict_objectflow_sources
 
 
+def activity_flow_source(self, target: ActivityNode) -> ActivityNode:
+    """Find the node that provides the values of a node over ObjectFlows, looking past any ForkNodes
+
+    Parameters
+    ----------
+    self: Activity
+    target: node (typically an InputPin) taking values
+
+    Returns
+    -------
+    The source node, or None if there is not exactly one incoming ObjectFlow along the way
+    """
+    while True:
+        flows = [e for e in self.incoming_edges(target) if isinstance(e, ObjectFlow)]
+        if len(flows) != 1:
+            return None
+        source = flows[0].source.lookup()
+        if not isinstance(source, ForkNode):
+            return source
+        target = source
+
+
+Activity.flow_source = activity_flow_source  # Add to class via monkey patch
+
+
 def activity_call_behavior(self, behavior: Behavior, **input_pin_map):
     """Call a Behavior as an Action in an Activity
 